@@ -0,0 +1,79 @@
+"""Benchmark of saving and opening a `pflacs` study as JSON with each of
+the available serializers (`json`, and `orjson` if it is installed).
+
+Run from the repository root:
+    python benchmarks/bench_json.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pflacs import Premise, Calc, Table
+from pflacs import serializers
+
+
+def pipe_hoop_stress(P, D, t):
+    return P * D / 2 / t
+
+
+def allowable_stress_unity_check(sigma, allowable, df=0.72):
+    return sigma / allowable * df
+
+
+def build_study(nlc=2000):
+    """Study with `4*nlc` nodes, each load case has two calculations and
+    a results table."""
+    basecase = Premise("Pipe study base case.",
+                    parameters={
+                        "ys": 22.1 * 10**6,
+                        "D": 110 * 10**-3,
+                        "P": 20 * 10**5,
+                        "t": 5 * 10**-3,
+                        "design_factor": 0.8,
+                    })
+    basecase.plugin_func(pipe_hoop_stress)
+    basecase.plugin_func(allowable_stress_unity_check)
+    for ii in range(nlc):
+        _lc = Premise("LoadCase{}".format(ii), basecase,
+                        parameters={"P": (10 + ii) * 10**5})
+        _pstress = Calc("Calc pipe stress", _lc, funcname="pipe_hoop_stress")
+        _unity = Calc("Stress unity check", _pstress,
+                        funcname="allowable_stress_unity_check",
+                        argmap={"sigma": "_pipe_hoop_stress",
+                                "allowable": "ys",
+                                "df": "design_factor"})
+        Table("results", _unity, paranames=["P", "_pipe_hoop_stress",
+                                    "_allowable_stress_unity_check"])
+    basecase.update()
+    return basecase
+
+
+def best_time(func, repeat=5):
+    _best = None
+    for _ in range(repeat):
+        _t0 = time.perf_counter()
+        func()
+        _dt = time.perf_counter() - _t0
+        _best = _dt if _best is None else min(_best, _dt)
+    return _best
+
+
+def bench(nlc=2000):
+    study = build_study(nlc)
+    results = {}
+    with tempfile.TemporaryDirectory() as _tmpdir:
+        for name in sorted(serializers.SERIALIZERS):
+            _fpath = os.path.join(_tmpdir, "study.{}.json".format(name))
+            _save = best_time(lambda: study.to_json(_fpath, serializer=name))
+            _open = best_time(lambda: Premise.from_json(_fpath, serializer=name))
+            results[name] = (_save, _open)
+    return results
+
+
+if __name__ == "__main__":
+    results = bench()
+    for name, (save, open_) in results.items():
+        print("{:>6s}: save {:8.3f} s, open {:8.3f} s".format(name, save, open_))
@@ -0,0 +1,77 @@
+"""Benchmark of the load time and peak memory of opening a `pflacs` study.
+
+Compares `Premise.openfile`, which adopts the un-pickled treedict, with
+building the tree from the same treedict with copies of the node data
+(the path used before `openfile` adopted the treedict).
+
+Run from the repository root:
+    python benchmarks/bench_load.py
+"""
+import os
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pflacs import Premise, Calc
+
+
+def pipe_hoop_stress(P, D, t):
+    return P * D / 2 / t
+
+
+def build_study(nlc=5000, npoints=100):
+    """Study with `2*nlc` nodes, each load case has a pressure profile."""
+    basecase = Premise("Pipe study base case.",
+                    parameters={
+                        "D": 110 * 10**-3,
+                        "P": 20 * 10**5,
+                        "t": 5 * 10**-3,
+                    })
+    basecase.plugin_func(pipe_hoop_stress)
+    for ii in range(nlc):
+        _lc = Premise("LoadCase{}".format(ii), basecase,
+                        parameters={"P": np.linspace(10, 20, npoints) * 10**5})
+        Calc("Calc pipe stress", _lc, funcname="pipe_hoop_stress")
+    basecase.update()
+    return basecase
+
+
+def measure(func):
+    tracemalloc.start()
+    _t0 = time.perf_counter()
+    _root = func()
+    _dt = time.perf_counter() - _t0
+    _peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return _root, _dt, _peak
+
+
+def bench(nlc=5000):
+    study = build_study(nlc)
+    with tempfile.TemporaryDirectory() as _tmpdir:
+        _fpath = os.path.join(_tmpdir, "study.vn3")
+        study.savefile(_fpath)
+
+        def _copy():
+            with open(_fpath, "rb") as _fh:
+                return Premise(treedict=pickle.load(_fh))
+
+        results = {}
+        for label, func in (("copy", _copy),
+                            ("adopt", lambda: Premise.openfile(_fpath))):
+            _root, _dt, _peak = measure(func)
+            assert len(list(_root)) == 2 * nlc + 1
+            results[label] = (_dt, _peak)
+    return results
+
+
+if __name__ == "__main__":
+    results = bench()
+    for label, (dt, peak) in results.items():
+        print("{:>6s}: {:8.3f} s, peak memory {:8.1f} MB".format(label, dt, peak / 2**20))
@@ -0,0 +1,70 @@
+"""Micro-benchmark of the per-call overhead of `pflacs` plugin functions.
+
+Compares a Calc node calling its plugin function through a cached call
+plan with the same call bound by signature inspection (the path used
+before call plans, still used for functions with *args or **kwargs).
+
+Run from the repository root:
+    python benchmarks/bench_pflacsfunc_call.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pflacs import Premise, Calc
+
+
+def pipe_hoop_stress(P, D, t):
+    return P * D / 2 / t
+
+
+def allowable_stress_unity_check(sigma, allowable, df=0.72):
+    return sigma / allowable * df
+
+
+def build_study(depth=10):
+    basecase = Premise("Pipe study base case.",
+                    parameters={
+                        "ys": 22.1 * 10**6,
+                        "D": 110 * 10**-3,
+                        "P": 20 * 10**5,
+                        "t": 5 * 10**-3,
+                        "design_factor": 0.8,
+                    })
+    basecase.plugin_func(pipe_hoop_stress)
+    basecase.plugin_func(allowable_stress_unity_check)
+    node = basecase
+    for ii in range(depth):
+        node = Premise("level {}".format(ii), parent=node)
+    pstress = Calc("Calc pipe stress", node, funcname="pipe_hoop_stress")
+    unity = Calc("Stress unity check", pstress,
+                    funcname="allowable_stress_unity_check",
+                    argmap={"sigma": "_pipe_hoop_stress",
+                            "allowable": "ys",
+                            "df": "design_factor"})
+    return basecase, pstress, unity
+
+
+def bench(number=20000, repeat=5):
+    basecase, pstress, unity = build_study()
+    pstress()
+    _pfunc = Premise.__dict__["allowable_stress_unity_check"]
+    results = {}
+    for label, plannable in (("inspect/bind", False), ("call plan", True)):
+        _pfunc._plannable = plannable
+        _pfunc._plans.clear()
+        unity()
+        _t = min(timeit.repeat(unity, number=number, repeat=repeat))
+        results[label] = _t / number * 1e6
+    _pfunc._plannable = True
+    return results
+
+
+if __name__ == "__main__":
+    results = bench()
+    for label, usec in results.items():
+        print("{:>14s}: {:8.2f} µs per Calc call".format(label, usec))
+    print("{:>14s}: {:8.2f}x".format("speed-up",
+            results["inspect/bind"] / results["call plan"]))
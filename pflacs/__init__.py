@@ -1,5 +1,7 @@
 """`pflacs` means faster load-cases and parameter studies.
 """
-from .pflacs import Premise, PflacsParam, Calc, Table, _empty
+from .pflacs import Premise, PflacsParam, Calc, Table, SweepCalc, _empty
 from .subprocess_node import SubProc
 from .pyfunc_node import PyFunc
+from .calcgraph import CalcGraph
+from .results import ResultStore
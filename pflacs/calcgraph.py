@@ -0,0 +1,208 @@
+"""Dependency graph and scheduler for `pflacs` calculation nodes.
+"""
+import concurrent.futures
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+from .pflacs import Calc, Table
+
+
+class CalcGraph:
+    """Dependency graph of the calculation nodes in a `pflacs` tree.
+
+    The dependencies are derived from the `Calc` function arguments
+    (after applying the `argmap`), the `Table` parameter names and the
+    names of the results (the «return» argmap entry, or the «internal»
+    params written by a previous call).  A calculation depends on the
+    nearest `Calc` ancestor producing a parameter that it reads, and on
+    the `Calc` producing a linked (`linkid`) parameter.
+
+    :param root: root node of the (sub-)tree.
+    :type root: Premise
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.nodes = [_n for _n in root if isinstance(_n, Calc)]
+        self.inputs = {}
+        self.outputs = {}
+        self.edges = {_n: [] for _n in self.nodes}   # node: dependants
+        self.durations = {}
+        for _n in self.nodes:
+            self.inputs[_n], self.outputs[_n] = self._node_io(_n)
+        _nodes = set(self.nodes)
+        for _n in self.nodes:
+            for _dep in self._depends_on(_n, _nodes):
+                if _n not in self.edges[_dep]:
+                    self.edges[_dep].append(_n)
+
+
+    @staticmethod
+    def _node_io(node):
+        """Return `(inputs, outputs)` parameter names of a calculation node,
+        `outputs` is `None` if they cannot be determined before a call."""
+        _inputs = set()
+        _outputs = set()
+        if isinstance(node, Table):
+            return set(node._param_reads()), _outputs
+        _func = getattr(node, node._funcname, None) if isinstance(node._funcname, str) else None
+        _pfunc = getattr(_func, "__func__", None)
+        if _pfunc is None:
+            return _inputs, _outputs
+        _argmap = _pfunc._applied_argmap(node)
+        _kwargs = node._kwargs or {}
+        for _argname in _pfunc._sig.parameters:
+            _pname = _argmap.get(_argname, _argname)
+            if _pname in _kwargs or _argname in _kwargs:
+                continue
+            _inputs.add(_pname)
+        _retspec = _pfunc._parse_return(_argmap.get("return", None))
+        if _retspec is None:
+            _outputs.add("_" + _pfunc.name)
+        elif isinstance(_retspec, str):
+            _outputs.add(_retspec)
+        elif isinstance(_retspec, tuple):
+            _outputs.update(_retspec)
+        elif isinstance(_retspec, dict):
+            # result keys not in the mapping are only known after a call
+            _outputs.update(_retspec.values())
+            if not node._internals:
+                _outputs = None
+        if _outputs is not None:
+            _outputs.update(node._internals or ())
+        return _inputs, _outputs
+
+
+    def _depends_on(self, node, nodes):
+        _deps = []
+        for _name in self.inputs[node]:
+            _n = node
+            while _n is not None:
+                if _n is not node and _n in nodes:
+                    _outputs = self.outputs[_n]
+                    if _outputs is None or _name in _outputs:
+                        _deps.append(_n)
+                        if _outputs is not None:
+                            break
+                _pdict = _n.data["params"].get(_name)
+                if _n is node and _name in (self.outputs[node] or ()):
+                    _pdict = None  # the node's own result
+                if _pdict is not None:
+                    if isinstance(_pdict, dict) and _pdict.get("linkid"):
+                        _linked = _n._tcache.get_node(_pdict["linkid"])
+                        if _linked in nodes and _linked is not node:
+                            _deps.append(_linked)
+                    break
+                _n = _n.parent
+        return _deps
+
+
+    def adjacency(self, key="path"):
+        """Return the graph as an adjacency dict `{node: [dependants]}`.
+
+        :param key: node key, `"path"` for `node._path`, `"nodeid"` for
+            `node._nodeid`, `None` for the nodes, or a function of the node.
+        :type key: str or function or None
+        :returns: adjacency dict.
+        :rtype: dict
+        """
+        if key == "path":
+            key = lambda n: n._path
+        elif key == "nodeid":
+            key = lambda n: n._nodeid
+        elif key is None:
+            key = lambda n: n
+        return {key(_n): [key(_d) for _d in _deps] for _n, _deps in self.edges.items()}
+
+
+    def levels(self):
+        """Return the nodes grouped in topological levels; the nodes in a
+        level depend only on nodes in earlier levels."""
+        _indegree = self._indegree()
+        _level = [_n for _n in self.nodes if _indegree[_n] == 0]
+        _levels = []
+        while _level:
+            _levels.append(_level)
+            _next = []
+            for _n in _level:
+                for _d in self.edges[_n]:
+                    _indegree[_d] -= 1
+                    if _indegree[_d] == 0:
+                        _next.append(_d)
+            _level = _next
+        if sum(len(_l) for _l in _levels) != len(self.nodes):
+            raise ValueError("{}.levels: dependency cycle in graph.".format(self.__class__.__name__))
+        return _levels
+
+
+    def critical_path(self, durations=None):
+        """Return the longest chain of dependent calculations.
+
+        :param durations: node durations, by default the durations from
+            the last `run`, or 1 for each node if the graph has not been run.
+        :type durations: dict or None
+        :returns: `(list of nodes, total duration)`
+        :rtype: tuple
+        """
+        if durations is None:
+            durations = self.durations
+        _cost = {}
+        _prev = {}
+        for _level in self.levels():
+            for _n in _level:
+                _cost[_n] = _cost.get(_n, 0) + durations.get(_n, 1)
+                for _d in self.edges[_n]:
+                    if _cost[_n] > _cost.get(_d, 0):
+                        _cost[_d] = _cost[_n]
+                        _prev[_d] = _n
+        if not _cost:
+            return [], 0
+        _n = max(_cost, key=_cost.get)
+        _total = _cost[_n]
+        _path = [_n]
+        while _n in _prev:
+            _n = _prev[_n]
+            _path.insert(0, _n)
+        return _path, _total
+
+
+    def run(self, workers=None):
+        """Call every calculation node as soon as the nodes it depends on
+        have been called, in a thread pool.  The call durations are
+        recorded in `durations`.
+
+        :param workers: maximum number of threads.
+        :type workers: int or None
+        """
+        self.levels()  # check for cycles
+        _indegree = self._indegree()
+        self.durations = {}
+
+        def _call(node):
+            _t0 = time.perf_counter()
+            node()
+            self.durations[node] = time.perf_counter() - _t0
+            return node
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as _pool:
+            _pending = {_pool.submit(_call, _n) for _n in self.nodes if _indegree[_n] == 0}
+            while _pending:
+                _done, _pending = concurrent.futures.wait(_pending,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+                for _fut in _done:
+                    _n = _fut.result()
+                    for _d in self.edges[_n]:
+                        _indegree[_d] -= 1
+                        if _indegree[_d] == 0:
+                            _pending.add(_pool.submit(_call, _d))
+        return True
+
+
+    def _indegree(self):
+        _indegree = {_n: 0 for _n in self.nodes}
+        for _deps in self.edges.values():
+            for _d in _deps:
+                _indegree[_d] += 1
+        return _indegree
@@ -0,0 +1,131 @@
+"""Columnar export of the results of a `pflacs` study to a Parquet or
+Arrow (IPC/Feather) file, see `Premise.export_results`.  Requires `pyarrow`.
+
+Each column has a single Arrow type, from the values in all the rows:
+`bool`, `int64` and `float64` for numeric scalars (mixed numeric values
+are converted to the wider type), `string`, and `list<float64>` for 1-D
+numeric arrays (mixed with numeric scalars, which are written as lists 
+of one value).  Other values, and columns with mixed values, are
+written as strings (`str(value)`).
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError as err:
+    logger.debug("pyarrow not installed, export_results not available: %s" % (err,))
+    pa = None
+
+FORMATS = ("parquet", "arrow")
+
+# numeric kinds, narrowest first
+_NUMERIC = ("bool", "int", "float")
+
+
+def value_kind(value):
+    """Return the column kind of `value`, or `None` for a missing value."""
+    if value is None:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        try:
+            _arr = np.asarray(value)
+        except ValueError:  # ragged
+            return "object"
+        if _arr.ndim == 1 and _arr.dtype.kind in "biuf":
+            return "list"
+    return "object"
+
+
+def merge_kind(kind, other):
+    """Return the column kind for values of `kind` and `other`."""
+    if kind is None or kind == other:
+        return other
+    if other is None:
+        return kind
+    if kind in _NUMERIC and other in _NUMERIC:
+        return max(kind, other, key=_NUMERIC.index)
+    if {kind, other} <= {"list", *_NUMERIC}:
+        return "list"
+    return "object"
+
+
+def _arrow_type(kind):
+    return {
+        "bool": pa.bool_(),
+        "int": pa.int64(),
+        "float": pa.float64(),
+        "str": pa.string(),
+        "list": pa.list_(pa.float64()),
+    }.get(kind, pa.string())
+
+
+def schema(columns):
+    """Return the `pyarrow.Schema` of `columns`, `{name: kind}`."""
+    return pa.schema([(_name, _arrow_type(_kind)) for _name, _kind in columns.items()])
+
+
+def _arrow_values(values, kind):
+    if kind == "list":
+        return [None if _v is None else np.atleast_1d(np.asarray(_v, dtype=float)) 
+                for _v in values]
+    if kind in ("bool", "int", "float", "str"):
+        return values
+    return [None if _v is None else str(_v) for _v in values]
+
+
+class ResultsWriter:
+    """Writer of record batches to a Parquet or Arrow file.
+
+    :param fpath: the file path.
+    :type fpath: str
+    :param columns: `{name: kind}` of the columns, see :func:`value_kind`.
+    :type columns: dict
+    :param format: `"parquet"` or `"arrow"`.
+    :type format: str
+    :param compression: compression codec, e.g. `"zstd"`, `None` for
+        the `pyarrow` default.
+    :type compression: str or None
+    """
+
+    def __init__(self, fpath, columns, format="parquet", compression=None):
+        if pa is None:
+            raise ImportError("export_results requires pyarrow, use «results_to_hdf5» instead.")
+        if format not in FORMATS:
+            raise ValueError("{}: arg «format»=«{}» not in {}.".format(self.__class__.__name__, format, FORMATS))
+        self.columns = columns
+        self.schema = schema(columns)
+        if format == "parquet":
+            _kwargs = {"compression": compression} if compression else {}
+            self._writer = pq.ParquetWriter(fpath, self.schema, **_kwargs)
+        else:
+            _options = pa.ipc.IpcWriteOptions(compression=compression) if compression else None
+            self._writer = pa.ipc.new_file(fpath, self.schema, options=_options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, rows):
+        """Write `rows`, `{name: list of values}`, as a record batch (a
+        Parquet row group)."""
+        _arrays = [pa.array(_arrow_values(rows[_name], _kind), type=_field.type)
+                    for (_name, _kind), _field in zip(self.columns.items(), self.schema)]
+        self._writer.write_batch(pa.RecordBatch.from_arrays(_arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
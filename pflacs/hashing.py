@@ -0,0 +1,132 @@
+"""Content hashes of parameter values, functions and files, for the
+`pflacs` caches.
+
+:func:`digest` hashes values by content: NumPy arrays by their dtype,
+shape and data, `pandas` objects by their values and index, dicts
+independently of the key order.  Other objects are hashed by their
+pickle.
+"""
+import functools
+import hashlib
+import logging
+import pickle
+import types
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_CHUNK = 2**20
+
+
+def digest(*values):
+    """Return the hex digest of `values`."""
+    _hash = hashlib.blake2b(digest_size=20)
+    for _value in values:
+        update(_hash, _value)
+    return _hash.hexdigest()
+
+
+def update(hash, value):
+    """Update `hash` (a `hashlib` object) with the content of `value`."""
+    if value is None or isinstance(value, (bool, int, float, complex)):
+        hash.update(b"s" + repr(value).encode("utf-8"))
+    elif isinstance(value, str):
+        hash.update(b"u%d:" % len(value) + value.encode("utf-8"))
+    elif isinstance(value, bytes):
+        hash.update(b"b%d:" % len(value) + value)
+    elif isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            hash.update(b"O" + repr(value.shape).encode("utf-8"))
+            for _v in value.ravel():
+                update(hash, _v)
+        else:
+            hash.update(b"a" + value.dtype.str.encode("utf-8")
+                        + repr(value.shape).encode("utf-8"))
+            hash.update(np.ascontiguousarray(value).data)
+    elif isinstance(value, np.generic):
+        update(hash, value.item())
+    elif isinstance(value, (list, tuple)):
+        hash.update(b"l%d:" % len(value) if isinstance(value, list) else b"t%d:" % len(value))
+        for _v in value:
+            update(hash, _v)
+    elif isinstance(value, dict):
+        _items = sorted(value.items(), key=lambda _kv: repr(_kv[0]))
+        hash.update(b"d%d:" % len(_items))
+        for _k, _v in _items:
+            update(hash, _k)
+            update(hash, _v)
+    elif isinstance(value, (set, frozenset)):
+        hash.update(b"S%d:" % len(value))
+        for _v in sorted(value, key=repr):
+            update(hash, _v)
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        hash.update(b"p" + repr(value.shape).encode("utf-8"))
+        if isinstance(value, pd.DataFrame):
+            update(hash, [str(_c) for _c in value.columns])
+        update(hash, pd.util.hash_pandas_object(value, index=True).to_numpy())
+    else:
+        hash.update(b"k" + pickle.dumps(value, protocol=4))
+
+
+@functools.lru_cache(maxsize=1024)
+def function_digest(func):
+    """Return the hex digest of function `func`: its module, qualified 
+    name and code (bytecode, constants and names, including those of 
+    nested functions), and the code of the functions it references as 
+    module globals, recursively.  Functions without Python code (e.g. 
+    builtins) are hashed by name.
+
+    Other globals (e.g. constants, or functions referenced as module
+    attributes, `module.func`) are not hashed.  The digests are cached 
+    for the session, call `function_digest.cache_clear()` after reloading
+    a module."""
+    _hash = hashlib.blake2b(digest_size=20)
+    _update_function(_hash, func, set())
+    return _hash.hexdigest()
+
+
+def _update_function(hash, func, seen):
+    _func = getattr(func, "__wrapped__", func)
+    update(hash, (getattr(_func, "__module__", None), 
+                    getattr(_func, "__qualname__", repr(_func))))
+    _code = getattr(_func, "__code__", None)
+    if _code is None:
+        return
+    seen.add(_code)
+    _names = []
+    _update_code(hash, _code, _names)
+    update(hash, _func.__defaults__)
+    update(hash, _func.__kwdefaults__)
+    _globals = getattr(_func, "__globals__", {})
+    for _name in _names:
+        _ref = _globals.get(_name)
+        if isinstance(_ref, types.FunctionType) and _ref.__code__ not in seen:
+            _update_function(hash, _ref, seen)
+
+
+def _update_code(hash, code, names):
+    "hash `code`, the names it uses are added to list `names`"
+    hash.update(code.co_code)
+    update(hash, code.co_names)
+    names.extend(code.co_names)
+    for _const in code.co_consts:
+        if isinstance(_const, types.CodeType):
+            _update_code(hash, _const, names)
+        else:
+            update(hash, _const)
+
+
+def file_digest(fpath):
+    """Return the hex digest of the content of file `fpath`, or `None` if
+    the file does not exist."""
+    _hash = hashlib.blake2b(digest_size=20)
+    try:
+        with open(fpath, "rb") as _fh:
+            for _chunk in iter(lambda: _fh.read(_CHUNK), b""):
+                _hash.update(_chunk)
+    except FileNotFoundError:
+        logger.warning("file_digest: file «%s» not found." % (fpath,))
+        return None
+    return _hash.hexdigest()
@@ -0,0 +1,171 @@
+"""Persistent memoization of the functions called by `pflacs` calculation
+nodes, see `Premise.memoize`.
+
+The results are saved in a SQLite database, keyed by a hash of the
+function (qualified name and code, see :func:`pflacs.hashing.function_digest`)
+and of the argument values (NumPy arrays are hashed by content), so
+that they are reused in later sessions, while neither the function nor
+its inputs change.  Only pure functions (the result depends only on the
+arguments) should be memoized.
+"""
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memo (
+    key TEXT PRIMARY KEY,
+    func TEXT,
+    value BLOB,
+    size INTEGER,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS memo_used ON memo (used);
+"""
+
+
+class MemoCache:
+    """On-disk cache of function results.
+
+    The least recently used results are removed when there are more than
+    `max_entries` results, or their total size is larger than `max_bytes`.
+    The last use of the results found by :meth:`get` is recorded in the
+    database by :meth:`flush`, in one transaction, so that a hit is only
+    a read; it is called by :meth:`evict` and :meth:`close`, and after 
+    `flush_every` hits.
+    `hits` and `misses` count the lookups of this instance.
+
+    :param fpath: path of the SQLite database file.
+    :type fpath: str
+    :param max_entries: maximum number of results.
+    :type max_entries: int
+    :param max_bytes: maximum total size of the (pickled) results.
+    :type max_bytes: int
+    :param flush_every: number of hits recorded before a flush.
+    :type flush_every: int
+    """
+
+    def __init__(self, fpath, max_entries=100000, max_bytes=2**30, 
+                flush_every=1000):
+        self.fpath = fpath
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self._used = {}  # key: last use, not yet in the database
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(fpath, timeout=30.0, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+        self._entries, self._bytes = self.conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM memo").fetchone()
+
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+
+    def get(self, key):
+        """Return `(True, result)` if `key` is cached, otherwise
+        `(False, None)`."""
+        with self._lock:
+            _row = self.conn.execute("SELECT value FROM memo WHERE key=?", (key,)).fetchone()
+            if _row is not None:
+                try:
+                    _value = pickle.loads(_row[0])
+                except Exception as err:
+                    logger.warning("%s.get: result «%s» not valid: %s" % (self.__class__.__name__, key, err))
+                    _row = None
+            if _row is None:
+                self.misses += 1
+                return False, None
+            self._used[key] = time.time()
+            if len(self._used) >= self.flush_every:
+                self.flush()
+            self.hits += 1
+            return True, _value
+
+
+    def flush(self):
+        """Record the last use of the results found by :meth:`get`."""
+        with self._lock:
+            if not self._used:
+                return
+            with self.conn:
+                self.conn.executemany("UPDATE memo SET used=? WHERE key=?",
+                                    [(_t, _k) for _k, _t in self._used.items()])
+            self._used.clear()
+
+
+    def put(self, key, func, value):
+        """Cache `value`, the result of function `func` (qualified name).
+        Returns `False` if the value cannot be pickled."""
+        try:
+            _blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            logger.debug("%s.put: result of «%s» not cached: %s" % (self.__class__.__name__, func, err))
+            return False
+        with self._lock:
+            with self.conn:
+                _old = self.conn.execute("SELECT size FROM memo WHERE key=?", (key,)).fetchone()
+                self.conn.execute("INSERT OR REPLACE INTO memo VALUES (?, ?, ?, ?, ?)",
+                                (key, func, _blob, len(_blob), time.time()))
+            if _old:
+                self._bytes -= _old[0]
+            else:
+                self._entries += 1
+            self._bytes += len(_blob)
+            if self._entries > self.max_entries or self._bytes > self.max_bytes:
+                self.evict()
+        return True
+
+
+    def evict(self):
+        """Remove the least recently used results, until the cache is
+        within its limits.  Returns the number of results removed."""
+        with self._lock:
+            self.flush()
+            # other processes may share the database
+            self._entries, self._bytes = self.conn.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM memo").fetchone()
+            _keys = []
+            _entries, _bytes = self._entries, self._bytes
+            for _key, _size in self.conn.execute("SELECT key, size FROM memo ORDER BY used"):
+                if _entries <= self.max_entries and _bytes <= self.max_bytes:
+                    break
+                _keys.append((_key,))
+                _entries -= 1
+                _bytes -= _size
+            with self.conn:
+                self.conn.executemany("DELETE FROM memo WHERE key=?", _keys)
+            self._entries, self._bytes = _entries, _bytes
+        return len(_keys)
+
+
+    def clear(self):
+        """Remove all the results."""
+        with self._lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM memo")
+            self._used.clear()
+            self._entries = self._bytes = 0
+
+
+    def stats(self):
+        """Return `{"hits", "misses", "entries", "bytes"}`."""
+        return {"hits": self.hits, "misses": self.misses,
+                "entries": self._entries, "bytes": self._bytes}
@@ -3,39 +3,8 @@ import numbers
 import numpy as np
 import pandas as pd
 
-def param_sweep(*paramlists, table=False, dataframe=False):
-    "Create a grid-search/parameter sweep from parameter lists"
-    # https://peps.python.org/pep-3102/#specification
-    op = []
-    for ii, li in enumerate(paramlists):
-        if len(li)==0:
-            raise ValueError(f"Empty list not allowed.")
-        li = np.array(li)
-        if ii<len(paramlists)-1:
-            #print(paramlists[ii+1:])
-            flen = 1
-            for li2 in paramlists[ii+1:]:
-                flen = flen*len(li2)
-            li = np.repeat(li, flen)
-        if ii>0:
-            rlen = 1
-            for li2 in paramlists[:ii]:
-                rlen = rlen*len(li2)    
-            li = np.tile(li, rlen)        
-        li = np.array(li)
-        op.append(li)
-    if table:  # NOTE np.array has a single type
-        op = np.array(op).T
-        return op
-    if dataframe:
-        # op = np.array(op).T
-        # op = pd.DataFrame(op)
-        op_dict = {}
-        for ii, arr in enumerate(op):
-            op_dict[ii] = arr
-        op = pd.DataFrame(op_dict)
-        return op
-    return tuple(op)
+# the sweep functions are in module pflacs.sweep
+from pflacs.sweep import param_sweep
 
 def ttest(a):
     a = np.array(a)
@@ -6,20 +6,28 @@ https://github.com/qwilka/pflacs/blob/master/LICENSE
 """
 import ast
 import collections
+import concurrent.futures
+import contextlib
+import contextvars
 import functools
 import importlib
 import inspect
 import copy
+import fnmatch
 import json
-#import os
+import os
+import pickle
 #import string
 import pathlib
 import re
 import logging
+import math
+import operator
 import sys
 #import time
 #from traceback import extract_stack
 import types
+import uuid
 import warnings
 logger = logging.getLogger(__name__)
 
@@ -34,6 +42,13 @@ import numpy as np
 
 import pandas as pd
 from tables import NaturalNameWarning
+
+from . import export, hashing, serializers, sidecar
+from .memo import MemoCache
+from .results import ResultStore
+from .sidecar import SidecarRef
+from .sqlite_store import SqliteStore
+from .sweep import param_sweep
 warnings.simplefilter('ignore', NaturalNameWarning)  # suppress spammy pytables warning
 
 
@@ -42,20 +57,355 @@ class _empty:
     """Marker object for undefined value.
     Used in pflacs: PflacsParam.empty"""
 
-# https://docs.python.org/3/library/json.html
-class PflacsEncoder(json.JSONEncoder):
-    def default(self, obj):
+class _PflacsDefault:
+    """`default` hook of the JSON serializers, encodes the objects that
+    are not JSON types.
+
+    `_empty` is encoded as `{"__empty__": true}`.  NumPy arrays are
+    encoded with their dtype and shape, `{"__ndarray__": list, "dtype":
+    str, "shape": list}`.  With `sidecar_dpath`, arrays larger than 
+    `array_threshold` bytes are saved as `.npy` files in the sidecar
+    directory, `{"__npy__": file name, "dtype": str, "shape": list}`, see
+    :mod:`pflacs.sidecar`.  Non-finite NumPy float scalars are encoded
+    as `{"__float__": "nan"}`, see :func:`pflacs.serializers.encode_nonfinite`,
+    and if the serializer cannot write them, the non-finite values of 
+    float arrays as strings, `"nan"`.  They are decoded by :func:`as_pflacs`.
+    """
+    def __init__(self, fallback=None, sidecar_dpath=None, array_threshold=0,
+                serializer=None):
+        self.fallback = fallback
+        self.sidecar_dpath = sidecar_dpath
+        self.array_threshold = array_threshold
+        self.serializer = serializer
+        self.sidecar_keys = set()
+    def __call__(self, obj):
         if obj is _empty:
-            return {str(_empty):True}
+            return {"__empty__": True}
         if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        return json.JSONEncoder.default(self, obj)
+            _meta = {"dtype": obj.dtype.str, "shape": list(obj.shape)}
+            if obj.dtype.hasobject:
+                return obj.tolist()
+            if self.sidecar_dpath and obj.nbytes > self.array_threshold:
+                _ref = sidecar.write_value(self.sidecar_dpath, uuid.uuid4().hex, obj)
+                self.sidecar_keys.add(_ref.key)
+                return {"__npy__": _ref.key, **_meta}
+            _native = None
+            if self.serializer is not None:
+                if (self.serializer.nonfinite or obj.dtype.kind != "f"
+                        or np.isfinite(obj).all()):
+                    _native = self.serializer.array(obj)
+                else:
+                    # the non-finite values as strings, read by `np.array`
+                    _native = [_v if math.isfinite(_v) else repr(_v)
+                                for _v in obj.ravel().tolist()]
+            if _native is None:
+                _native = obj.tolist()
+            return {"__ndarray__": _native, **_meta}
+        if isinstance(obj, np.generic):
+            return serializers.encode_nonfinite(obj.item())
+        if self.fallback is not None:
+            return self.fallback(obj)
+        raise TypeError("Object of type {} is not JSON serializable".format(obj.__class__.__name__))
 
-def as_pflacs(obj):
-    if isinstance(obj, dict) and str(_empty) in obj:
-        return _empty
+# https://docs.python.org/3/library/json.html
+class PflacsEncoder(json.JSONEncoder):
+    """JSON encoder for `pflacs` trees, for use with the `json` module, 
+    see :class:`_PflacsDefault`."""
+    def __init__(self, *args, sidecar_dpath=None, array_threshold=0, 
+                default=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hook = _PflacsDefault(default, sidecar_dpath, array_threshold)
+    @property
+    def sidecar_keys(self):
+        return self._hook.sidecar_keys
+    def default(self, obj):
+        return self._hook(obj)
+
+def as_pflacs(obj, sidecar_dpath=None):
+    if isinstance(obj, dict):
+        if "__empty__" in obj or str(_empty) in obj:
+            return _empty
+        if "__float__" in obj:
+            return float(obj["__float__"])
+        if "__ndarray__" in obj:
+            return np.array(obj["__ndarray__"], dtype=obj["dtype"]).reshape(obj["shape"])
+        if "__npy__" in obj and sidecar_dpath:
+            return sidecar.read_array(sidecar_dpath, obj["__npy__"])
     return obj
 
+def _encode_nonfinite(treedict):
+    """Encode the non-finite floats in the parameter values, `_arguments`
+    and `_internals` of the nodes of `treedict` (a `to_treedict` copy, 
+    whose `data` dicts are the node dicts: they are replaced, not 
+    changed), for the serializers that cannot write them.  The other 
+    `data` values are not checked, NumPy values are encoded by 
+    :class:`_PflacsDefault`."""
+    _encode = serializers.encode_nonfinite
+    _stack = [treedict]
+    while _stack:
+        _td = _stack.pop()
+        _stack.extend(_td.get("childs", ()))
+        _data = _td["data"]
+        _new = {}
+        for _key in ("_arguments", "_internals"):
+            _val = _data.get(_key)
+            if _val:
+                _enc = _encode(_val)
+                if _enc is not _val:
+                    _new[_key] = _enc
+        _params = {}
+        for _name, _pdict in (_data.get("params") or {}).items():
+            if isinstance(_pdict, dict) and "value" in _pdict:
+                _enc = _encode(_pdict["value"])
+                if _enc is not _pdict["value"]:
+                    _params[_name] = {**_pdict, "value": _enc}
+        if _params:
+            _new["params"] = {**_data["params"], **_params}
+        if _new:
+            _td["data"] = {**_data, **_new}
+
+
+# the keys of the dicts decoded by `as_pflacs`
+_PFLACS_KEYS = ("__empty__", str(_empty), "__float__", "__ndarray__", "__npy__")
+
+
+# `True` while building a tree from a throwaway treedict (see `_adopting`)
+_adopt = contextvars.ContextVar("pflacs_adopt", default=False)
+
+@contextlib.contextmanager
+def _adopting():
+    """Context in which nodes built from a treedict adopt the treedict
+    `data` dicts, instead of copying them.  The treedict must not be
+    used afterwards."""
+    _token = _adopt.set(True)
+    try:
+        yield
+    finally:
+        _adopt.reset(_token)
+
+
+class _TreeCache:
+    """Runtime state shared by all the nodes of a `pflacs` tree.
+
+    :class:`_TreeCache` is used internally by :mod:`pflacs`, it is not
+    saved with the tree.
+
+    `params` caches resolved parameter values, `{name: {node: value}}`,
+    so that reading an inherited parameter does not walk up the tree.
+    Changing a parameter with `PflacsParam.__set__` or `__delete__`
+    drops the cached values for that name; changing the tree structure
+    (`add_child`, `remove_child`, `from_treedict`) drops all cached values.
+    Note that editing `node.data["params"]` directly bypasses the cache,
+    call `invalidate()` after doing so.
+
+    `declared` caches `Premise.is_param` results in the same way.
+
+    `ids` indexes the nodes of the tree by `_nodeid`, `{nodeid: node}`,
+    it is used to resolve linked parameters without searching the tree.
+
+    `readers`, `{name: set of nodes}`, records the parameters read by
+    each calculation node (see `Premise._param_reads`), and `links`, 
+    `{(linkid, name): set of nodes}`, the nodes with linked parameters.
+    When a parameter is changed, the readers of that parameter in the
+    sub-tree of the changed node, or of the nodes linking to it, are
+    added to the `stale` set; they are removed when they are called.
+
+    `results` is the columnar :class:`ResultStore` of the calculation
+    results; the rows of a node are added (deferred) when it is called.
+    `unstored` is `True` after a tree is opened, until the results saved
+    with its nodes are added, see `Premise._store_results`.
+
+    `dirty` is the set of nodes changed (parameters set, calculations 
+    called) since the tree was last saved or opened, and `restructured`
+    is `True` if nodes have been added or removed; they are used by
+    `Premise.savefile(incremental=True)`.
+
+    `memo` is the :class:`MemoCache` of the function results, if the 
+    tree functions are memoized, see `Premise.memoize`.
+
+    `lazy` is `True` while the tree can hold sidecar values that have not
+    been read, after `Premise.openfile(..., lazy=True)`.
+
+    `pindex`, `{name: _ParamIndex}`, are the secondary indexes of the
+    resolved parameter values used by `Premise.select`.  An index is
+    built when a parameter is first queried; it is updated for the 
+    changed nodes by `param_changed`, and dropped by `invalidate`.
+    """
+    def __init__(self):
+        self.params = {}
+        self.declared = {}
+        self.pindex = {}
+        self.ids = {}
+        self.readers = {}
+        self.links = {}
+        self.stale = set()
+        self.results = ResultStore()
+        self.unstored = False
+        self.dirty = set()
+        self.restructured = False
+        self.memo = None
+        self.lazy = False
+    def __deepcopy__(self, memo):
+        # a copied tree starts with an empty cache, see Premise.copy
+        return self.__class__()
+    def invalidate(self, name=None):
+        if name is None:
+            self.params.clear()
+            self.declared.clear()
+            self.pindex.clear()
+        else:
+            self.params.pop(name, None)
+            self.declared.pop(name, None)
+            self.pindex.pop(name, None)
+    def param_changed(self, node, name):
+        _index = self.pindex.get(name)
+        self.invalidate(name)
+        if _index is not None:
+            _index.update(node)
+            self.pindex[name] = _index
+        _readers = self.readers.get(name)
+        if _readers:
+            for _n in node:
+                if _n in _readers:
+                    self.stale.add(_n)
+        _nodeid = getattr(node, "_nodeid", None)
+        for _linker in tuple(self.links.get((_nodeid, name), ())):
+            if _linker is not node:
+                self.param_changed(_linker, name)
+    def add_link(self, node, linkid, name):
+        self.links.setdefault((linkid, name), set()).add(node)
+    def track_reads(self, node):
+        for _name in node._param_reads():
+            self.readers.setdefault(_name, set()).add(node)
+    def saved(self):
+        self.dirty.clear()
+        self.restructured = False
+    def called(self, node, ok=True):
+        """Record a call of calculation `node`."""
+        self.dirty.add(node)
+        self.track_reads(node)
+        if ok:
+            self.stale.discard(node)
+        _columns = node._result_columns()
+        if _columns:
+            self.results.defer(node._nodeid, _columns)
+        else:
+            self.results.discard(node._nodeid)
+    def register(self, node):
+        for _name, _pdict in node.data.get("params", {}).items():
+            if isinstance(_pdict, dict) and _pdict.get("linkid"):
+                self.add_link(node, _pdict["linkid"], _name)
+        if hasattr(node, "_param_reads"):
+            self.track_reads(node)
+        _nodeid = getattr(node, "_nodeid", None)
+        if not _nodeid:
+            return
+        _other = self.ids.get(_nodeid)
+        if _other is not None and _other is not node:
+            logger.warning("%s.register: node «%s» has the same _nodeid as node «%s»: %s" % (self.__class__.__name__, node.name, _other.name, _nodeid))
+        self.ids[_nodeid] = node
+    def unregister(self, node):
+        _nodeid = getattr(node, "_nodeid", None)
+        if _nodeid and self.ids.get(_nodeid) is node:
+            del self.ids[_nodeid]
+            self.results.discard(_nodeid)
+    def get_node(self, nodeid):
+        return self.ids.get(nodeid)
+    def param_index(self, root, name):
+        _index = self.pindex.get(name)
+        if _index is None:
+            _index = self.pindex[name] = _ParamIndex(name)
+            _index.update(root._root)
+        return _index
+
+
+# comparison operators of `Premise.select` predicates
+_SELECT_OPS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "in": lambda a, b: np.isin(a, list(b)),
+}
+
+_PREDICATE_RE = re.compile(r"^\s*([\w.]+)\s*(<=|>=|==|!=|<|>|\bin\b)\s*(.+?)\s*$")
+
+
+class _ParamIndex:
+    """Secondary index of the resolved values of parameter `name` in a
+    tree, see `Premise.select`.
+
+    :class:`_ParamIndex` is used internally by :mod:`pflacs`.
+
+    `values` is `{node: value}` for the nodes where the parameter has a
+    value.  For range queries the numeric values (scalars, or the
+    minimum and maximum of arrays) are kept in arrays sorted by value,
+    re-built after the index is updated.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.values = {}
+        self._sorted = None
+    def update(self, node):
+        """Re-read the values of the sub-tree rooted at `node`."""
+        for _n in node:
+            if _n.is_param(self.name):
+                _val = getattr(_n, self.name, _empty)
+            else:
+                _val = _empty
+            if _val is _empty:
+                self.values.pop(_n, None)
+            else:
+                self.values[_n] = _val
+        self._sorted = None
+    def _ranges(self):
+        if self._sorted is None:
+            _nodes, _lo, _hi = [], [], []
+            for _n, _val in self.values.items():
+                if isinstance(_val, (bool, np.bool_)):
+                    continue
+                if isinstance(_val, (int, float, np.integer, np.floating)):
+                    _lo.append(_val)
+                    _hi.append(_val)
+                elif (isinstance(_val, np.ndarray) and _val.size 
+                        and _val.dtype.kind in "iuf"):
+                    _lo.append(_val.min())
+                    _hi.append(_val.max())
+                else:
+                    continue
+                _nodes.append(_n)
+            _nodes = _object_array(_nodes)
+            _lo = np.array(_lo, dtype=float)
+            _hi = np.array(_hi, dtype=float)
+            _ilo = np.argsort(_lo, kind="stable")
+            _ihi = np.argsort(_hi, kind="stable")
+            self._sorted = (_nodes[_ilo], _lo[_ilo], _nodes[_ihi], _hi[_ihi])
+        return self._sorted
+    def match(self, op, value):
+        """Return the set of nodes with a value that matches `op value`;
+        array values match if any element matches."""
+        if op in ("<", "<=", ">", ">=") and isinstance(value, (int, float, np.integer, np.floating)):
+            _lonodes, _lo, _hinodes, _hi = self._ranges()
+            if op == ">":
+                return set(_hinodes[np.searchsorted(_hi, value, side="right"):])
+            if op == ">=":
+                return set(_hinodes[np.searchsorted(_hi, value, side="left"):])
+            if op == "<":
+                return set(_lonodes[:np.searchsorted(_lo, value, side="left")])
+            return set(_lonodes[:np.searchsorted(_lo, value, side="right")])
+        _func = _SELECT_OPS[op]
+        _nodes = set()
+        for _n, _val in self.values.items():
+            try:
+                _ok = np.any(_func(_val, value))
+            except (TypeError, ValueError):
+                _ok = False
+            if _ok:
+                _nodes.add(_n)
+        return _nodes
+
 
 class PflacsParam:
     """Descriptor class for `pflacs` parameters.
@@ -77,23 +427,35 @@ class PflacsParam:
         self._access_coord = None  # just a test, get the instance coord...
     def __get__(self, instance, owner):
         #print(f"PflacsParam.__get__ self.name={self.name} instance={instance} owner={owner}")
+        # resolved values are cached per tree, see `_TreeCache`
+        _pcache = instance._tcache.params.setdefault(self.name, {})
+        try:
+            return _pcache[instance]
+        except KeyError:
+            pass
+        _val = self._resolve(instance, owner)
+        _pcache[instance] = _val
+        return _val
+    def _resolve(self, instance, owner):
         _linkid = instance.data["params"].get(self.name, {}).get("linkid", None) 
         if _linkid and instance:
-            linkednode = instance.get_node_by_id(_linkid)
-            if linkednode is None:
-                linkednode = instance._root.get_node_by_id(_linkid)
+            linkednode = instance._tcache.get_node(_linkid)
             if linkednode is None:
                 _val = _empty
             else:
                 _val = linkednode.data["params"].get(self.name, _empty) 
             if _val and isinstance(_val, dict) and "value" in _val:
                 _val = _val["value"] 
+                if type(_val) is SidecarRef:
+                    _val = linkednode._sidecar_param(self.name)
         elif instance:
             _val = instance.data["params"].get(self.name, _empty)
             # if self.access_coord is None:
             #     self.access_coord = instance._coord
             if isinstance(_val, dict) and "value" in _val:
                 _val = _val["value"] 
+                if type(_val) is SidecarRef:
+                    _val = instance._sidecar_param(self.name)
                 # print("Parameter in node: ", instance._coord, "accessed from: ", self.access_coord)
                 # self.access_coord = None
             else:
@@ -110,16 +472,59 @@ class PflacsParam:
                 instance.data["params"][self.name]["desc"] = self.desc
             if self.linkid:
                 instance.data["params"][self.name]["linkid"] = self.linkid
+                instance._tcache.add_link(instance, self.linkid, self.name)
                 self.linkid = None
         if value is not _empty:
             instance.data["params"][self.name]["value"] = value
+        instance._tcache.dirty.add(instance)
+        instance._tcache.param_changed(instance, self.name)
     def __delete__(self, instance):
         del instance.data["params"][self.name]
+        instance._tcache.dirty.add(instance)
+        instance._tcache.param_changed(instance, self.name)
     def __set_name__(self, owner, name):  # not required: this is only called for attributes defined when the class is created
         self.name = name
         #print("Parameter __set_name__ call: ", self.name)
     
 
+class _SidecarAttr(NodeAttr):
+    """`NodeAttr` for a dict of values that can be saved in the sidecar
+    directory (see :mod:`pflacs.sidecar`), the values are read from the 
+    sidecar directory when the attribute is first accessed.  The values
+    are only checked in trees opened lazily (`_TreeCache.lazy`)."""
+    def __get__(self, instance, owner):
+        _value = super().__get__(instance, owner)
+        if _value and instance._tcache.lazy:
+            for _k, _v in _value.items():
+                if type(_v) is SidecarRef:
+                    _value[_k] = instance._sidecar_read(_v)
+        return _value
+
+
+class _CallPlan:
+    """Argument resolution for a :class:`PflacsFunc`, worked out once for
+    a function, argmap and node class and then reused on every call.
+
+    :class:`_CallPlan` is used internally by :mod:`pflacs`.
+
+    `entries` holds `(argname, paramname)` for each function argument, in
+    signature order, where `paramname` is the (argmap) name of the `pflacs`
+    parameter or explicit keyword argument supplying it.
+    `retspec` is the parsed «return» entry of the argmap.
+    """
+    __slots__ = ("entries", "names", "required", "retspec")
+
+    def __init__(self, sig, argmap):
+        self.entries = []
+        self.required = set()
+        for _para in sig.parameters.values():
+            self.entries.append( (_para.name, argmap.get(_para.name, _para.name)) )
+            if _para.default is _para.empty:
+                self.required.add(_para.name)
+        self.names = frozenset(_e[0] for _e in self.entries)
+        self.retspec = PflacsFunc._parse_return(argmap.get("return", None))
+
+
 class PflacsFunc:
     """Class for `pflacs` plugin functions.
 
@@ -140,26 +545,122 @@ class PflacsFunc:
             self._argmap = argmap
         else:
             self._argmap = {}
-        self._instance = None
         #self._owner = None
+        # call plans are only used for functions with plain named arguments
+        self._plannable = all(_p.kind in (_p.POSITIONAL_OR_KEYWORD, _p.KEYWORD_ONLY)
+                              for _p in self._sig.parameters.values())
+        self._plans = {}
     def __get__(self, instance, owner):
-        logger.debug("PflacsFunc.__get__ «instance» {}, «owner» {}".format(instance, owner))
-        self._instance = instance  # fragile?? must be sync
-        #self._owner = owner
-        return self
+        logger.debug("PflacsFunc.__get__ «instance» %s, «owner» %s", instance, owner)
+        if instance is None:
+            return self
+        # bind to the instance like a method, the descriptor is shared
+        # by all the nodes of the class (and threads)
+        return _BoundPflacsFunc(self, instance)
     def __call__(self, *args, **kwargs):
-        #_xkwargs = {}
-        logger.debug("PflacsFunc.__call__: function «%s».«%s»; args «%s»; kwargs «%s»" % (self._instance, self.name, args, kwargs))
-        _xkwargs = copy.deepcopy(kwargs)
-        if (self._instance and hasattr(self._instance, "_argmap") and
-                isinstance(self._instance._argmap, dict)):
-            _applied_argmap = self._instance._argmap
+        return self._call(None, args, kwargs)
+
+    def _applied_argmap(self, instance):
+        if (instance and hasattr(instance, "_argmap") and
+                isinstance(instance._argmap, dict)):
+            return instance._argmap
         elif self._argmap:
-            _applied_argmap = self._argmap
-        else:
-            _applied_argmap = {}
+            return self._argmap
+        return {}
+
+    def _get_plan(self, instance, argmap):
+        """Return the call plan for this function, `argmap` and the class
+        of `instance`, or `None` if the call must be bound by inspection."""
+        if not self._plannable or instance is None:
+            return None
+        try:
+            _key = (instance.__class__, frozenset(argmap.items()))
+            _plan = self._plans.get(_key)
+        except TypeError:  # unhashable argmap entries
+            return None
+        if _plan is None:
+            _plan = self._plans[_key] = _CallPlan(self._sig, argmap)
+        return _plan
+
+    def _call(self, instance, args, kwargs):
+        logger.debug("PflacsFunc.__call__: function «%s».«%s»; args «%s»; kwargs «%s»", instance, self.name, args, kwargs)
+        _bound = self._bind(instance, args, kwargs)
+        if _bound is None:
+            return False
+        _args, _kwargs, _applied_args, _retspec = _bound
+        ##self._instance._arguments = _applied_args
+        if hasattr(instance, "_arguments"):
+            instance._arguments.update(_applied_args)
+
+        _result = _memo_call(instance, self._func, _args, _kwargs)
+        # internals
+        if instance and getattr(instance, "_return2attr", False):
+            self._store_result(instance, _result, _retspec)
+        return _result
+
+    def _bind(self, instance, args, kwargs, copy_kwargs=True):
+        """Resolve the function arguments for a call on `instance`.
+        The explicit `kwargs` are deep-copied, unless `copy_kwargs` is 
+        `False` (values owned by the node).
+
+        :returns: `(args, kwargs, applied_args, retspec)`, where 
+            `applied_args` are the arguments by parameter (argmap) name and
+            `retspec` is the parsed «return» mapping; or `None` if the
+            arguments cannot be bound (the error is logged).
+        """
+        _applied_argmap = self._applied_argmap(instance)
+        _plan = self._get_plan(instance, _applied_argmap)
+        if _plan is not None:
+            _bound = self._bind_plan(_plan, instance, args, kwargs, copy_kwargs)
+            if _bound is not None:
+                return _bound + (_plan.retspec,)
+        _bound = self._bind_inspect(instance, args, kwargs, _applied_argmap,
+                                    copy_kwargs)
+        if _bound is None:
+            return None
+        return _bound + (self._parse_return(_applied_argmap.get("return", None)),)
+
+    def _bind_plan(self, plan, instance, args, kwargs, copy_kwargs=True):
+        """Resolve the function arguments following `plan`.  Returns
+        `None` if the call is not a simple one (e.g. a missing or unexpected
+        argument), so that the error is reported by `_bind_inspect`."""
+        _nargs = len(args)
+        if _nargs > len(plan.entries):
+            return None
+        # the explicit kwargs are copied (as by `_bind_inspect`), the 
+        # stored `_arguments` must not share the caller's mutable values
+        _xkwargs = copy.deepcopy(kwargs) if kwargs and copy_kwargs else dict(kwargs)
+        for _argname, _pname in plan.entries[_nargs:]:
+            # explicit keyword argument first priority
+            if _pname in kwargs:
+                if _pname != _argname:
+                    _xkwargs[_argname] = _xkwargs.pop(_pname, kwargs[_pname])
+                continue
+            if _argname in kwargs:
+                continue
+            if instance.is_param(_pname):
+                _val = getattr(instance, _pname)
+                if _val is not _empty:
+                    _xkwargs[_argname] = _val
+        _applied_args = {}
+        for ii, (_argname, _pname) in enumerate(plan.entries):
+            if ii < _nargs:
+                _applied_args[_pname] = args[ii]
+            elif _argname in _xkwargs:
+                _applied_args[_pname] = _xkwargs[_argname]
+            elif _argname in plan.required:
+                return None
+        if len(_xkwargs) + _nargs > len(_applied_args) or not plan.names.issuperset(_xkwargs):
+            return None
+        return args, _xkwargs, _applied_args
+
+    def _bind_inspect(self, instance, args, kwargs, _applied_argmap, 
+                    copy_kwargs=True):
+        """Resolve the function arguments by inspecting the signature, and
+        bind them with `Signature.bind`."""
+        _xkwargs = copy.deepcopy(kwargs) if copy_kwargs else dict(kwargs)
         for ii, (_key, _para) in enumerate(self._sig.parameters.items()):
-            logger.debug("PflacsFunc.__call__: function «%s».«%s»; parameter name «%s»" % (self._instance, self.name, _para.name))
+            logger.debug("PflacsFunc.__call__: function «%s».«%s»; parameter name «%s»" % (instance, self.name, _para.name))
             if ii<len(args):
                 continue
             # explicit keyword argument first priority
@@ -169,7 +670,7 @@ class PflacsFunc:
                 _xkwargs[_para.name] = _parval
                 _explicit_kwarg = True
             elif _para.name in kwargs:
-                logger.debug("PflacsFunc.__call__: WARNING «%s».«%s»; parameter name «%s» is keyword argument in original function «%s» (binding nonetheless)." % (self._instance, self.name, _para.name, self._func.__name__))
+                logger.debug("PflacsFunc.__call__: WARNING «%s».«%s»; parameter name «%s» is keyword argument in original function «%s» (binding nonetheless)." % (instance, self.name, _para.name, self._func.__name__))
                 continue
             if not _explicit_kwarg:
                 if _para.name in _applied_argmap:
@@ -178,12 +679,12 @@ class PflacsFunc:
                     _inst_param = _para.name
                 # if _inst_param in self._instance.params:
                 #     _xkwargs[_para.name] = self._instance.params[_inst_param]
-                if self._instance.is_param(_inst_param):
+                if instance.is_param(_inst_param):
                     #_xkwargs[_para.name] = getattr(self._instance, _inst_param)
-                    _val = getattr(self._instance, _inst_param)
+                    _val = getattr(instance, _inst_param)
                     if _val is not _empty:
                         _xkwargs[_para.name] = _val
-        logger.debug("PflacsFunc.__call__: function «%s».«%s»; bind args: %s & kwargs: %s;" % (self._instance, self.name, args, _xkwargs))
+        logger.debug("PflacsFunc.__call__: function «%s».«%s»; bind args: %s & kwargs: %s;" % (instance, self.name, args, _xkwargs))
         try:
             #_bound = self._sig.bind(*args, **kwargs, **_xkwargs)
             _bound = self._sig.bind(*args, **_xkwargs)
@@ -197,8 +698,8 @@ class PflacsFunc:
                 if _argname in _applied_argmap:
                     _argname = _applied_argmap.get(_argname)
                     _argname = "missing parameter «{}»".format(_argname)
-            logger.error("PflacsFunc.__call__: function «%s».«%s»; %s; (original function error: %s)" % (self._instance, self.name, _argname, err))
-            return False
+            logger.error("PflacsFunc.__call__: function «%s».«%s»; %s; (original function error: %s)" % (instance, self.name, _argname, err))
+            return None
 
         #self._instance._arguments = copy.deepcopy(_bound.arguments)
         _applied_args = {}
@@ -207,52 +708,83 @@ class PflacsFunc:
                 _applied_args[_applied_argmap[k]] = v
             else:
                 _applied_args[k] = v
-        ##self._instance._arguments = _applied_args
-        if hasattr(self._instance, "_arguments"):
-            self._instance._arguments.update(_applied_args)
+        return _bound.args, _bound.kwargs, _applied_args
 
-        _result = self._func(*_bound.args, **_bound.kwargs)
-        # internals
-        if self._instance and getattr(self._instance, "_return2attr", False):
-            _return2attr = getattr(self._instance, "_return2attr", False)
-            _internals = {} # _internals = []
-            #_argmap_ret = self._argmap.get("return", None)
-            _argmap_ret = _applied_argmap.get("return", None)
-            if _argmap_ret is None or (isinstance(_argmap_ret, str) and _argmap_ret.strip()==""):
-                _attr_name = "_"+self.name # avoid name clash in default attr name
-                ##_attr_name = self.name
-                self._instance.add_param(_attr_name, value=_result, desc="«internal»")
-                _internals[_attr_name] = _result #_internals.append(_attr_name)
-            elif isinstance(_argmap_ret, str):
-                print(f"_argmap_ret={_argmap_ret}")
-                _argmap_ret = _argmap_ret.strip()
-                try:
-                    _eval_ret = ast.literal_eval(_argmap_ret)
-                except ValueError:
-                    _eval_ret = _argmap_ret
-                if isinstance(_eval_ret, str):
-                    _attr_name = _eval_ret
-                    self._instance.add_param(_eval_ret, value=_result, desc="«internal»")
-                    _internals[_attr_name] = _result #_internals.append(_attr_name)
-                elif isinstance(_eval_ret, dict) and isinstance(_result, dict):
-                    for k, v in _result.items():
-                        if k in _eval_ret:
-                            _attr_name = _eval_ret[k]
-                        else:
-                            _attr_name = k
-                        self._instance.add_param(_attr_name, value=v, desc="«internal»")
-                        _internals[_attr_name] = v #_internals.append(_attr_name)
-                elif isinstance(_eval_ret, tuple) and isinstance(_result, tuple):
-                    print(f"_eval_ret={_eval_ret}")
-                    print(f"_result={_result}")
-                    for ii, _r in enumerate(_result):
-                        _attr_name = _eval_ret[ii]
-                        self._instance.add_param(_attr_name, value=_r, desc="«internal»")
-                        _internals[_attr_name] = _r
-            #self._instance._internals = _internals
-            self._instance._internals.update(_internals)
-            #self._instance._externals = list(self._sig.parameters.keys())
-        return _result
+    @staticmethod
+    def _parse_return(argmap_ret):
+        """Parse the «return» entry of an argmap; returns `None` for the
+        default return attribute name, otherwise a str, dict or tuple."""
+        if argmap_ret is None or (isinstance(argmap_ret, str) and argmap_ret.strip()==""):
+            return None
+        if isinstance(argmap_ret, str):
+            logger.debug(f"_argmap_ret={argmap_ret}")
+            argmap_ret = argmap_ret.strip()
+            try:
+                _eval_ret = ast.literal_eval(argmap_ret)
+            except ValueError:
+                _eval_ret = argmap_ret
+            return _eval_ret
+        return False  # not a valid return mapping, result not stored
+
+    @staticmethod
+    def _set_internal(instance, name, value):
+        # re-running a calculation updates its «internal» params in place;
+        # `add_param` would set the same value, with an "already param"
+        # warning on every call
+        if instance.has_param(name):
+            setattr(instance, name, value)
+        else:
+            instance.add_param(name, value=value, desc="«internal»")
+
+    def _store_result(self, instance, _result, _eval_ret):
+        _internals = {} # _internals = []
+        if _eval_ret is None:
+            _attr_name = "_"+self.name # avoid name clash in default attr name
+            ##_attr_name = self.name
+            self._set_internal(instance, _attr_name, _result)
+            _internals[_attr_name] = _result #_internals.append(_attr_name)
+        elif isinstance(_eval_ret, str):
+            _attr_name = _eval_ret
+            self._set_internal(instance, _eval_ret, _result)
+            _internals[_attr_name] = _result #_internals.append(_attr_name)
+        elif isinstance(_eval_ret, dict) and isinstance(_result, dict):
+            for k, v in _result.items():
+                if k in _eval_ret:
+                    _attr_name = _eval_ret[k]
+                else:
+                    _attr_name = k
+                self._set_internal(instance, _attr_name, v)
+                _internals[_attr_name] = v #_internals.append(_attr_name)
+        elif isinstance(_eval_ret, tuple) and isinstance(_result, tuple):
+            logger.debug(f"_eval_ret={_eval_ret}")
+            logger.debug(f"_result={_result}")
+            for ii, _r in enumerate(_result):
+                _attr_name = _eval_ret[ii]
+                self._set_internal(instance, _attr_name, _r)
+                _internals[_attr_name] = _r
+        #self._instance._internals = _internals
+        instance._internals.update(_internals)
+        #self._instance._externals = list(self._sig.parameters.keys())
+
+
+class _BoundPflacsFunc:
+    # A PflacsFunc bound to a node instance, returned by PflacsFunc.__get__.
+    # Other attributes (name, _sig, __wrapped__, ...) are those of the
+    # PflacsFunc.
+    __slots__ = ("__func__", "__self__")
+
+    def __init__(self, pfunc, instance):
+        self.__func__ = pfunc
+        self.__self__ = instance
+    def __call__(self, *args, **kwargs):
+        return self.__func__._call(self.__self__, args, kwargs)
+    def __getattr__(self, name):
+        return getattr(self.__func__, name)
+    @property
+    def __doc__(self):
+        return self.__func__.__doc__
+    def __repr__(self):
+        return "<bound pflacs function {} of {}>".format(self.__func__.name, self.__self__)
 
 
 class Premise(Node):
@@ -276,26 +808,34 @@ class Premise(Node):
     desc = NodeAttr()
     plugins = TreeAttr()
     #_hdf_fpath = TreeAttr("_vntreemeta")
+    _transient_attrs = ("_tcache",)  # runtime-only attributes, not saved
 
     def __init__(self, name=None, parent=None, parameters=None,
                 data=None, treedict=None, vnpkl_fpath=None):
+        if isinstance(parent, Premise):
+            self._tcache = parent._tcache  # joins the tree in add_child
+        else:
+            self._tcache = _TreeCache()
         super().__init__(name, parent, data, treedict, vnpkl_fpath)
         #self.set_data("params", value={})
-        params = {}
-        if parameters and isinstance(parameters, dict):
-            for _k, _v in parameters.items():
-                if isinstance(_v, dict) and "value" in _v:
-                    params[_k] = _v
-                else:
-                    params[_k] = {"value": _v}
-        if "params" in self.data and isinstance(self.data["params"], dict):
-            _pars = copy.deepcopy(self.data["params"])
+        if treedict is not None and not parameters and _adopt.get():
+            self._adopt_params()
+        else:
+            params = {}
+            if parameters and isinstance(parameters, dict):
+                for _k, _v in parameters.items():
+                    if isinstance(_v, dict) and "value" in _v:
+                        params[_k] = _v
+                    else:
+                        params[_k] = {"value": _v}
+            if "params" in self.data and isinstance(self.data["params"], dict):
+                _pars = copy.deepcopy(self.data["params"])
+                if params and isinstance(params, dict):
+                    _pars.update(copy.deepcopy(params))
+                params = _pars
+            self.data["params"] =  {}
             if params and isinstance(params, dict):
-                _pars.update(copy.deepcopy(params))
-            params = _pars
-        self.data["params"] =  {}
-        if params and isinstance(params, dict):
-            self.import_params(params)
+                self.import_params(params)
         if "plugins" in self.data:
             _plist = copy.copy(self.data["plugins"])
         else:
@@ -309,6 +849,29 @@ class Premise(Node):
         if treedict is None:
             self._clsname = self.__class__.__name__
             self._return2attr = False
+        if treedict is None or not getattr(self, "_nodeid", None):
+            # otherwise registered in from_treedict
+            if not getattr(self, "_nodeid", None):
+                self._nodeid = uuid.uuid4().hex
+            self._tcache.register(self)
+
+
+    def _adopt_params(self):
+        """Declare the params in `data` adopted from a treedict (see 
+        `_adopting`), without copying and re-setting their values."""
+        _params = self.data.get("params")
+        if not isinstance(_params, dict):
+            self.data["params"] = {}
+            return
+        for _name, _pdict in list(_params.items()):
+            _attr = inspect.getattr_static(self.__class__, _name, None)
+            if isinstance(_attr, PflacsParam):
+                continue
+            if _attr is None and isinstance(_pdict, dict):
+                setattr(self.__class__, _name, PflacsParam(_name, _pdict.get("desc", "")))
+            else:
+                del _params[_name]
+                self.import_params({_name: _pdict})
 
 
     @property
@@ -322,6 +885,538 @@ class Premise(Node):
             return None
 
 
+    @property
+    def _sidecar_dpath(self):
+        """Path of the sidecar directory for large values, see :mod:`pflacs.sidecar`.
+        """
+        return sidecar.sidecar_dpath(self._vnpkl_fpath)
+
+
+    # compact the journal when it is larger than this fraction of the file
+    _journal_ratio = 1.0
+
+    @property
+    def _journal_fpath(self):
+        """Path of the journal file of incremental saves."""
+        if self._vnpkl_fpath:
+            return self._vnpkl_fpath + ".journal"
+        return None
+
+
+    def savefile(self, filepath=None, sidecar_threshold=None, incremental=False):
+        """Save the tree in a `pflacs` (pickle) file.
+
+        With `sidecar_threshold` the parameter values, `_arguments` and 
+        `_internals` larger than `sidecar_threshold` bytes are saved in
+        separate files in the sidecar directory, so that they can be 
+        read when they are first accessed, see :meth:`openfile`.
+
+        With `incremental=True` only the data of the nodes changed since
+        the tree was last saved (or opened) is saved, appended to the
+        journal file `<file>.journal`, which is replayed by :meth:`openfile`.
+        The whole tree is saved instead, and the journal removed 
+        (compaction), if nodes have been added or removed, or if the 
+        journal is larger than the file.  The changed nodes are tracked 
+        for parameters and `Calc` calls; call :meth:`mark_dirty` after 
+        changing other node data (e.g. the node name).
+
+        A file path with extension `.vn4` saves the tree in a SQLite 
+        database, see :mod:`pflacs.sqlite_store`; `incremental=True` then
+        replaces the rows of the changed nodes in the database.
+
+        :param filepath: the file path, if `None` use `self._vnpkl_fpath`.
+        :type filepath: str or None
+        :param sidecar_threshold: size in bytes of the values saved in
+            the sidecar directory, `None` to save all the values in the file.
+        :type sidecar_threshold: int or None
+        :param incremental: save only the changed nodes.
+        :type incremental: bool
+        :returns: `True` if successful. 
+        :rtype: bool
+        """
+        if str(filepath or self._vnpkl_fpath).endswith(".vn4"):
+            return self._save_sqlite(filepath, incremental)
+        if incremental and self._journal_ok(filepath):
+            return self._save_journal(sidecar_threshold)
+        # values not read yet from the file that the tree was opened from
+        self._root._sidecar_load()
+        self._root._savetoken = uuid.uuid4().hex
+        if sidecar_threshold is None:
+            _ok = super().savefile(filepath)
+        else:
+            _ok = self._save_sidecar(filepath, sidecar_threshold)
+        if _ok:
+            if os.path.isfile(self._journal_fpath):
+                os.remove(self._journal_fpath)
+            self._tcache.saved()
+        return _ok
+
+
+    def _save_sidecar(self, filepath, sidecar_threshold):
+        if filepath:
+            self._vnpkl_fpath = os.path.abspath(filepath)
+        try:
+            _dpath = self._sidecar_dpath
+            _dpath.mkdir(exist_ok=True)
+            _keys = set()
+            _treedict = self._root.to_treedict()
+            _stack = [_treedict]
+            while _stack:
+                _td = _stack.pop()
+                _td["data"] = _sidecar_data(_td["data"], _dpath, 
+                                        sidecar_threshold, _keys)
+                _stack.extend(_td.get("childs", ()))
+            with open(self._vnpkl_fpath, "wb") as pf:
+                pickle.dump(_treedict, pf) 
+            sidecar.clear(_dpath, keep=_keys)
+        except Exception as err:
+            logger.error("%s.savefile: arg `filepath`=«%s» `self._vnpkl_fpath`=«%s» error: %s" % (self.__class__.__name__, filepath, self._vnpkl_fpath, err))
+            return False
+        return True
+
+
+    def _save_sqlite(self, filepath, incremental):
+        _incremental = incremental and self._journal_ok(filepath)
+        self._root._sidecar_load()
+        if filepath:
+            self._vnpkl_fpath = os.path.abspath(filepath)
+        try:
+            with SqliteStore(self._vnpkl_fpath) as _store:
+                if _incremental:
+                    _store.save_nodes(self._tcache.dirty)
+                else:
+                    self._root._savetoken = uuid.uuid4().hex
+                    _store.save_tree(self._root)
+        except Exception as err:
+            logger.error("%s.savefile: arg `filepath`=«%s» `self._vnpkl_fpath`=«%s» error: %s" % (self.__class__.__name__, filepath, self._vnpkl_fpath, err))
+            return False
+        self._tcache.saved()
+        return True
+
+
+    def _journal_ok(self, filepath):
+        """`True` if the changes can be appended to the journal."""
+        _fpath = self._vnpkl_fpath
+        if not _fpath or (filepath and os.path.abspath(filepath) != _fpath):
+            return False
+        if self._tcache.restructured or not getattr(self._root, "_savetoken", None):
+            return False
+        if not os.path.isfile(_fpath):
+            return False
+        _jpath = self._journal_fpath
+        if (os.path.isfile(_jpath) and 
+                os.path.getsize(_jpath) > self._journal_ratio * os.path.getsize(_fpath)):
+            return False
+        return True
+
+
+    def _save_journal(self, sidecar_threshold):
+        """Append the data of the changed nodes to the journal."""
+        try:
+            _dpath = None
+            if sidecar_threshold is not None:
+                _dpath = self._sidecar_dpath
+                _dpath.mkdir(exist_ok=True)
+            _nodes = {}
+            for _n in self._tcache.dirty:
+                _data = _n.data
+                if _dpath:
+                    _data = _sidecar_data(_data, _dpath, sidecar_threshold, set())
+                _nodes[_n._nodeid] = _data
+            if _nodes:
+                with open(self._journal_fpath, "ab") as _fh:
+                    pickle.dump({"token": self._root._savetoken, "nodes": _nodes}, _fh)
+        except Exception as err:
+            logger.error("%s.savefile: journal «%s» error: %s" % (self.__class__.__name__, self._journal_fpath, err))
+            return False
+        self._tcache.saved()
+        return True
+
+
+    def _replay_journal(self):
+        """Apply the node data saved in the journal by incremental saves.
+
+        :returns: number of node patches applied.
+        :rtype: int
+        """
+        _jpath = self._journal_fpath
+        if not _jpath or not os.path.isfile(_jpath):
+            return 0
+        _token = getattr(self, "_savetoken", None)
+        _count = 0
+        with open(_jpath, "rb") as _fh:
+            while True:
+                try:
+                    _record = pickle.load(_fh)
+                except EOFError:
+                    break
+                except Exception as err:
+                    logger.warning("%s._replay_journal: journal «%s» truncated, changes after record not applied: %s" % (self.__class__.__name__, _jpath, err))
+                    break
+                if _record.get("token") != _token:
+                    logger.warning("%s._replay_journal: journal «%s» record not for this file, ignored." % (self.__class__.__name__, _jpath))
+                    continue
+                for _nodeid, _data in _record["nodes"].items():
+                    _n = self._tcache.get_node(_nodeid)
+                    if _n is None:
+                        logger.warning("%s._replay_journal: node «%s» not in tree." % (self.__class__.__name__, _nodeid))
+                        continue
+                    _n._patch_data(_data)
+                    _count += 1
+        return _count
+
+
+    def _patch_data(self, data):
+        """Replace the node data, e.g. with a journal patch."""
+        self._tcache.unregister(self)
+        if "_vntree_meta" in self.data:
+            data["_vntree_meta"] = self.data["_vntree_meta"]
+        self.data = data
+        self._adopt_params()
+        if getattr(self, "_df", None) is not None:
+            self._df = None
+        self._tcache.register(self)
+        self._tcache.invalidate()
+
+
+    def mark_dirty(self):
+        """Mark this node as changed, to be saved by the next incremental
+        save, see :meth:`savefile`."""
+        self._tcache.dirty.add(self)
+
+
+    @classmethod
+    def openfile(cls, filepath, lazy=False):
+        """Class method that opens a `pflacs` (pickle) file.
+
+        With `lazy=True` the values saved in the sidecar directory (see
+        :meth:`savefile`) are read when they are first accessed,
+        otherwise they are all read when the file is opened.
+        The journal of incremental saves, if any, is replayed.
+        A file with extension `.vn4` is a SQLite database, see 
+        :meth:`savefile`.
+
+        :param filepath: the file path.
+        :type filepath: str
+        :param lazy: read the sidecar values on first access.
+        :type lazy: bool
+        :returns: root node of tree or `False` if failure. 
+        :rtype: Premise or bool
+        """
+        if str(filepath).endswith(".vn4"):
+            return cls._open_sqlite(filepath)
+        with _adopting():
+            _root = super().openfile(filepath)
+        if _root:
+            _root._replay_journal()
+            _root._tcache.lazy = True
+            if not lazy:
+                _root._sidecar_load()
+            _root._tcache.saved()
+            _root._tcache.unstored = True
+        return _root
+
+
+    @classmethod
+    def _open_sqlite(cls, filepath):
+        try:
+            with SqliteStore(filepath) as _store:
+                _treedict = _store.treedict()
+        except Exception as err:
+            logger.error("%s.openfile: arg `filepath`=«%s» error: %s" % (cls.__name__, filepath, err))
+            return False
+        _clsname = _treedict["data"].get("_clsname")
+        _nodecls = _node_class(_clsname) if _clsname else cls
+        with _adopting():
+            _root = _nodecls(treedict=_treedict)
+        _root._vnpkl_fpath = os.path.abspath(filepath)
+        _root._tcache.saved()
+        _root._tcache.unstored = True
+        return _root
+
+
+    def _sidecar_read(self, ref):
+        return sidecar.read_value(self._sidecar_dpath, ref)
+
+
+    def _sidecar_param(self, name):
+        _pdict = self.data["params"][name]
+        _pdict["value"] = self._sidecar_read(_pdict["value"])
+        return _pdict["value"]
+
+
+    def _sidecar_load(self, recursive=True):
+        """Read all the sidecar values of the sub-tree rooted at this node,
+        or only of this node with `recursive=False`.  Only a tree opened
+        lazily has sidecar values that have not been read."""
+        if not self._tcache.lazy:
+            return
+        _loaded = False
+        for _n in (self if recursive else [self]):
+            for _name, _pdict in _n.data.get("params", {}).items():
+                if isinstance(_pdict, dict) and type(_pdict.get("value")) is SidecarRef:
+                    _n._sidecar_param(_name)
+                    _loaded = True
+            for _ns in ("_arguments", "_internals"):
+                _values = _n.data.get(_ns)
+                if isinstance(_values, dict):
+                    for _k, _v in _values.items():
+                        if type(_v) is SidecarRef:
+                            _values[_k] = _n._sidecar_read(_v)
+        if _loaded:
+            self._tcache.invalidate()
+        if recursive and self is self._root:
+            self._tcache.lazy = False
+
+
+    def memoize(self, fpath=None, max_entries=100000, max_bytes=2**30):
+        """Memoize the functions called by the `Calc` (including 
+        `SweepCalc`) and `PyFunc` nodes of the tree: the results are 
+        saved in a :class:`pflacs.memo.MemoCache` (a SQLite file), and 
+        reused, in this and later sessions, when a function is called 
+        again with the same argument values, while the function code is 
+        unchanged.  Use only with pure functions.
+
+        The code of a function includes the code of the functions that it
+        calls as module globals, but not the values of other globals (e.g.
+        constants or data read by the function), nor functions called as
+        attributes (`module.func`): clear the cache (`memo.clear()`) if
+        these change.  See :func:`pflacs.hashing.function_digest`.
+
+        Memoization is not saved with the tree, call `memoize` again 
+        after opening the tree.  It does not apply to
+        `update(executor="process")`.
+
+        :param fpath: path of the cache file, by default `<study file>.memo`;
+            `False` to stop memoizing.
+        :type fpath: str, None or bool
+        :param max_entries: maximum number of results in the cache.
+        :type max_entries: int
+        :param max_bytes: maximum total size of the results.
+        :type max_bytes: int
+        :returns: the cache, with the `hits` and `misses` counters, or
+            `None`.
+        :rtype: MemoCache or None
+        """
+        _tcache = self._tcache
+        if _tcache.memo is not None:
+            _tcache.memo.close()
+            _tcache.memo = None
+        if fpath is False:
+            return None
+        if fpath is None:
+            if not self._root._vnpkl_fpath:
+                logger.error("%s.memoize: arg «fpath»=«%s» and the tree has not been saved." % (self.__class__.__name__, fpath))
+                return None
+            fpath = self._root._vnpkl_fpath + ".memo"
+        _tcache.memo = MemoCache(fpath, max_entries=max_entries, max_bytes=max_bytes)
+        return _tcache.memo
+
+
+    @property
+    def result_store(self):
+        """The columnar :class:`ResultStore` of the calculation results of
+        the whole tree.  The results of all the load cases can be compared 
+        with a single selection, e.g. 
+        `study.result_store.to_dataframe()`.
+        """
+        self._store_results()
+        return self._tcache.results
+
+
+    def _store_results(self):
+        """Add the results of the nodes of a tree opened from a file to
+        the result store, the first time the store is read."""
+        _tcache = self._tcache
+        if not _tcache.unstored:
+            return
+        _tcache.unstored = False
+        for _n in self._root:
+            if _is_calc(_n) and _n._nodeid not in _tcache.results:
+                _columns = _n._result_columns()
+                if _columns:
+                    _tcache.results.defer(_n._nodeid, _columns)
+
+
+    def select(self, cls=None, name=None, path=None, where=(), results=(),
+                frame=False, columns=None):
+        """Select the nodes of the sub-tree rooted at this node.
+
+        Predicates are `(name, op, value)` tuples or strings, e.g.
+        `"_allowable_stress_unity_check > 0.9"`, with `op` one of `<`,
+        `<=`, `>`, `>=`, `==`, `!=` or `in`; a node with an array value
+        matches if any element matches.
+
+        `where` predicates test the parameter values that the nodes 
+        resolve (including inherited values), using indexes of the
+        parameter values that are kept up to date when parameters are 
+        set.  `results` predicates test the results of the calculation
+        nodes in the :attr:`result_store`.
+
+        :param cls: node class, or tuple of classes.
+        :type cls: type or tuple
+        :param name: node name pattern (`fnmatch` style, e.g. `"LoadCase*"`).
+        :type name: str
+        :param path: node path pattern.
+        :type path: str
+        :param where: parameter predicates.
+        :type where: str, tuple or list
+        :param results: result predicates.
+        :type results: str, tuple or list
+        :param frame: return a `pandas.DataFrame` instead of a node list.
+        :type frame: bool
+        :param columns: parameter names for the DataFrame columns, by 
+            default the names in the predicates.
+        :type columns: list or None
+        :returns: the nodes, in tree order.
+        :rtype: list or pandas.DataFrame
+        """
+        _where = _parse_predicates(where)
+        _results = _parse_predicates(results)
+        _tcache = self._tcache
+        _candidates = None
+        if _results:
+            self._store_results()
+        _tcache.results.flush()
+        for _pname, _op, _value in _where:
+            _nodes = _tcache.param_index(self, _pname).match(_op, _value)
+            _candidates = _nodes if _candidates is None else _candidates & _nodes
+        for _pname, _op, _value in _results:
+            _ids = set()
+            if _pname in _tcache.results.columns:
+                _nodeids, _vals = _tcache.results.column(_pname)
+                try:
+                    _mask = np.asarray(_SELECT_OPS[_op](_vals, _value), dtype=bool)
+                except TypeError:
+                    _mask = np.array([bool(np.any(_SELECT_OPS[_op](_v, _value))) 
+                                    for _v in _vals], dtype=bool)
+                _ids = set(_nodeids[_mask])
+            _nodes = {_tcache.get_node(_id) for _id in _ids}
+            _candidates = _nodes if _candidates is None else _candidates & _nodes
+        _selected = []
+        for _n in self:
+            if _candidates is not None and _n not in _candidates:
+                continue
+            if cls is not None and not isinstance(_n, cls):
+                continue
+            if name is not None and not fnmatch.fnmatchcase(_n.name, name):
+                continue
+            if path is not None and not fnmatch.fnmatchcase(_n._path, path):
+                continue
+            _selected.append(_n)
+        if not frame:
+            return _selected
+        if columns is None:
+            columns = list(dict.fromkeys(_p[0] for _p in _where + _results))
+        _data = {
+            "nodeid": [_n._nodeid for _n in _selected],
+            "path": [_n._path for _n in _selected],
+            "class": [_n.__class__.__name__ for _n in _selected],
+        }
+        for _col in columns:
+            _data[_col] = [getattr(_n, _col, None) if _n.is_param(_col) else None 
+                            for _n in _selected]
+        return pd.DataFrame(_data)
+
+
+    def add_child(self, node):
+        """Add a child node to the current node instance.
+
+        The child sub-tree joins the tree cache and node id index of
+        this tree, and its calculation nodes are marked stale, except 
+        while a saved tree is rebuilt (see `_adopting`): its nodes keep
+        the results they were saved with.
+        """
+        super().add_child(node)
+        _tcache = self._tcache
+        if getattr(node, "_tcache", None) is not _tcache:
+            if getattr(node, "_tcache", None) is not None and node._tcache.lazy:
+                _tcache.lazy = True
+            for _n in node:
+                if hasattr(_n, "_tcache"):
+                    _n._tcache.unregister(_n)
+                _n._tcache = _tcache
+                _tcache.register(_n)
+        if not _adopt.get():
+            for _n in node:
+                if isinstance(_n, Calc):
+                    _tcache.stale.add(_n)
+        _tcache.invalidate()
+        _tcache.restructured = True
+        return node
+
+
+    def remove_child(self, idx=None, *, name=None, node=None):
+        """Remove a child node from the current node instance.
+
+        The removed sub-tree is detached from this tree and given its
+        own tree cache.
+        """
+        _removed = super().remove_child(idx, name=name, node=node)
+        if _removed:
+            _removed.parent = None
+            _tcache = _TreeCache()
+            _tcache.lazy = self._tcache.lazy
+            for _n in _removed:
+                self._tcache.unregister(_n)
+                _n._tcache = _tcache
+                _tcache.register(_n)
+            self._tcache.invalidate()
+            self._tcache.restructured = True
+        return _removed
+
+
+    def copy(self):
+        """Return a deep copy of the sub-tree rooted at this node instance.
+
+        The copied nodes are given new `_nodeid` values; parameter links
+        between nodes inside the copied sub-tree are re-targeted to the
+        copies.
+        """
+        self._sidecar_load()
+        _copy = super().copy()
+        _copy.__dict__.pop("_savetoken", None)  # not the saved tree
+        _newids = {}
+        for _n in _copy:
+            _oldid = getattr(_n, "_nodeid", None)
+            _n._nodeid = uuid.uuid4().hex
+            if _oldid:
+                _newids[_oldid] = _n._nodeid
+        for _n in _copy:
+            for _pdict in _n.data.get("params", {}).values():
+                if isinstance(_pdict, dict) and _pdict.get("linkid") in _newids:
+                    _pdict["linkid"] = _newids[_pdict["linkid"]]
+        _tcache = _copy._tcache
+        for _n in _copy._root:
+            _tcache.register(_n)
+        return _copy
+
+
+    def get_node_by_id(self, nodeid):
+        """Get a node in the sub-tree rooted at this node instance by its
+        `_nodeid`, using the tree node id index.
+
+        :param nodeid: the `_nodeid` of the required node.
+        :type nodeid: str
+        :returns: the node with `_nodeid` equal to `nodeid`.
+        :rtype: Node or None
+        """
+        _node = self._tcache.get_node(nodeid)
+        _n = _node
+        while _n is not None and _n is not self:
+            _n = _n.parent
+        if _n is None:
+            return None
+        return _node
+
+
+    def to_treedict(self, *args, **kwargs):
+        _dct = super().to_treedict(*args, **kwargs)
+        for _attr in self._transient_attrs:
+            _dct.pop(_attr, None)
+        return _dct
+
+
     def add_param(self, name, value=PflacsParam.empty, desc="", linkid=None, **kwargs):
         if name in self.data["params"]:
             logger.warning("{}.add_param: {} is already param of instance «{}»!".format(self.__class__.__name__, name, self.name))
@@ -336,13 +1431,25 @@ class Premise(Node):
 
 
     def is_param(self, name):
+        # cached per tree (`_TreeCache.declared`): a call plan checks each
+        # argument, and the lookup walks up to the root for inherited params
+        _cache = self._tcache.declared.setdefault(name, {})
+        try:
+            return _cache[self]
+        except KeyError:
+            pass
         _exists = False
         if name in self.data["params"]:
             _exists = True
         elif self.parent:
             _exists = self.parent.is_param(name)
+        _cache[self] = _exists
         return _exists
 
+    def _param_reads(self):
+        """Names of the parameters read when this node is called."""
+        return []
+
     def has_param(self, name):
         _has = False
         if name in self.data["params"]:
@@ -366,15 +1473,325 @@ class Premise(Node):
         return desc
 
 
-    def update(self, *, calcs=True, tables=True):
-        if calcs:
+    def update(self, *, calcs=True, tables=True, workers=None, executor="process",
+                incremental=False):
+        """Call the `Calc` nodes, and then the `Table` nodes, in the
+        sub-tree rooted at this node.
+
+        With `workers` > 1 the independent calculation branches (see
+        `_calc_branches`) are called in parallel in a `concurrent.futures`
+        pool; the calculations in each branch are called in tree order.
+        With `executor="process"` each branch is re-built in a worker
+        process and the results (`_arguments`, `_internals`) are merged
+        back into this tree.  Branches with parameters linked (`linkid`) 
+        from outside the branch are called afterwards, in this process.
+        `Table` nodes are always called in this process.
+
+        With `incremental=True` only the stale nodes are called, serially
+        in tree order: nodes that have not been called yet, and nodes 
+        that read a parameter (or the result of another calculation) that
+        has been changed since they were last called.
+
+        :param workers: number of parallel workers, `None` to call the
+            `Calc` nodes serially.
+        :type workers: int or None
+        :param executor: `"process"` or `"thread"`.
+        :type executor: str
+        :param incremental: call only the stale nodes.
+        :type incremental: bool
+        """
+        if calcs and incremental:
             for _n in self:
-                if type(_n) is Calc:
+                if _is_calc(_n) and _n._is_stale():
+                    _n()
+        elif calcs and workers and workers > 1:
+            self._update_parallel(workers, executor)
+        elif calcs:
+            for _n in self:
+                if _is_calc(_n):
                     _n()
         if tables:
             for _n in self:
-                if type(_n) is Table:
+                if type(_n) is Table and (not incremental or _n._is_stale()):
                     _n()
+        if self._tcache.memo is not None:
+            self._tcache.memo.flush()
+
+
+    def _calc_branches(self):
+        """Return the root nodes of the independent calculation branches in
+        the sub-tree rooted at this node: the top-most `Calc` nodes, which
+        have only non-`Calc` ancestors in this sub-tree.  A calculation can
+        only depend on the results of its `Calc` ancestors.
+        """
+        _branches = []
+        _stack = [self]
+        while _stack:
+            _n = _stack.pop()
+            if isinstance(_n, Calc):
+                if any(_is_calc(_c) for _c in _n):
+                    _branches.append(_n)
+            else:
+                _stack.extend(reversed(_n.childs))
+        return _branches
+
+
+    def _has_external_links(self):
+        """`True` if this sub-tree, or its ancestors, has parameters linked
+        to nodes outside this sub-tree."""
+        for _n in self._ancestors:
+            for _pdict in _n.data["params"].values():
+                if isinstance(_pdict, dict) and _pdict.get("linkid"):
+                    return True
+        for _n in self:
+            for _pdict in _n.data["params"].values():
+                if isinstance(_pdict, dict) and _pdict.get("linkid"):
+                    if self.get_node_by_id(_pdict["linkid"]) is None:
+                        return True
+        return False
+
+
+    def _inherited_params(self):
+        """Return the params dicts that this node inherits from its
+        ancestors, as they are resolved by `PflacsParam`."""
+        _params = {}
+        for _n in self._ancestors:  # nearest ancestor first
+            for _name, _pdict in _n.data["params"].items():
+                if _name not in _params or ("value" in _pdict and
+                                            "value" not in _params[_name]):
+                    _params[_name] = _pdict
+        return _params
+
+
+    def _update_parallel(self, workers, executor):
+        _branches = []
+        _deferred = []
+        for _b in self._calc_branches():
+            if _b._has_external_links():
+                _deferred.append(_b)
+            else:
+                _branches.append(_b)
+        if executor == "thread":
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as _pool:
+                list(_pool.map(_update_branch, _branches))
+        elif executor == "process":
+            _plugins = self._root.plugins
+            # the worker processes cannot read the sidecar values
+            for _b in _branches:
+                _b._sidecar_load()
+                for _n in _b._ancestors:
+                    _n._sidecar_load(recursive=False)
+            _payloads = [(_b.to_treedict(), _b._inherited_params(), _plugins) 
+                            for _b in _branches]
+            _chunksize = max(1, len(_payloads) // (workers * 4))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as _pool:
+                _allresults = _pool.map(_update_branch_process, _payloads,
+                                        chunksize=_chunksize)
+                for _b, _results in zip(_branches, _allresults):
+                    _calcs = [_n for _n in _b if _is_calc(_n)]
+                    for _n, (_arguments, _internals) in zip(_calcs, _results):
+                        _n._arguments = _arguments
+                        _n._internals = _internals
+                        _n._df = None
+                        for _name, _val in _internals.items():
+                            PflacsFunc._set_internal(_n, _name, _val)
+                        _n._tcache.called(_n, ok=bool(_internals))
+        else:
+            raise ValueError("{}.update: arg «executor»=«{}» must be 'process' or 'thread'.".format(self.__class__.__name__, executor))
+        for _b in _deferred:
+            _update_branch(_b)
+
+
+    def run_design(self, design, funcname, name=None, argmap=None,
+                    kwargs=None, chunksize=None, call=True):
+        """Run a sampling design (see :mod:`pflacs.sweep`) as a 
+        :class:`SweepCalc` child node of this node, with one vectorized
+        function call instead of a calculation node for each sample.
+
+        :param design: design columns, `{parameter name: values}`, or a
+            `pandas.DataFrame`.
+        :type design: dict or pandas.DataFrame
+        :param funcname: name of the `pflacs` plugin function.
+        :type funcname: str
+        :param name: name of the new node, by default the function name.
+        :type name: str or None
+        :param argmap: optional mapping for names of function arguments and return values.
+        :type argmap: dict or None
+        :param kwargs: keyword arguments of the function, that override
+            the parameter values.
+        :type kwargs: dict or None
+        :param chunksize: maximum number of rows in each function call, 
+            `None` for a single call.
+        :type chunksize: int or None
+        :param call: call the new node.
+        :type call: bool
+        :returns: the new :class:`SweepCalc` node.
+        :rtype: SweepCalc
+        """
+        _sweep = {str(_k): np.asarray(_v) for _k, _v in dict(design).items()}
+        _node = SweepCalc(name or funcname, self, funcname=funcname,
+                        argmap=argmap, kwargs=kwargs, sweep=_sweep,
+                        product=False, chunksize=chunksize)
+        if call:
+            _node()
+        return _node
+
+
+    def results_to_hdf5(self, hdf_fpath=None, nodes=True, long=False,
+                        long_key="/_results", complevel=None, complib=None,
+                        mode="a"):
+        """Write the results of the calculation nodes in the sub-tree 
+        rooted at this node to a HDF5 file, in a single `pandas.HDFStore`
+        session.  
+
+        With `nodes=True` the `df` of each node is written to a table with
+        key `node._path` (as :meth:`Calc.to_hdf5`).  With `long=True` the
+        numeric results are also written to a single long-format table,
+        with columns `nodeid`, `path`, `row`, `parameter` and `value`.
+
+        :param hdf_fpath: path of the HDF5 file, by default the `.hdf5` 
+            file next to the `pflacs` file.
+        :type hdf_fpath: str or None
+        :param nodes: write a table for each node.
+        :type nodes: bool
+        :param long: write the long-format table.
+        :type long: bool
+        :param long_key: key of the long-format table.
+        :type long_key: str
+        :param complevel: compression level, 0-9.
+        :type complevel: int or None
+        :param complib: compression library, e.g. `"zlib"` or `"blosc"`.
+        :type complib: str or None
+        :param mode: `pandas.HDFStore` file mode.
+        :type mode: str
+        :returns: number of nodes written, or `None` on error.
+        :rtype: int or None
+        """
+        _fpath = hdf_fpath if hdf_fpath else self._hdf_fpath
+        if _fpath is None:
+            logger.error("%s.results_to_hdf5: arg `hdf_fpath`=«%s» not correct." % (self.__class__.__name__, _fpath))
+            return None
+        _count = 0
+        _longdfs = []
+        with pd.HDFStore(_fpath, mode=mode, complevel=complevel, 
+                        complib=complib) as _store:
+            for _n in self:
+                if not isinstance(_n, Calc):
+                    continue
+                _df = _n.df
+                if _df is None:
+                    continue
+                if nodes:
+                    _store.put(_n._path, _df, format="table", data_columns=True)
+                if long:
+                    _longdf = _n._long_results(_df)
+                    if _longdf is not None:
+                        _longdfs.append(_longdf)
+                _count += 1
+            if long and _longdfs:
+                _store.put(long_key, pd.concat(_longdfs, ignore_index=True),
+                            format="table", data_columns=True)
+        return _count
+
+
+    def export_results(self, path, format="parquet", batch_size=10000,
+                        compression=None):
+        """Export the calculation nodes in the sub-tree rooted at this node 
+        to a single Parquet or Arrow (IPC/Feather) file, in tree order, 
+        with a row for each node.  Requires `pyarrow`.
+
+        The columns are `nodeid`, `path` and `class`, and the resolved
+        (including inherited) values of all the node parameters, which
+        include the calculation results (`_internals`); a parameter named
+        as one of the first three columns is in column `param.<name>`.
+        The values saved in the sidecar directory of a tree opened lazily
+        are read for the export, but not kept in the tree.  The rows are 
+        written in batches (Parquet row groups) of `batch_size` nodes, so
+        that memory use does not grow with the size of the tree.  The 
+        column types are described in :mod:`pflacs.export`.
+
+        :param path: path of the file.
+        :type path: str
+        :param format: `"parquet"` or `"arrow"`.
+        :type format: str
+        :param batch_size: number of nodes in a batch.
+        :type batch_size: int
+        :param compression: compression codec, e.g. `"zstd"`, `None` for
+            the `pyarrow` default.
+        :type compression: str or None
+        :returns: number of nodes written.
+        :rtype: int
+        """
+        # first pass: the column names and types
+        _meta = ("nodeid", "path", "class")
+        _columns = dict.fromkeys(_meta, "str")
+        _pnames = {}  # {column name: parameter name}
+        for _n, _params in self._resolved_params(attach=False):
+            if _is_calc(_n):
+                for _name, _val in _params.items():
+                    _col = "param." + _name if _name in _meta else _name
+                    _pnames[_col] = _name
+                    _columns[_col] = export.merge_kind(_columns.get(_col),
+                                                        export.value_kind(_val))
+        _count = 0
+        with export.ResultsWriter(path, _columns, format=format, 
+                                    compression=compression) as _writer:
+            _rows = {_name: [] for _name in _columns}
+            for _n, _params in self._resolved_params(attach=False):
+                if not _is_calc(_n):
+                    continue
+                _rows["nodeid"].append(_n._nodeid)
+                _rows["path"].append(_n._path)
+                _rows["class"].append(_n.__class__.__name__)
+                for _col, _name in _pnames.items():
+                    _rows[_col].append(_params.get(_name))
+                _count += 1
+                if _count % batch_size == 0:
+                    _writer.write(_rows)
+                    _rows = {_name: [] for _name in _columns}
+            if _rows["nodeid"] or not _count:
+                _writer.write(_rows)
+        return _count
+
+
+    def _resolved_params(self, attach=True):
+        """Generate `(node, {name: value})` for the nodes in the sub-tree
+        rooted at this node, in tree order, with the resolved values of
+        the node parameters (`_empty` values are left out).  The values 
+        are resolved down the tree, without using the tree cache.  With 
+        `attach=False` the sidecar values not read yet are read but not
+        kept in the nodes."""
+        _base = {}
+        if self.parent:
+            for _name in self._inherited_params():
+                _val = getattr(self.parent, _name, _empty)
+                if _val is not _empty:
+                    _base[_name] = _val
+        _stack = [(self, _base)]
+        while _stack:
+            _n, _inherited = _stack.pop()
+            _own = _n.data.get("params")
+            if _own:
+                _resolved = dict(_inherited)
+                for _name, _pdict in _own.items():
+                    if not isinstance(_pdict, dict):
+                        continue
+                    if _pdict.get("linkid"):
+                        _val = getattr(_n, _name, _empty)
+                    elif "value" in _pdict and _pdict["value"] is not _empty:
+                        _val = _pdict["value"]
+                        if type(_val) is SidecarRef:
+                            _val = _n._sidecar_param(_name) if attach else _n._sidecar_read(_val)
+                    else:
+                        continue
+                    if _val is _empty:
+                        _resolved.pop(_name, None)
+                    else:
+                        _resolved[_name] = _val
+            else:
+                _resolved = _inherited
+            yield _n, _resolved
+            _stack.extend((_child, _resolved) for _child in reversed(_n.childs))
 
 
     def plugin_func(self, func, module=None, argmap=None, newname=None):
@@ -430,30 +1847,120 @@ class Premise(Node):
 
 
     def from_treedict(self, treedict):
+        self._tcache.unregister(self)
         if "data" in treedict:
             #self.data = collections.defaultdict(dict, treedict["data"])
-            self.data = copy.deepcopy(treedict["data"])
+            if _adopt.get():
+                self.data = treedict["data"]
+            else:
+                self.data = copy.deepcopy(treedict["data"])
+            self._tcache.invalidate()
         for key, val in treedict.items():
-            if key in ["parent", "childs", "data"]:
+            if key in ["parent", "childs", "data"] or key in self._transient_attrs:
                 continue
             setattr(self, key, val)
+        self._tcache.register(self)
         if "childs" in treedict.keys():
             for _childdict in treedict["childs"]:
                 # https://stackoverflow.com/questions/17959996/get-python-class-object-from-class-name-string-in-the-same-module
                 if "_clsname" in _childdict["data"] and _childdict["data"]["_clsname"]:
-                    _nodecls = getattr(sys.modules[__name__], _childdict["data"]["_clsname"])
+                    _nodecls = _node_class(_childdict["data"]["_clsname"])
                     _nodecls(parent=self, treedict=_childdict)
                 else:
                     self.__class__(parent=self, treedict=_childdict)
 
 
-    def to_json(self, filepath=None, default=None, treemeta=True, dataonly=True):
-        _ret = super().to_json(filepath, default, treemeta, dataonly, cls=PflacsEncoder)
-        return _ret
+    def to_json(self, filepath=None, default=None, treemeta=True, dataonly=True,
+                array_threshold=None, serializer=None):
+        """Serialize the sub-tree rooted at this node to JSON.
+
+        The JSON backend is `orjson` if it is installed, otherwise the 
+        `json` module, see :mod:`pflacs.serializers`.
+        NumPy arrays keep their dtype (see :class:`_PflacsDefault`).  With
+        `filepath` and `array_threshold`, arrays larger than 
+        `array_threshold` bytes are saved as `.npy` files in the sidecar
+        directory of the JSON file, and :meth:`from_json` reads them as
+        memory-mapped arrays.
+
+        :param filepath: the JSON file path, if `None` return a JSON string.
+        :type filepath: str or None
+        :param default: function for objects that cannot be serialized.
+        :type default: function or None
+        :param treemeta: include the tree metadata (`_vntree_meta`).
+        :type treemeta: bool
+        :param dataonly: include only the node `data` (and `_nodeid`), 
+            not the other node instance attributes.
+        :type dataonly: bool
+        :param array_threshold: size in bytes of the arrays saved as 
+            `.npy` files, `None` to save all the arrays in the JSON.
+        :type array_threshold: int or None
+        :param serializer: name of the JSON backend, `None` for the 
+            fastest available.
+        :type serializer: str or None
+        :returns: JSON string, or `True` if saved to file, `False` on error.
+        :rtype: str or bool
+        """
+        self._sidecar_load()
+        _treedict = self.to_treedict()
+        _stack = [_treedict]
+        while _stack:
+            _td = _stack.pop()
+            if dataonly:
+                for _key in [_k for _k in _td if _k not in ("data", "childs", "_nodeid")]:
+                    del _td[_key]
+            if not treemeta and "_vntree_meta" in _td["data"]:
+                _td["data"] = {_k: _v for _k, _v in _td["data"].items() 
+                                if _k != "_vntree_meta"}
+            _stack.extend(_td.get("childs", ()))
+        try:
+            _serializer = serializers.get_serializer(serializer)
+            if not _serializer.nonfinite:
+                _encode_nonfinite(_treedict)
+            _dpath = None
+            if filepath and array_threshold is not None:
+                _dpath = sidecar.sidecar_dpath(os.path.abspath(filepath))
+                _dpath.mkdir(exist_ok=True)
+            _default = _PflacsDefault(default, _dpath, array_threshold or 0,
+                                        _serializer)
+            _json = _serializer.dumps(_treedict, _default)
+            if not filepath:
+                return _json.decode("utf-8")
+            with open(filepath, "wb") as _fh:
+                _fh.write(_json)
+            if _dpath:
+                sidecar.clear(_dpath, keep=_default.sidecar_keys)
+        except Exception as err:
+            logger.error("%s.to_json: arg `filepath`=«%s» error: %s" % (self.__class__.__name__, filepath, err))
+            return False
+        return True
 
     @classmethod
-    def from_json(cls, filepath):
-        _ret = super().from_json(filepath, object_hook=as_pflacs)
+    def from_json(cls, filepath, serializer=None):
+        """Create a tree from a JSON file (or string) saved by :meth:`to_json`.
+
+        :param filepath: the JSON file path, or a JSON string.
+        :type filepath: str
+        :param serializer: name of the JSON backend, `None` for the 
+            fastest available.
+        :type serializer: str or None
+        :returns: root node of tree or `False` if failure. 
+        :rtype: Premise or bool
+        """
+        try:
+            _serializer = serializers.get_serializer(serializer)
+            if os.path.isfile(filepath):
+                _hook = functools.partial(as_pflacs, 
+                            sidecar_dpath=sidecar.sidecar_dpath(os.path.abspath(filepath)))
+                with open(filepath, "rb") as _fh:
+                    _treedict = _serializer.loads(_fh.read(), _hook, _PFLACS_KEYS)
+            else:
+                _treedict = _serializer.loads(filepath, as_pflacs, _PFLACS_KEYS)
+            with _adopting():
+                _ret = cls(treedict=_treedict)
+            _ret._tcache.unstored = True
+        except Exception as err:
+            logger.error("%s.from_json: arg `filepath`=«%s» error: %s" % (cls.__name__, str(filepath)[:100], err))
+            return False
         return _ret
 
 
@@ -477,8 +1984,8 @@ class Calc(Premise):
     :param argmap: optional mapping for names of function arguments and return values.
     :type argmap: dict or None
     """
-    _internals = NodeAttr(initial={})
-    _arguments = NodeAttr()
+    _internals = _SidecarAttr(initial={})
+    _arguments = _SidecarAttr()
     #_calcfuncname = NodeAttr()
     _funcname = NodeAttr()
     _argmap = NodeAttr()
@@ -525,9 +2032,28 @@ class Calc(Premise):
             #_ret = _func(*args, **kwargs)
             _ret = _func(*args, **_xkwargs)
             ##self._return = _ret # self._return redundant? same as self._internals
+        self._tcache.called(self, ok=bool(self._internals) or not self._return2attr)
         return _ret
 
 
+    def _param_reads(self):
+        return list(self._arguments) if self._arguments else []
+
+    def _result_columns(self):
+        if self._arguments and self._internals:
+            return {**self._arguments, **self._internals}
+        return None
+
+    def to_treedict(self, *args, **kwargs):
+        _dct = super().to_treedict(*args, **kwargs)
+        if "_df" in _dct:
+            _dct["_df"] = None  # re-built from the results
+        return _dct
+
+    def _is_stale(self):
+        return self._arguments is None or self in self._tcache.stale
+
+
     # def calc_child(self, call=False, name=None, **kwargs):
     #     if kwargs:
     #         _parameters = dict(kwargs)
@@ -553,18 +2079,42 @@ class Calc(Premise):
 
 
     def to_dataframe(self, return_df=True):
-        if self._arguments and self._internals:
-            try:
-                self._df = pd.DataFrame(data={**self._arguments, **self._internals})
-            except ValueError:
-                # https://stackoverflow.com/questions/17839973/constructing-pandas-dataframe-from-values-in-variables-gives-valueerror-if-usi
-                self._df = pd.DataFrame(data={**self._arguments, **self._internals}, index=[0])
+        """The dataframe of the node arguments and results is a view of the
+        rows of this node in the tree `result_store`."""
+        _columns = self._result_columns()
+        if _columns:
+            _store = self._tcache.results
+            if self._nodeid not in _store:
+                _store.append(self._nodeid, _columns)
+            self._df = _store.frame(self._nodeid)
         else:
             self._df = None
         if return_df:
             return self._df
 
 
+    def _long_results(self, df):
+        """Return `df` in long format, one row for each numeric value."""
+        _frames = []
+        for _col in df.columns:
+            try:
+                _vals = pd.to_numeric(df[_col]).to_numpy(dtype=float)
+            except (TypeError, ValueError):
+                logger.debug("%s._long_results: column «%s» of node «%s» not numeric.", 
+                            self.__class__.__name__, _col, self.name)
+                continue
+            _frames.append(pd.DataFrame({
+                "nodeid": self._nodeid,
+                "path": self._path,
+                "row": np.arange(len(_vals)),
+                "parameter": str(_col),
+                "value": _vals,
+            }))
+        if not _frames:
+            return None
+        return pd.concat(_frames, ignore_index=True)
+
+
     def to_hdf5(self, hdf_fpath=None, key=None, append=False):
         ##if self._return is None:
         if self._internals is None:
@@ -600,6 +2150,15 @@ class Table(Calc):
 
     def __call__(self):
         self.to_dataframe(False)
+        self._tcache.called(self)
+
+    def _param_reads(self):
+        return list(self._paranames) if self._paranames else []
+
+    def _is_stale(self):
+        # a new table is marked stale by `add_child`; the dataframe of a 
+        # table opened from a file is re-built on access, see `Calc.df`
+        return self in self._tcache.stale
     
     # @property
     # def df(self):
@@ -632,7 +2191,312 @@ class Table(Calc):
 
 
 
+class SweepCalc(Calc):
+    """Class for creating pflacs parameter sweep calculation nodes.
+
+    The plugin function is called with NumPy arrays of the swept parameter
+    values, instead of once for each combination of values.  The swept
+    values are stored as arrays in `_arguments`, and the (array) results
+    in `_internals`, so that `df` is a table of the sweep.  The sweep 
+    arrays (`_sweep`) are not copied to `_arguments`, and the swept 
+    columns of `_arguments` are not saved, they are re-built from 
+    `_sweep` when the tree is opened.
+    Functions that cannot be called with arrays (the call fails, or the
+    result does not have one value per row) are called for each row.
+
+    :class:`SweepCalc` is a sub-class of :class:`Calc`.
+
+    :param name: node name
+    :type name: str or None
+    :param parent: The parent node of this node.
+    :type parent: Node or None
+    :param parameters: dictionary of input parameters.
+    :type parameters: dict or None
+    :param data: Dictionary containing node data.
+    :type data: dict or None
+    :param treedict: Dictionary specifying a complete tree.
+    :type treedict: dict or None
+    :param funcname: name of `pflacs` plugin funcion/module to be used dby this calculation node.
+    :type funcname: str or None
+    :param argmap: optional mapping for names of function arguments and return values.
+    :type argmap: dict or None
+    :param sweep: swept parameters, `{parameter name: list of values}`.
+    :type sweep: dict or None
+    :param product: `True` to sweep all combinations (full-factorial grid)
+        of the values, `False` if the sweep lists are columns of equal length.
+    :type product: bool
+    :param chunksize: maximum number of rows in each function call.
+    :type chunksize: int or None
+    """
+    _sweep = NodeAttr()
+    _product = NodeAttr()
+    _chunksize = NodeAttr()
+
+    def __init__(self, name=None, parent=None, parameters=None,
+                data=None, treedict=None, funcname=None, argmap=None,
+                kwargs=None, sweep=None, product=True, chunksize=None):
+        # checked before the node joins the tree
+        for _k, _v in (sweep or {}).items():
+            if np.size(_v) == 0:
+                raise ValueError("%s.__init__: node «%s» sweep list «%s» is empty." % (self.__class__.__name__, name, _k))
+        if chunksize is not None and chunksize <= 0:
+            raise ValueError("%s.__init__: node «%s» arg «chunksize»=«%s» must be positive." % (self.__class__.__name__, name, chunksize))
+        super().__init__(name, parent, parameters=parameters, data=data,
+                        treedict=treedict, funcname=funcname, argmap=argmap,
+                        kwargs=kwargs)
+        if treedict is None or sweep is not None:
+            self._sweep = {_k: np.asarray(_v) for _k, _v in sweep.items()} if sweep else {}
+            self._product = product
+            self._chunksize = chunksize
+        elif self._arguments is not None and not set(self._sweep) <= set(self._arguments):
+            self._arguments.update(self.sweep_columns())
+
+
+    def to_treedict(self, *args, **kwargs):
+        _dct = super().to_treedict(*args, **kwargs)
+        if self._arguments and self._sweep:
+            # the swept columns are re-built from `_sweep`, see `__init__`
+            _dct["data"] = dict(_dct["data"])
+            _dct["data"]["_arguments"] = {_k: _v for _k, _v in self._arguments.items()
+                                            if _k not in self._sweep}
+        return _dct
+
+
+    def sweep_columns(self):
+        """Return the sweep rows as columns, `{parameter name: ndarray}`."""
+        _names = list(self._sweep)
+        _lists = [np.asarray(self._sweep[_k]) for _k in _names]
+        if self._product:
+            _cols = param_sweep(*_lists)
+        else:
+            if len(set(len(_l) for _l in _lists)) > 1:
+                raise ValueError("%s.sweep_columns: node «%s» sweep lists must have equal length when «product» is False." % (self.__class__.__name__, self.name))
+            _cols = _lists
+        return dict(zip(_names, _cols))
+
+
+    def __call__(self, *args, **kwargs):
+        _xkwargs = self._kwargs.copy() if self._kwargs else {}
+        if kwargs:
+            _xkwargs.update(copy.deepcopy(kwargs))
+        if not isinstance(self._funcname, str):
+            return False
+        self._internals = {}
+        self._arguments = {}
+        self._df = None
+        _func = getattr(self, self._funcname, None)
+        _pfunc = getattr(_func, "__func__", None)
+        if not isinstance(_pfunc, PflacsFunc):
+            logger.error("%s.__call__: node «%s» function «%s» not callable." % (self.__class__.__name__, self.name, _func))
+            return False
+        _columns = self.sweep_columns()
+        _nrows = len(next(iter(_columns.values()))) if _columns else 1
+        # the sweep columns are not copied, see `_bind`
+        _bound = _pfunc._bind(self, args, {**_xkwargs, **_columns}, copy_kwargs=False)
+        if _bound is None:
+            return False
+        _args, _kwargs, _applied_args, _retspec = _bound
+        self._arguments.update(_applied_args)
+        _argmap = _pfunc._applied_argmap(self)
+        _swept = [_a for _a in _kwargs if _argmap.get(_a, _a) in _columns]
+        _chunksize = self._chunksize or _nrows
+        _results = []
+        for _start in range(0, _nrows, _chunksize):
+            _stop = min(_start + _chunksize, _nrows)
+            _ckwargs = dict(_kwargs)
+            for _a in _swept:
+                _ckwargs[_a] = _kwargs[_a][_start:_stop]
+            _results.append(_memo_call(self, _pfunc._func, _args, _ckwargs,
+                                    call=functools.partial(self._call_chunk, 
+                                        _pfunc._func, _args, _ckwargs, 
+                                        _swept, _stop - _start),
+                                    tag="sweep"))
+        _result = _concat_results(_results)
+        if self._return2attr:
+            _pfunc._store_result(self, _result, _retspec)
+        self._tcache.called(self, ok=bool(self._internals) or not self._return2attr)
+        return _result
+
 
+    def _call_chunk(self, func, args, kwargs, swept, nrows):
+        """Call `func` on a chunk of the sweep, with arrays if possible,
+        otherwise row by row."""
+        try:
+            _result = func(*args, **kwargs)
+        except Exception as err:
+            logger.info("%s._call_chunk: node «%s» function «%s» not vectorizable, calling for each row: %s" % (self.__class__.__name__, self.name, func.__name__, err))
+        else:
+            if _has_rows(_result, nrows):
+                return _result
+        _rows = []
+        for ii in range(nrows):
+            _rkwargs = dict(kwargs)
+            for _a in swept:
+                _rkwargs[_a] = kwargs[_a][ii]
+            _rows.append(func(*args, **_rkwargs))
+        return _stack_rows(_rows)
+
+
+def _sidecar_data(data, dpath, threshold, keys):
+    """Return a copy of node `data` with the values larger than `threshold`
+    saved in sidecar directory `dpath`; `data` is not changed.  The 
+    file names are added to set `keys`."""
+    _data = dict(data)
+
+    def _write(value):
+        _ref = sidecar.write_value(dpath, uuid.uuid4().hex, value)
+        keys.add(_ref.key)
+        return _ref
+
+    if isinstance(data.get("params"), dict):
+        _params = {}
+        for _name, _pdict in data["params"].items():
+            if (isinstance(_pdict, dict) and "value" in _pdict and 
+                    sidecar.nbytes(_pdict["value"]) > threshold):
+                _pdict = dict(_pdict)
+                _pdict["value"] = _write(_pdict["value"])
+            _params[_name] = _pdict
+        _data["params"] = _params
+    for _ns in ("_arguments", "_internals"):
+        if isinstance(data.get(_ns), dict):
+            _values = {}
+            for _k, _v in data[_ns].items():
+                if sidecar.nbytes(_v) > threshold:
+                    _v = _write(_v)
+                _values[_k] = _v
+            _data[_ns] = _values
+    return _data
+
+
+def _has_rows(result, nrows):
+    if isinstance(result, dict):
+        return all(_has_rows(_v, nrows) for _v in result.values())
+    if isinstance(result, tuple):
+        return all(_has_rows(_v, nrows) for _v in result)
+    return np.ndim(result) > 0 and np.shape(result)[0] == nrows
+
+
+def _stack_rows(rows):
+    """Convert a list of row results to array(s)."""
+    if rows and isinstance(rows[0], dict):
+        return {_k: np.array([_r[_k] for _r in rows]) for _k in rows[0]}
+    if rows and isinstance(rows[0], tuple):
+        return tuple(np.array(_c) for _c in zip(*rows))
+    return np.array(rows)
+
+
+def _concat_results(results):
+    """Concatenate the array result(s) of the sweep chunks."""
+    if len(results) == 1:
+        return results[0]
+    if isinstance(results[0], dict):
+        return {_k: np.concatenate([_r[_k] for _r in results]) for _k in results[0]}
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(_c) for _c in zip(*results))
+    return np.concatenate(results)
+
+
+def _memo_call(node, func, args, kwargs, call=None, tag=""):
+    """Return `func(*args, **kwargs)` (or `call()`), from the memo cache 
+    of the tree of `node` if the tree functions are memoized."""
+    _memo = getattr(getattr(node, "_tcache", None), "memo", None)
+    if _memo is None:
+        return call() if call else func(*args, **kwargs)
+    try:
+        _key = hashing.digest(tag, hashing.function_digest(func), args, kwargs)
+    except Exception as err:
+        logger.debug("_memo_call: function «%s» arguments not hashable, not memoized: %s" % (func, err))
+        return call() if call else func(*args, **kwargs)
+    _hit, _result = _memo.get(_key)
+    if not _hit:
+        _result = call() if call else func(*args, **kwargs)
+        _memo.put(_key, getattr(func, "__qualname__", repr(func)), _result)
+    return _result
+
+
+def _node_class(clsname):
+    """Return the node class named `clsname`, a class of this module or
+    a sub-class of `Premise` defined elsewhere (e.g. `SubProc`)."""
+    _cls = getattr(sys.modules[__name__], clsname, None)
+    if isinstance(_cls, type) and issubclass(_cls, Node):
+        return _cls
+    _stack = [Premise]
+    while _stack:
+        _cls = _stack.pop()
+        if _cls.__name__ == clsname:
+            return _cls
+        _stack.extend(_cls.__subclasses__())
+    raise AttributeError("node class «{}» not found.".format(clsname))
+
+
+def _object_array(values):
+    "1-D object array of `values` (nodes are iterable, so not `np.array`)"
+    _arr = np.empty(len(values), dtype=object)
+    for ii, _v in enumerate(values):
+        _arr[ii] = _v
+    return _arr
+
+
+def _parse_predicates(predicates):
+    "list of `(name, op, value)`, from one predicate or a list"
+    if isinstance(predicates, str) or (isinstance(predicates, tuple) and 
+                len(predicates) == 3 and isinstance(predicates[0], str) and
+                predicates[1] in _SELECT_OPS):
+        predicates = [predicates]
+    return [_parse_predicate(_p) for _p in predicates]
+
+
+def _parse_predicate(predicate):
+    """Return `(name, op, value)` of a `Premise.select` predicate, given
+    as a tuple or a string such as `"_unity_check > 0.9"`."""
+    if isinstance(predicate, str):
+        _match = _PREDICATE_RE.match(predicate)
+        if not _match:
+            raise ValueError("Premise.select: predicate «{}» not valid.".format(predicate))
+        _name, _op, _value = _match.groups()
+        try:
+            _value = ast.literal_eval(_value)
+        except (ValueError, SyntaxError):
+            pass  # a string without quotes
+    else:
+        _name, _op, _value = predicate
+    if _op not in _SELECT_OPS:
+        raise ValueError("Premise.select: operator «{}» not in {}.".format(_op, tuple(_SELECT_OPS)))
+    return _name, _op, _value
+
+
+def _is_calc(node):
+    """`True` for the calculation nodes called by `Premise.update`."""
+    return isinstance(node, Calc) and not isinstance(node, Table)
+
+
+def _update_branch(branch):
+    """Call the `Calc` nodes of a calculation branch in tree order."""
+    for _n in branch:
+        if _is_calc(_n):
+            _n()
+
+
+def _update_branch_process(payload):
+    """Re-build a calculation branch in a worker process, call its `Calc`
+    nodes and return their `(_arguments, _internals)` in tree order.
+    `payload` is `(branch treedict, inherited params, plugins)`."""
+    _branch = _build_branch(*payload)
+    _update_branch(_branch)
+    return [(_n._arguments, _n._internals) for _n in _branch if _is_calc(_n)]
+
+
+def _build_branch(treedict, params, plugins):
+    """Build a branch from its treedict (adopted), under a base node with
+    the `params` that it inherits and the `plugins` functions of the tree.
+    Returns the branch root node."""
+    _base = Premise(data={"params": params})
+    for _plug in plugins:
+        _base.plugin_func(*_plug)
+    _clsname = treedict["data"].get("_clsname")
+    _nodecls = _node_class(_clsname) if _clsname else Calc
+    with _adopting():
+        return _nodecls(parent=_base, treedict=treedict)
 
 
 
@@ -10,7 +10,74 @@ import subprocess
 
 logger = logging.getLogger(__name__)
 
-from .pflacs import Premise, NodeAttr, _empty
+from .pflacs import Premise, NodeAttr, _empty, _memo_call
+
+
+class _FuncInfo:
+    """The resolved callable of a `PyFunc` function, its signature and the
+    required args/kwargs names (for each `argmap`), shared by all the nodes
+    calling the function."""
+
+    def __init__(self, function):
+        self.function = function
+        self.signature = inspect.signature(function)
+        self._required = {}
+
+    def required(self, argmap=None):
+        """Return the tuples `(req_args, req_kwargs)` of names of the
+        function arguments, mapped by `argmap`."""
+        _key = tuple(sorted(argmap.items())) if argmap else ()
+        if _key not in self._required:
+            _req_args = []
+            _req_kwargs = []
+            for _param in self.signature.parameters.values():
+                if argmap and _param.name in argmap:
+                    _pname = argmap[_param.name]
+                else:
+                    _pname = _param.name
+                if (_param.kind == inspect.Parameter.POSITIONAL_ONLY):
+                    _req_args.append(_pname)
+                else:
+                    _req_kwargs.append(_pname)
+            self._required[_key] = (tuple(_req_args), tuple(_req_kwargs))
+        return self._required[_key]
+
+
+# process-wide registry {(funcname, module): _FuncInfo}
+_functions = {}
+# entries of the functions given to `plugin_func` {function: _FuncInfo}
+_plugged = {}
+
+
+def _func_info(funcname, function=None):
+    """Return the registry entry of function `funcname`, a `(name, module)`
+    tuple.  The module is imported only if the function is not yet
+    registered and `function` is not given.
+
+    A given `function` has its own entry, so that functions with the same
+    name and module (closures, or functions defined in `__main__`) are 
+    not confused; the entry of the name is the last one given, used by
+    the nodes of a tree opened from a file."""
+    _key = tuple(funcname)
+    _info = _functions.get(_key)
+    if function is not None:
+        if _info is not None and _info.function is not function:
+            logger.warning("_func_info: function «%s» of module «%s» replaces another function of the same name, nodes rebuilt from a file will call the last one." % _key)
+        _info = _plugged.get(function)
+        if _info is None:
+            _info = _plugged[function] = _FuncInfo(function)
+        _functions[_key] = _info
+    elif _info is None:
+        _mod = importlib.import_module(_key[1])
+        _info = _functions[_key] = _FuncInfo(getattr(_mod, _key[0]))
+    return _info
+
+
+def clear_func_registry():
+    """Clear the registry of `PyFunc` functions, for example after a
+    function module has been reloaded."""
+    _functions.clear()
+    _plugged.clear()
 
 
 class PyFunc(Premise):
@@ -41,6 +108,9 @@ class PyFunc(Premise):
     #_stdout = NodeAttr()
     #_stderr = NodeAttr()
     _timestamp = NodeAttr("vn")
+    # shared function data, not saved (older trees may hold the last three)
+    _transient_attrs = Premise._transient_attrs + ("_funcinfo", "_function",
+                                                "_req_args", "_req_kwargs")
 
     def __init__(self, name=None, parent=None, parameters=None,
                 data=None, treedict=None, function=None, 
@@ -66,31 +136,28 @@ class PyFunc(Premise):
     def plugin_func(self, function=None):
         """Plugin a Python function that will be called on this node
         instance specifically (not patched into class).
+
+        The function, its signature and the required arguments are
+        looked up in a process-wide registry, so that nodes calling the 
+        same function share them.
         """
         if function:
             if callable(function):
                 self._funcname = (function.__name__, function.__module__)
-                self._function = function
             else:
                 logger.error("%s.plugin_func: argument «function» must be callable, «%s» is %s." % (self.__class__.__name__, function, type(function)))
-        else:
-            _mod = importlib.import_module(self._funcname[1])
-            self._function = getattr(_mod, self._funcname[0])
-        _sig = inspect.signature(self._function)
-        self._req_args = []
-        self._req_kwargs = []
-        for _param in _sig.parameters.values():
-            if self._argmap and _param.name in self._argmap:
-                _pname = self._argmap[_param.name]
-            else:
-                _pname = _param.name
-            if (_param.kind == inspect.Parameter.POSITIONAL_ONLY):
-                self._req_args.append(_pname)
-            else:
-                self._req_kwargs.append(_pname)
+                return
+        if self._funcname is None:
+            return
+        self._funcinfo = _func_info(self._funcname, function)
+        self._req_args, self._req_kwargs = self._funcinfo.required(self._argmap)
 
         #setattr(self, _methodname, _function)
 
+    @property
+    def _function(self):
+        return self._funcinfo.function
+
 
     def __call__(self, *args, **kwargs):
         _args = list(args)
@@ -109,7 +176,7 @@ class PyFunc(Premise):
         for _k, _v in _xkwargs.items():
             if _v is _empty:
                 _xkwargs[_k] = getattr(self, _k)
-        _ret = self._function(*_args, **_xkwargs)
+        _ret = _memo_call(self, self._function, _args, _xkwargs)
         return _ret
         # print(f"{self.__class__.__name__}:{self.name} args={args}")
         # print(f"{self.__class__.__name__}:{self.name} _xkwargs={_xkwargs}")
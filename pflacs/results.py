@@ -0,0 +1,323 @@
+"""Columnar store for the results of `pflacs` calculation nodes.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class ResultStore:
+    """Columnar store of the arguments and results of the calculation
+    nodes in a `pflacs` tree.
+
+    There is one NumPy column for each argument/result name, and the rows
+    of each node are keyed by the node `_nodeid`.  `Calc` nodes append
+    their rows when they are called; the rows of a node that is called
+    again are replaced (the old rows are dropped when the store is
+    compacted).  Columns of numeric values keep their NumPy dtype; missing
+    values are `NaN` (`int` and `bool` columns are converted to `float`)
+    or `None` for other values.  The columns are pre-filled with their
+    missing value, so that appending rows only writes the columns of the
+    node.
+
+    `Calc` nodes add their rows with :meth:`defer`: they are appended
+    when the store is next read, so that a node called repeatedly is only
+    appended once.
+
+    The store of a tree is `Premise.result_store`.
+
+    :param capacity: initial number of rows.
+    :type capacity: int
+    """
+
+    def __init__(self, capacity=64):
+        self._lock = threading.RLock()
+        self._size = 0
+        self._capacity = max(1, capacity)
+        self.nodeids = np.empty(self._capacity, dtype=object)
+        self.valid = np.zeros(self._capacity, dtype=bool)
+        self.columns = {}
+        self.rows = {}   # nodeid: (slice, column names)
+        self._exact = set()  # int/bool columns, without missing values
+        self._pending = {}   # nodeid: data, see defer
+        self._ninvalid = 0
+
+
+    def __len__(self):
+        self.flush()
+        return self._size - self._ninvalid
+
+
+    def __contains__(self, nodeid):
+        return nodeid in self.rows or nodeid in self._pending
+
+
+    def defer(self, nodeid, data):
+        """Add the rows of a node, as :meth:`append`, when the store is
+        next read.  Replaces any pending rows of the same node."""
+        with self._lock:
+            self._pending[nodeid] = data
+
+
+    def flush(self):
+        """Append the pending rows, see :meth:`defer`."""
+        if not self._pending:
+            return
+        with self._lock:
+            while self._pending:
+                _nodeid = next(iter(self._pending))
+                self.append(_nodeid, self._pending[_nodeid])
+
+
+    def append(self, nodeid, data):
+        """Add the rows of a node, replacing any rows of the same node.
+
+        The values in `data` that are 1-D arrays (or lists) of the same
+        length are columns; other values are repeated in each row.
+
+        :param nodeid: the `_nodeid` of the node.
+        :type nodeid: str
+        :param data: `{name: value}`, e.g. `{**_arguments, **_internals}`.
+        :type data: dict
+        :returns: the node rows.
+        :rtype: slice
+        """
+        _values, _nrows = self._rowvalues(data)
+        with self._lock:
+            self._pending.pop(nodeid, None)
+            self.discard(nodeid)
+            self._reserve(_nrows)
+            _start = self._size
+            _stop = _start + _nrows
+            _slice = slice(_start, _stop)
+            for _name in self._exact.difference(_values):
+                self._missing(_name)
+            for _name, _arr in _values.items():
+                _col = self._column(_name, _arr.dtype)
+                _col[_slice] = _arr
+            self.nodeids[_slice] = nodeid
+            self.valid[_slice] = True
+            self._size = _stop
+            self.rows[nodeid] = (_slice, tuple(_values))
+        return _slice
+
+
+    def discard(self, nodeid):
+        """Remove the rows of a node."""
+        with self._lock:
+            self._pending.pop(nodeid, None)
+            _rows = self.rows.pop(nodeid, None)
+            if _rows is None:
+                return
+            _slice = _rows[0]
+            self.valid[_slice] = False
+            self._ninvalid += _slice.stop - _slice.start
+            if self._ninvalid > self._size // 2 and self._ninvalid > 64:
+                self.compact()
+
+
+    def compact(self):
+        """Drop the rows that have been replaced or discarded."""
+        with self._lock:
+            _keep = np.flatnonzero(self.valid[:self._size])
+            _capacity = max(64, 2 * len(_keep))
+            _newpos = np.empty(self._size, dtype=np.int64)
+            _newpos[_keep] = np.arange(len(_keep))
+            for _name, _col in self.columns.items():
+                _new = _empty_column(_col.dtype, _capacity)
+                _new[:len(_keep)] = _col[_keep]
+                self.columns[_name] = _new
+            _nodeids = np.empty(_capacity, dtype=object)
+            _nodeids[:len(_keep)] = self.nodeids[_keep]
+            self.nodeids = _nodeids
+            self.valid = np.zeros(_capacity, dtype=bool)
+            self.valid[:len(_keep)] = True
+            for _nodeid, (_slice, _names) in self.rows.items():
+                _start = int(_newpos[_slice.start])
+                self.rows[_nodeid] = (slice(_start, _start + _slice.stop - _slice.start), _names)
+            self._capacity = _capacity
+            self._size = len(_keep)
+            self._ninvalid = 0
+
+
+    def node_columns(self, nodeid):
+        """Return the columns of a node, `{name: ndarray}`, as views of the
+        store columns.
+
+        :param nodeid: the `_nodeid` of the node.
+        :type nodeid: str
+        :returns: the node columns, or `None` if the node has no rows.
+        :rtype: dict or None
+        """
+        with self._lock:
+            self.flush()
+            _rows = self.rows.get(nodeid)
+            if _rows is None:
+                return None
+            _slice, _names = _rows
+            return {_name: self.columns[_name][_slice] for _name in _names}
+
+
+    def frame(self, nodeid):
+        """Return the rows of a node as a `pandas.DataFrame` of views of
+        the store columns (no copy).
+
+        :param nodeid: the `_nodeid` of the node.
+        :type nodeid: str
+        :returns: the node rows, or `None` if the node has no rows.
+        :rtype: pandas.DataFrame or None
+        """
+        _cols = self.node_columns(nodeid)
+        if _cols is None:
+            return None
+        return pd.DataFrame(_cols, copy=False)
+
+
+    def column(self, name):
+        """Return the values of a column in all the (current) rows.
+
+        :param name: the column name.
+        :type name: str
+        :returns: `(nodeids, values)`
+        :rtype: tuple
+        """
+        with self._lock:
+            self.flush()
+            _mask = self.valid[:self._size]
+            return self.nodeids[:self._size][_mask], self.columns[name][:self._size][_mask]
+
+
+    def to_dataframe(self, columns=None):
+        """Return all the (current) rows as a `pandas.DataFrame`, with the
+        node id in column `nodeid`.
+
+        :param columns: the names of the columns, by default all columns.
+        :type columns: list or None
+        :rtype: pandas.DataFrame
+        """
+        with self._lock:
+            self.flush()
+            _mask = self.valid[:self._size]
+            _data = {"nodeid": self.nodeids[:self._size][_mask]}
+            for _name in (self.columns if columns is None else columns):
+                _data[_name] = self.columns[_name][:self._size][_mask]
+        return pd.DataFrame(_data)
+
+
+    @staticmethod
+    def _rowvalues(data):
+        _nrows = None
+        for _val in data.values():
+            if isinstance(_val, (np.ndarray, pd.Series)):
+                _isrows = np.ndim(_val) == 1
+            else:
+                _isrows = isinstance(_val, (list, tuple)) and _is_flat(_val)
+            if _isrows:
+                _nrows = len(_val)
+                break
+        if _nrows is None:
+            _nrows = 1
+        _values = {}
+        for _name, _val in data.items():
+            _arr = None
+            if isinstance(_val, (list, tuple, np.ndarray, pd.Series)):
+                if len(_val) == _nrows and (isinstance(_val, (np.ndarray, pd.Series))
+                                            or _is_flat(_val)):
+                    _arr = np.asarray(_val)
+                    if _arr.ndim != 1:
+                        _arr = None
+            elif np.isscalar(_val) or _val is None:
+                _arr = np.asarray(_val)
+                if _arr.dtype.kind not in "biufc":
+                    _arr = None
+                else:
+                    _arr = np.repeat(_arr, _nrows)
+            if _arr is None or _arr.dtype.kind not in "biufc":
+                _obj = np.empty(_nrows, dtype=object)
+                if _arr is not None:
+                    _obj[:] = _arr
+                else:
+                    for ii in range(_nrows):
+                        _obj[ii] = _val
+                _arr = _obj
+            _values[str(_name)] = _arr
+        return _values, _nrows
+
+
+    def _reserve(self, nrows):
+        if self._size + nrows <= self._capacity:
+            return
+        _capacity = max(2 * self._capacity, self._size + nrows)
+        for _name, _col in self.columns.items():
+            _new = _empty_column(_col.dtype, _capacity)
+            _new[:self._size] = _col[:self._size]
+            self.columns[_name] = _new
+        _nodeids = np.empty(_capacity, dtype=object)
+        _nodeids[:self._size] = self.nodeids[:self._size]
+        self.nodeids = _nodeids
+        _valid = np.zeros(_capacity, dtype=bool)
+        _valid[:self._size] = self.valid[:self._size]
+        self.valid = _valid
+        self._capacity = _capacity
+
+
+    def _column(self, name, dtype):
+        """Return column `name`, converted if necessary to hold `dtype`."""
+        _col = self.columns.get(name)
+        if _col is not None and _col.dtype == dtype:
+            return _col
+        if _col is None:
+            if self._size:
+                dtype = _missing_dtype(dtype)
+            _col = _empty_column(dtype, self._capacity)
+            self.columns[name] = _col
+        else:
+            if _col.dtype.kind in "biufc" and dtype.kind in "biufc":
+                _dtype = np.result_type(_col.dtype, dtype)
+            else:
+                _dtype = np.dtype(object)
+            if _dtype != _col.dtype:
+                _col = self._convert(name, _dtype)
+        if _col.dtype != _missing_dtype(_col.dtype):
+            self._exact.add(name)
+        else:
+            self._exact.discard(name)
+        return _col
+
+
+    def _missing(self, name):
+        "convert column `name` to hold missing values"
+        self._convert(name, _missing_dtype(self.columns[name].dtype))
+        self._exact.discard(name)
+
+
+    def _convert(self, name, dtype):
+        "convert column `name` to `dtype`, the rows after the current rows are missing"
+        _col = _empty_column(dtype, self._capacity)
+        _col[:self._size] = self.columns[name][:self._size]
+        self.columns[name] = _col
+        return _col
+
+
+def _is_flat(values):
+    "`True` if list `values` has no nested sequences"
+    return not any(isinstance(_v, (list, tuple, dict, set, np.ndarray)) for _v in values)
+
+
+def _empty_column(dtype, capacity):
+    "new column filled with missing values, `NaN` or `None` (not `int`/`bool`)"
+    if dtype.kind in "fc":
+        return np.full(capacity, np.nan, dtype=dtype)
+    return np.empty(capacity, dtype=dtype)
+
+
+def _missing_dtype(dtype):
+    "dtype of a column with missing values"
+    if dtype.kind in "fc" or dtype.kind == "O":
+        return dtype
+    if dtype.kind in "biu":
+        return np.dtype(float)
+    return np.dtype(object)
@@ -0,0 +1,140 @@
+"""On-disk cache of the runs of `SubProc` commands.
+
+A run is cached in a directory named by its key, a hash of the command,
+the resolved parameters and the content of the input files of the node
+(see `SubProc`).  The directory holds `meta.pkl`, the output recorded on
+the node (return code, output tail, extracted params), and copies of
+the log files and of the output files of the run.
+
+The cache size is limited: the least recently used runs are removed
+when the total size is larger than `max_bytes`.
+"""
+import logging
+import os
+import pathlib
+import pickle
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class RunCache:
+    """Content-addressed cache of `SubProc` runs.
+
+    :param dpath: the cache directory.
+    :type dpath: str
+    :param max_bytes: maximum total size of the cached runs.
+    :type max_bytes: int
+    """
+
+    def __init__(self, dpath, max_bytes=2**30):
+        self.dpath = pathlib.Path(dpath)
+        self.max_bytes = max_bytes
+        self.dpath.mkdir(parents=True, exist_ok=True)
+
+
+    def get(self, key):
+        """Return the `meta` dict of run `key`, or `None` if not cached.
+        The run is marked as used."""
+        _meta_fpath = self.dpath / key / "meta.pkl"
+        try:
+            with open(_meta_fpath, "rb") as _fh:
+                _meta = pickle.load(_fh)
+            _touch(_meta_fpath)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning("%s.get: run «%s» not valid, removed: %s" % (self.__class__.__name__, key, err))
+            shutil.rmtree(self.dpath / key, ignore_errors=True)
+            return None
+        return _meta
+
+
+    def put(self, key, meta, files, replace=False):
+        """Cache run `key`.  A run already cached (e.g. by another job) 
+        is kept, unless `replace`.
+
+        :param meta: the run data, must be picklable.
+        :type meta: dict
+        :param files: `{name: path}` of the files of the run, copied to
+            the cache as `name`.
+        :type files: dict
+        :param replace: replace the cached run `key`, if any.
+        :type replace: bool
+        """
+        _tmp = self.dpath / ".{}.{}".format(key, uuid.uuid4().hex)
+        _tmp.mkdir()
+        try:
+            _size = 0
+            for _name, _fpath in files.items():
+                shutil.copyfile(_fpath, _tmp / _name)
+                _size += os.path.getsize(_tmp / _name)
+            meta = dict(meta, files=sorted(files), size=_size, time=time.time())
+            with open(_tmp / "meta.pkl", "wb") as _fh:
+                pickle.dump(meta, _fh)
+            _touch(_tmp / "meta.pkl")
+            _old = None
+            if replace and (self.dpath / key).exists():
+                # a directory cannot replace a non-empty directory
+                _old = self.dpath / ".{}.{}".format(key, uuid.uuid4().hex)
+                os.replace(self.dpath / key, _old)
+            os.replace(_tmp, self.dpath / key)
+            if _old is not None:
+                shutil.rmtree(_old, ignore_errors=True)
+        except OSError as err:
+            # e.g. the same run cached by another job
+            logger.debug("%s.put: run «%s» not cached: %s" % (self.__class__.__name__, key, err))
+            shutil.rmtree(_tmp, ignore_errors=True)
+            return False
+        self.evict()
+        return True
+
+
+    def restore(self, key, name, fpath):
+        """Copy file `name` of run `key` to `fpath`."""
+        _fpath = pathlib.Path(fpath)
+        _fpath.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.dpath / key / name, _fpath)
+
+
+    def entries(self):
+        """Return `[(last used time (ns), size, key)]` of the cached runs."""
+        _entries = []
+        for _dpath in self.dpath.iterdir():
+            _meta_fpath = _dpath / "meta.pkl"
+            if _dpath.name.startswith(".") or not _meta_fpath.is_file():
+                continue
+            _size = sum(_f.stat().st_size for _f in _dpath.iterdir())
+            _entries.append((_meta_fpath.stat().st_mtime_ns, _size, _dpath.name))
+        return _entries
+
+
+    def evict(self):
+        """Remove the least recently used runs until the cache size is
+        at most `max_bytes`.  Returns the number of runs removed."""
+        _entries = sorted(self.entries())
+        _total = sum(_e[1] for _e in _entries)
+        _count = 0
+        for _used, _size, _key in _entries:
+            if _total <= self.max_bytes:
+                break
+            shutil.rmtree(self.dpath / _key, ignore_errors=True)
+            _total -= _size
+            _count += 1
+        return _count
+
+
+    def clear(self):
+        """Remove all the cached runs."""
+        for _dpath in self.dpath.iterdir():
+            if _dpath.is_dir():
+                shutil.rmtree(_dpath, ignore_errors=True)
+
+
+def _touch(fpath):
+    "set the modification time (the last use of a run) to now"
+    # explicit time, the file system clock can be too coarse for LRU order
+    _now = time.time_ns()
+    os.utime(fpath, ns=(_now, _now))
@@ -0,0 +1,169 @@
+"""JSON serialization backends for `pflacs` trees, see `Premise.to_json`.
+
+The `orjson` backend is used when `orjson` is installed, otherwise the
+standard library `json` module.  Both write the same JSON, so a file
+written with one backend can be read with the other.  `orjson` cannot
+write float `NaN` and `inf` values (it writes `null`), so for the orjson
+backend they are written as `{"__float__": "nan"}` (see 
+:func:`encode_nonfinite`); `Premise.to_json` encodes them in the 
+parameter values and calculation results, and in NumPy arrays and scalars.
+
+Other backends can be added with :func:`register_serializer`.
+"""
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError as err:
+    logger.debug("orjson not installed, using json: %s" % (err,))
+    orjson = None
+
+
+class JSONSerializer:
+    """Serializer using the standard library `json` module.
+
+    A serializer has a `name`, and methods `dumps(obj, default)` returning
+    `bytes`, `loads(data, object_hook, keys)`, and `array(arr)` returning a
+    native encoding of NumPy array `arr`, or `None` if not supported.
+    `keys` are the keys of the dicts that `object_hook` decodes, `None`
+    if the hook must be applied to all the dicts.  `nonfinite` is `False`
+    if the backend cannot write float `NaN` and `inf`; they must then be
+    encoded with :func:`encode_nonfinite` before `dumps`.
+    """
+    name = "json"
+    nonfinite = True
+
+    def dumps(self, obj, default):
+        return json.dumps(obj, default=default).encode("utf-8")
+
+    def loads(self, data, object_hook, keys=None):
+        return json.loads(data, object_hook=object_hook)
+
+    def array(self, arr):
+        return None
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Serializer using `orjson`; arrays are encoded natively by
+    `orjson` if it supports `orjson.Fragment` (version 3.9 or later)."""
+    name = "orjson"
+    nonfinite = False
+
+    def dumps(self, obj, default):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data, object_hook, keys=None):
+        try:
+            _obj = orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. NaN written by the json backend
+            return super().loads(data, object_hook)
+        if keys is None:
+            return _apply_hook(_obj, object_hook)
+        _encoded = [_k.encode("utf-8") if isinstance(data, bytes) else _k 
+                    for _k in keys]
+        if any(_k in data for _k in _encoded):
+            return _apply_hook(_obj, object_hook, frozenset(keys))
+        return _obj
+
+    def array(self, arr):
+        _fragment = getattr(orjson, "Fragment", None)
+        if _fragment is None:
+            return None
+        try:
+            return _fragment(orjson.dumps(arr, option=orjson.OPT_SERIALIZE_NUMPY))
+        except orjson.JSONEncodeError:
+            return None
+
+
+SERIALIZERS = {JSONSerializer.name: JSONSerializer}
+if orjson is not None:
+    SERIALIZERS[OrjsonSerializer.name] = OrjsonSerializer
+
+
+def register_serializer(cls):
+    """Add serializer class `cls` to the available backends, by `cls.name`."""
+    SERIALIZERS[cls.name] = cls
+    return cls
+
+
+def get_serializer(name=None):
+    """Return a serializer instance.
+
+    :param name: backend name, `None` for the fastest available backend.
+    :type name: str or None
+    :rtype: JSONSerializer
+    """
+    if name is None:
+        name = OrjsonSerializer.name if OrjsonSerializer.name in SERIALIZERS else JSONSerializer.name
+    if name not in SERIALIZERS:
+        raise ValueError("get_serializer: serializer «{}» not available, {}.".format(name, sorted(SERIALIZERS)))
+    return SERIALIZERS[name]()
+
+
+def encode_nonfinite(obj):
+    """Return `obj` with the non-finite float values (in dicts, lists and
+    tuples) replaced by `{"__float__": "nan"}` (or `"inf"`, `"-inf"`).
+    Only the containers holding such a value are copied, `obj` is 
+    returned unchanged if there is none."""
+    if isinstance(obj, float):
+        if math.isfinite(obj):
+            return obj
+        return {"__float__": repr(float(obj))}
+    if isinstance(obj, dict):
+        _new = None
+        for _k, _v in obj.items():
+            if isinstance(_v, float):
+                if math.isfinite(_v):
+                    continue
+                _enc = {"__float__": repr(float(_v))}
+            elif isinstance(_v, (dict, list, tuple)):
+                _enc = encode_nonfinite(_v)
+                if _enc is _v:
+                    continue
+            else:
+                continue
+            if _new is None:
+                _new = dict(obj)
+            _new[_k] = _enc
+        return obj if _new is None else _new
+    if isinstance(obj, (list, tuple)):
+        _new = None
+        for ii, _v in enumerate(obj):
+            if isinstance(_v, float):
+                if math.isfinite(_v):
+                    continue
+                _enc = {"__float__": repr(float(_v))}
+            elif isinstance(_v, (dict, list, tuple)):
+                _enc = encode_nonfinite(_v)
+                if _enc is _v:
+                    continue
+            else:
+                continue
+            if _new is None:
+                _new = list(obj)
+            _new[ii] = _enc
+        return obj if _new is None else _new
+    return obj
+
+
+def _apply_hook(obj, object_hook, keys=None):
+    """Apply `object_hook` to the dicts in `obj`, inner dicts first, as
+    `json.loads` does; with `keys`, only to the dicts with one of `keys`."""
+    if isinstance(obj, dict):
+        if "__ndarray__" not in obj:
+            for _k, _v in obj.items():
+                if isinstance(_v, (dict, list)):
+                    obj[_k] = _apply_hook(_v, object_hook, keys)
+        if keys is None or not keys.isdisjoint(obj):
+            return object_hook(obj)
+        return obj
+    if isinstance(obj, list):
+        for ii, _v in enumerate(obj):
+            if isinstance(_v, (dict, list)):
+                obj[ii] = _apply_hook(_v, object_hook, keys)
+    return obj
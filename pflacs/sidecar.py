@@ -0,0 +1,146 @@
+"""Sidecar directory for the large values of a `pflacs` study file.
+
+`Premise.savefile(..., sidecar_threshold=nbytes)` saves parameter values,
+`_arguments` and `_internals` larger than `nbytes` to separate files in
+the sidecar directory (`<study file>.sidecar`), and saves a
+:class:`SidecarRef` in their place in the study file.  The values are
+read when the study file is opened, or with `Premise.openfile(...,
+lazy=True)` when they are first accessed.
+
+NumPy arrays are saved as `.npy` files, and read as read-only 
+memory-mapped arrays (`np.memmap`): opening is zero-copy and the dtype
+is exact.  Assign a new array to change a memory-mapped value.
+"""
+import logging
+import mmap
+import pathlib
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class SidecarRef:
+    """Reference to a value saved in the sidecar directory.
+
+    :param key: the file name of the value in the sidecar directory.
+    :type key: str
+    :param info: short description of the value, type and size.
+    :type info: str
+    """
+    __slots__ = ("key", "info")
+
+    def __init__(self, key, info=""):
+        self.key = key
+        self.info = info
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(self.__class__.__name__, self.key, self.info)
+
+
+def sidecar_dpath(fpath):
+    """Return the path of the sidecar directory of study file `fpath`."""
+    if not fpath:
+        return None
+    _fpath = pathlib.Path(fpath)
+    return _fpath.with_name(_fpath.name + ".sidecar")
+
+
+def nbytes(value):
+    """Return the (approximate) size of `value` in bytes."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=False)))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + 8 * len(value)
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    return 0
+
+
+def describe(value):
+    """Return a short description of `value`."""
+    if isinstance(value, np.ndarray):
+        return "ndarray {} {}".format(value.dtype, value.shape)
+    if isinstance(value, pd.DataFrame):
+        return "DataFrame {}".format(value.shape)
+    if hasattr(value, "__len__"):
+        return "{} len={}".format(type(value).__name__, len(value))
+    return type(value).__name__
+
+
+def write_value(dpath, key, value):
+    """Save `value` in the sidecar directory and return its reference.
+    An array memory-mapped from a file in the sidecar directory is not
+    written again."""
+    _fname = mapped_fname(dpath, value)
+    if _fname:
+        return SidecarRef(_fname, describe(value))
+    if is_npy(value):
+        _fpath = write_array(dpath, key, value)
+    else:
+        _fpath = pathlib.Path(dpath) / (key + ".pkl")
+        with open(_fpath, "wb") as _fh:
+            pickle.dump(value, _fh, protocol=pickle.HIGHEST_PROTOCOL)
+    return SidecarRef(_fpath.name, describe(value))
+
+
+def read_value(dpath, ref):
+    """Read the value of reference `ref` from the sidecar directory."""
+    if ref.key.endswith(".npy"):
+        return read_array(dpath, ref.key)
+    with open(pathlib.Path(dpath) / ref.key, "rb") as _fh:
+        return pickle.load(_fh)
+
+
+def is_npy(value):
+    """`True` if `value` is an array that can be saved as a `.npy` file."""
+    return isinstance(value, np.ndarray) and not value.dtype.hasobject
+
+
+def write_array(dpath, key, value):
+    """Save array `value` as a `.npy` file in the sidecar directory."""
+    _fpath = pathlib.Path(dpath) / (key + ".npy")
+    np.save(_fpath, value, allow_pickle=False)
+    return _fpath
+
+
+def read_array(dpath, fname):
+    """Read a `.npy` file from the sidecar directory as a read-only
+    memory-mapped array."""
+    _fpath = pathlib.Path(dpath) / fname
+    try:
+        return np.load(_fpath, mmap_mode="r", allow_pickle=False)
+    except ValueError:  # e.g. empty arrays cannot be memory-mapped
+        return np.load(_fpath, allow_pickle=False)
+
+
+def mapped_fname(dpath, value):
+    """Return the file name of array `value` if it is memory-mapped
+    (unchanged, it is read-only) from a `.npy` file in the sidecar 
+    directory, otherwise `None`."""
+    if not isinstance(value, np.memmap) or not isinstance(value.base, mmap.mmap):
+        return None
+    _fpath = pathlib.Path(value.filename)
+    if _fpath.parent != pathlib.Path(dpath).resolve() or not _fpath.is_file():
+        return None
+    return _fpath.name
+
+
+def clear(dpath, keep=()):
+    """Remove the value files from the sidecar directory.
+
+    :param keep: names of the files to keep.
+    :type keep: set
+    """
+    _dpath = pathlib.Path(dpath)
+    if not _dpath.is_dir():
+        return
+    for _pattern in ("*.pkl", "*.npy"):
+        for _fpath in _dpath.glob(_pattern):
+            if _fpath.name not in keep:
+                _fpath.unlink()
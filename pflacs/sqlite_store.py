@@ -0,0 +1,371 @@
+"""SQLite storage for `pflacs` studies.
+
+A study saved with a `.vn4` file extension (`Premise.savefile("study.vn4")`)
+is stored in a SQLite database, with a row for each node, parameter,
+plugin function and result value.  :class:`SqliteStore` reads and writes
+single parameters and node results, and queries the results, without
+loading the whole tree.  The database uses WAL mode, so that several
+worker processes can write results to the same study concurrently, e.g.
+
+    with SqliteStore("study.vn4") as store:
+        branch = store.open_branch(nodeid)
+        branch.update()
+        store.write_results(branch)
+
+The values are saved as pickles; numeric values are also saved in
+indexed `num` columns for queries, with a result row for each element of
+a 1-D array.
+"""
+import logging
+import pickle
+import sqlite3
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    nodeid TEXT PRIMARY KEY,
+    parentid TEXT,
+    position INTEGER,
+    clsname TEXT,
+    name TEXT,
+    data BLOB,
+    attrs BLOB,
+    arguments BLOB,
+    internals BLOB
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parentid, position);
+CREATE TABLE IF NOT EXISTS params (
+    nodeid TEXT,
+    name TEXT,
+    hasvalue INTEGER,
+    value BLOB,
+    num REAL,
+    pdict BLOB,
+    linkid TEXT,
+    PRIMARY KEY (nodeid, name)
+);
+CREATE INDEX IF NOT EXISTS params_num ON params (name, num);
+CREATE TABLE IF NOT EXISTS plugins (
+    position INTEGER PRIMARY KEY,
+    plugin BLOB
+);
+CREATE TABLE IF NOT EXISTS results (
+    nodeid TEXT,
+    name TEXT,
+    kind TEXT,
+    row INTEGER,
+    num REAL,
+    PRIMARY KEY (nodeid, name, row)
+);
+CREATE INDEX IF NOT EXISTS results_num ON results (name, num);
+"""
+
+# node data saved in other columns and tables
+_DATA_COLS = ("params", "_arguments", "_internals", "plugins")
+
+_OPERATORS = ("<", "<=", ">", ">=", "=", "!=")
+
+
+def _num(value):
+    "value as a float for the `num` columns, or `None`"
+    if isinstance(value, (bool, np.bool_)):
+        return float(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return None
+
+
+def _rows(value):
+    "numeric result rows `[(row, num)]` of a value"
+    if isinstance(value, (list, tuple, np.ndarray)):
+        _arr = np.asarray(value) if not isinstance(value, np.ndarray) else value
+        if _arr.ndim == 1 and _arr.dtype.kind in "biuf":
+            return list(enumerate(_arr.astype(float).tolist()))
+        return []
+    _n = _num(value)
+    return [] if _n is None else [(0, _n)]
+
+
+class SqliteStore:
+    """SQLite database of a `pflacs` study.
+
+    :param fpath: path of the database file (`.vn4`).
+    :type fpath: str
+    :param timeout: seconds to wait for a lock held by another writer.
+    :type timeout: float
+    """
+
+    def __init__(self, fpath, timeout=30.0):
+        self.fpath = fpath
+        self.conn = sqlite3.connect(fpath, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+
+    def save_tree(self, root):
+        """Save the whole tree, replacing the database contents.
+
+        :param root: root node of the tree.
+        :type root: Premise
+        """
+        with self.conn:
+            for _table in ("nodes", "params", "plugins", "results"):
+                self.conn.execute("DELETE FROM {}".format(_table))
+            # re-build the results index after the bulk insert
+            self.conn.execute("DROP INDEX IF EXISTS results_num")
+            self.conn.executemany("INSERT INTO plugins VALUES (?, ?)",
+                    [(ii, pickle.dumps(tuple(_p))) for ii, _p in enumerate(root.plugins or ())])
+            self._save_node(root, 0)
+            for _n in root:
+                for ii, _child in enumerate(_n.childs):
+                    self._save_node(_child, ii)
+            self.conn.execute("CREATE INDEX results_num ON results (name, num)")
+
+
+    def save_nodes(self, nodes):
+        """Save (insert or replace) nodes.  The tree structure must not
+        have changed since the tree was saved, see `save_tree`.
+
+        :param nodes: the nodes.
+        :type nodes: iterable
+        """
+        with self.conn:
+            for _n in nodes:
+                _parent = _n.parent
+                self._save_node(_n, _parent.childs.index(_n) if _parent else 0)
+
+
+    def _save_node(self, node, position):
+        _parent = node.parent
+        _data = {_k: _v for _k, _v in node.data.items() if _k not in _DATA_COLS}
+        _attrs = node.to_treedict(recursive=False)
+        _attrs.pop("data", None)
+        self.conn.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (node._nodeid,
+                _parent._nodeid if _parent is not None else None,
+                position,
+                node.data.get("_clsname"), node.name,
+                pickle.dumps(_data), pickle.dumps(_attrs),
+                pickle.dumps(node.data.get("_arguments")),
+                pickle.dumps(node.data.get("_internals"))))
+        self.conn.execute("DELETE FROM params WHERE nodeid=?", (node._nodeid,))
+        for _name, _pdict in node.data.get("params", {}).items():
+            self._insert_param(node._nodeid, _name, _pdict)
+        self._insert_results(node)
+
+
+    def _insert_param(self, nodeid, name, pdict):
+        _hasvalue = "value" in pdict
+        _value = pdict.get("value")
+        _meta = {_k: _v for _k, _v in pdict.items() if _k != "value"}
+        self.conn.execute("INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (nodeid, name, int(_hasvalue),
+                pickle.dumps(_value) if _hasvalue else None,
+                _num(_value) if _hasvalue else None,
+                pickle.dumps(_meta), pdict.get("linkid")))
+
+
+    def _insert_results(self, node):
+        self.conn.execute("DELETE FROM results WHERE nodeid=?", (node._nodeid,))
+        _rows_ = []
+        for _kind, _ns in (("argument", "_arguments"), ("internal", "_internals")):
+            for _name, _value in (node.data.get(_ns) or {}).items():
+                for _row, _n in _rows(_value):
+                    _rows_.append((node._nodeid, str(_name), _kind, _row, _n))
+        self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", _rows_)
+
+
+    def write_results(self, nodes):
+        """Write the results (`_arguments`, `_internals` and the result
+        parameters) of the calculation nodes in `nodes`, which may be
+        nodes of a branch opened with :meth:`open_branch`.
+
+        :param nodes: the nodes, or the root node of a branch.
+        :type nodes: iterable
+        """
+        with self.conn:
+            for _n in nodes:
+                if _n.data.get("_internals") is None and _n.data.get("_arguments") is None:
+                    continue
+                self.conn.execute("UPDATE nodes SET arguments=?, internals=? WHERE nodeid=?",
+                        (pickle.dumps(_n.data.get("_arguments")),
+                        pickle.dumps(_n.data.get("_internals")), _n._nodeid))
+                for _name in (_n.data.get("_internals") or {}):
+                    _pdict = _n.data["params"].get(_name)
+                    if isinstance(_pdict, dict):
+                        self._insert_param(_n._nodeid, _name, _pdict)
+                self._insert_results(_n)
+
+
+    def get_param(self, nodeid, name, inherit=True):
+        """Return the value of a parameter of a node, inherited from the
+        node ancestors (as `PflacsParam`) if `inherit`.
+
+        :raises KeyError: if the parameter is not defined.
+        """
+        if inherit:
+            _sql = """
+                WITH RECURSIVE anc(nodeid, parentid, depth) AS (
+                    SELECT nodeid, parentid, 0 FROM nodes WHERE nodeid=?
+                    UNION ALL
+                    SELECT n.nodeid, n.parentid, a.depth + 1
+                    FROM nodes n JOIN anc a ON n.nodeid = a.parentid)
+                SELECT p.hasvalue, p.value, p.linkid FROM anc
+                JOIN params p ON p.nodeid = anc.nodeid AND p.name = ?
+                WHERE p.hasvalue OR p.linkid IS NOT NULL
+                ORDER BY anc.depth LIMIT 1"""
+        else:
+            _sql = """SELECT hasvalue, value, linkid FROM params
+                WHERE nodeid=? AND name=?"""
+        _row = self.conn.execute(_sql, (nodeid, name)).fetchone()
+        if _row is None:
+            raise KeyError("{}.get_param: node «{}» parameter «{}» not defined.".format(self.__class__.__name__, nodeid, name))
+        _hasvalue, _value, _linkid = _row
+        if _linkid:
+            return self.get_param(_linkid, name, inherit=False)
+        if not _hasvalue:
+            raise KeyError("{}.get_param: node «{}» parameter «{}» has no value.".format(self.__class__.__name__, nodeid, name))
+        return pickle.loads(_value)
+
+
+    def set_param(self, nodeid, name, value):
+        """Set the value of a parameter of a node."""
+        _row = self.conn.execute("SELECT pdict FROM params WHERE nodeid=? AND name=?",
+                                (nodeid, name)).fetchone()
+        _pdict = pickle.loads(_row[0]) if _row else {}
+        _pdict["value"] = value
+        with self.conn:
+            self._insert_param(nodeid, name, _pdict)
+
+
+    def select(self, name, op=">", value=0, table="results"):
+        """Query the numeric values of a result or parameter, e.g. all
+        the nodes with a unity check larger than 1,
+        `store.select("_allowable_stress_unity_check", ">", 1)`.
+
+        :param name: result or parameter name.
+        :type name: str
+        :param op: comparison operator, `<`, `<=`, `>`, `>=`, `=` or `!=`.
+        :type op: str
+        :param value: value for comparison.
+        :type value: float
+        :param table: `"results"` or `"params"`.
+        :type table: str
+        :returns: `[(nodeid, row, value)]`, `row` is 0 for parameters.
+        :rtype: list
+        """
+        if op not in _OPERATORS:
+            raise ValueError("{}.select: arg «op»=«{}» not in {}.".format(self.__class__.__name__, op, _OPERATORS))
+        if table == "results":
+            _sql = "SELECT nodeid, row, num FROM results WHERE name=? AND num {} ?".format(op)
+        elif table == "params":
+            _sql = "SELECT nodeid, 0, num FROM params WHERE name=? AND num {} ?".format(op)
+        else:
+            raise ValueError("{}.select: arg «table»=«{}» not valid.".format(self.__class__.__name__, table))
+        return self.conn.execute(_sql, (name, value)).fetchall()
+
+
+    def plugins(self):
+        return [pickle.loads(_p) for (_p,) in
+                self.conn.execute("SELECT plugin FROM plugins ORDER BY position")]
+
+
+    def treedict(self, nodeid=None):
+        """Return the treedict of the tree, or of the sub-tree rooted at
+        node `nodeid` (only the sub-tree rows are read)."""
+        if nodeid is None:
+            _row = self.conn.execute("SELECT nodeid FROM nodes WHERE parentid IS NULL").fetchone()
+            if _row is None:
+                raise KeyError("{}.treedict: database «{}» is empty.".format(self.__class__.__name__, self.fpath))
+            _rootid = _row[0]
+        else:
+            _rootid = nodeid
+        _sub = """WITH RECURSIVE sub(nodeid) AS (
+                    SELECT nodeid FROM nodes WHERE nodeid=?
+                    UNION ALL
+                    SELECT n.nodeid FROM nodes n JOIN sub ON n.parentid = sub.nodeid)"""
+        _dicts = {}
+        _childs = {}
+        for _row in self.conn.execute(_sub + """
+                        SELECT n.nodeid, n.parentid, n.data, n.attrs, n.arguments,
+                        n.internals FROM nodes n JOIN sub ON n.nodeid = sub.nodeid
+                        ORDER BY n.parentid, n.position""", (_rootid,)):
+            _nid, _pid, _data, _attrs, _args, _ints = _row
+            _td = pickle.loads(_attrs)
+            _td["data"] = pickle.loads(_data)
+            _td["data"]["params"] = {}
+            for _ns, _blob in (("_arguments", _args), ("_internals", _ints)):
+                _val = pickle.loads(_blob) if _blob is not None else None
+                if _val is not None:
+                    _td["data"][_ns] = _val
+            _dicts[_nid] = _td
+            _childs.setdefault(_pid, []).append(_td)
+        if _rootid not in _dicts:
+            raise KeyError("{}.treedict: node «{}» not in database.".format(self.__class__.__name__, _rootid))
+        for _nid, _name, _hasvalue, _value, _pdict in self.conn.execute(_sub + """
+                        SELECT p.nodeid, p.name, p.hasvalue, p.value, p.pdict
+                        FROM params p JOIN sub ON p.nodeid = sub.nodeid""", (_rootid,)):
+            _pdict = pickle.loads(_pdict)
+            if _hasvalue:
+                _pdict["value"] = pickle.loads(_value)
+            _dicts[_nid]["data"]["params"][_name] = _pdict
+        for _nid, _td in _dicts.items():
+            if _nid in _childs:
+                _td["childs"] = _childs[_nid]
+        _root = _dicts[_rootid]
+        if nodeid is None:
+            _root["data"]["plugins"] = self.plugins()
+        return _root
+
+
+    def inherited_params(self, nodeid):
+        """Return the params dicts that node `nodeid` inherits from its
+        ancestors, as `Premise._inherited_params`."""
+        _rows = self.conn.execute("""
+            WITH RECURSIVE anc(nodeid, parentid, depth) AS (
+                SELECT nodeid, parentid, 0 FROM nodes WHERE nodeid=?
+                UNION ALL
+                SELECT n.nodeid, n.parentid, a.depth + 1
+                FROM nodes n JOIN anc a ON n.nodeid = a.parentid)
+            SELECT p.name, p.hasvalue, p.value, p.pdict FROM anc
+            JOIN params p ON p.nodeid = anc.nodeid
+            WHERE anc.depth > 0
+            ORDER BY anc.depth""", (nodeid,)).fetchall()
+        _params = {}
+        for _name, _hasvalue, _value, _pdict in _rows:
+            if _name in _params and ("value" in _params[_name] or not _hasvalue):
+                continue
+            _pdict = pickle.loads(_pdict)
+            if _hasvalue:
+                _pdict["value"] = pickle.loads(_value)
+            _params[_name] = _pdict
+        return _params
+
+
+    def open_branch(self, nodeid):
+        """Build the sub-tree rooted at node `nodeid`, with the parameters
+        that it inherits and the plugin functions of the study, without
+        loading the rest of the tree.
+
+        :param nodeid: the `_nodeid` of the root node of the branch.
+        :type nodeid: str
+        :returns: the root node of the branch.
+        :rtype: Premise
+        """
+        from .pflacs import _build_branch
+        return _build_branch(self.treedict(nodeid), self.inherited_params(nodeid),
+                            self.plugins())
@@ -1,10 +1,26 @@
+import collections
+import concurrent.futures
 from datetime import datetime, timezone
+import gzip
 import logging
+import os
+import pathlib
+import re
 import subprocess
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
-from .pflacs import Premise, NodeAttr
+try:
+    import resource
+except ImportError as err:  # not available on Windows
+    logger.debug("resource not available, CPU time not measured: %s" % (err,))
+    resource = None
+
+from . import hashing
+from .pflacs import Premise, NodeAttr, PflacsFunc, _empty
+from .runcache import RunCache
 
 
 class SubProc(Premise):
@@ -26,20 +42,67 @@ class SubProc(Premise):
     :type funcname: str or None
     :param argmap: optional mapping for names of function arguments and return values.
     :type argmap: dict or None
+    :param cmd: the command, as for `subprocess.Popen`.
+    :type cmd: list or None
+    :param logdir: directory of the log files of the process output, by
+        default `<study file>.logs` if the tree has been saved, or `False`
+        for no log files.
+    :type logdir: str, None or bool
+    :param compress: write gzip compressed log files.
+    :type compress: bool
+    :param shell: run the command through the shell, as for 
+        `subprocess.Popen`.
+    :type shell: bool
+    :param tail: number of lines of output kept in `_stdout` and `_stderr`,
+        by default `_default_tail` if the output is written to log files,
+        otherwise all the lines.
+    :type tail: int or None
+    :param extract: `{param name: regex}`, the params set from the output
+        lines matching the regex, to the value of its first group.
+    :type extract: dict or None
+    :param inputs: paths of the input files of the command.
+    :type inputs: list or None
+    :param outputs: paths of the output files of the command.
+    :type outputs: list or None
+    :param cache: directory of the cache of runs (see :mod:`pflacs.runcache`),
+        `True` for `<study file>.runcache`, or `None` for no cache.
+    :type cache: str, bool or None
+    :param cache_size: maximum size of the cache in bytes.
+    :type cache_size: int
+    :param timeout: seconds after which the process of this node is 
+        killed, overriding the `timeout` of :meth:`run_all`.
+    :type timeout: float or None
     """
     #_internals = NodeAttr(initial={})
     #_arguments = NodeAttr()
     #_funcname = NodeAttr()
     #_argmap = NodeAttr()
     _cmd = NodeAttr()
+    _shell = NodeAttr()
     _kwargs = NodeAttr()
     _stdout = NodeAttr()
     _stderr = NodeAttr()
+    _returncode = NodeAttr()
+    _logdir = NodeAttr()
+    _compress = NodeAttr()
+    _tail = NodeAttr()
+    _extract = NodeAttr()
+    _logfiles = NodeAttr()
+    _inputs = NodeAttr()
+    _outputs = NodeAttr()
+    _cache = NodeAttr()
+    _cache_size = NodeAttr()
+    _cachekey = NodeAttr()
+    _timeout = NodeAttr()
     _timestamp = NodeAttr("vn")
+    _transient_attrs = Premise._transient_attrs + ("_line_callbacks",)
+    _default_tail = 100
 
     def __init__(self, name=None, parent=None, parameters=None,
                 data=None, treedict=None, cmd=None, 
-                kwargs=None, shell=False):
+                kwargs=None, shell=False, logdir=None, compress=False,
+                tail=None, extract=None, inputs=None, outputs=None,
+                cache=None, cache_size=2**30, timeout=None):
         super().__init__(name, parent, data=data, treedict=treedict,
                         parameters=parameters)
         self._df = None
@@ -56,25 +119,400 @@ class SubProc(Premise):
             self._kwargs = kwargs
         if cmd is not None:
             self._cmd = cmd
+        if treedict is None:
+            self._shell = shell
+            self._logdir = logdir
+            self._compress = compress
+            self._tail = tail
+            self._extract = extract
+            self._inputs = inputs
+            self._outputs = outputs
+            self._cache = cache
+            self._cache_size = cache_size
+            self._timeout = timeout
+        self._line_callbacks = []
+
+
+    def on_line(self, callback):
+        """Add a function called with each line of output while the 
+        process runs, `callback(node, stream, line)`, where `stream` is 
+        `"stdout"` or `"stderr"`.  Callbacks are not saved with the tree.
+        Note that callbacks are called from the output reader threads.
+        """
+        self._line_callbacks.append(callback)
+        return callback
+
+
+    @property
+    def _log_dpath(self):
+        if self._logdir is False:
+            return None
+        if self._logdir:
+            return pathlib.Path(self._logdir)
+        _fpath = self._root._vnpkl_fpath
+        if _fpath:
+            _fpath = pathlib.Path(_fpath)
+            return _fpath.with_name(_fpath.name + ".logs")
+        return None
 
 
+    def _log_fpaths(self):
+        "`{stream: log file path}`, empty if there are no log files"
+        _dpath = self._log_dpath
+        if not _dpath:
+            return {}
+        return {_name: _dpath / "{}.{}.log{}".format(self._nodeid, _name,
+                                                ".gz" if self._compress else "")
+                for _name in ("stdout", "stderr")}
 
-    def __call__(self, *args, **kwargs):
+
+    def _run_cache(self):
+        if not self._cache:
+            return None
+        if self._cache is True:
+            _fpath = self._root._vnpkl_fpath
+            if not _fpath:
+                logger.warning("%s: node «%s» arg «cache»=True but the tree has not been saved, runs not cached." % (self.__class__.__name__, self.name))
+                return None
+            _fpath = pathlib.Path(_fpath)
+            _dpath = _fpath.with_name(_fpath.name + ".runcache")
+        else:
+            _dpath = self._cache
+        return RunCache(_dpath, self._cache_size or 2**30)
+
+
+    def _resolved_kwargs(self, kwargs=None):
         _xkwargs = self._kwargs.copy() if self._kwargs else {}
         if kwargs:
             _xkwargs.update(kwargs)
-        print(f"{self.__class__.__name__}:{self.name} args={args}")
-        print(f"{self.__class__.__name__}:{self.name} _xkwargs={_xkwargs}")
+        for _k, _v in _xkwargs.items():
+            if _v is _empty:
+                _xkwargs[_k] = getattr(self, _k)
+        return _xkwargs
+
+
+    def _cache_key(self, kwargs=None):
+        """Hash of the command, the resolved kwargs and parameters (not 
+        the «internal» params set by runs), and the input files."""
+        _own = self.data["params"]
+        _params = {_name: _val for _name, _val in next(self._resolved_params())[1].items()
+                    if not (isinstance(_own.get(_name), dict) and 
+                            _own[_name].get("desc") == "«internal»")}
+        _inputs = [(str(_f), hashing.file_digest(_f)) for _f in (self._inputs or ())]
+        return hashing.digest(self._cmd, self._resolved_kwargs(kwargs), _params,
+                            self._extract, _inputs)
+
+
+    def _restore_run(self, cache, key):
+        """Restore the output of a cached run, `True` if successful."""
+        _meta = cache.get(key)
+        if _meta is None:
+            return False
+        try:
+            _logfiles = {}
+            _dpath = self._log_dpath
+            for _stream, _name in _meta["logs"].items():
+                if _dpath:
+                    _fpath = _dpath / "{}.{}".format(self._nodeid, _name)
+                    cache.restore(key, _name, _fpath)
+                    _logfiles[_stream] = str(_fpath)
+            for ii, _fpath in enumerate(_meta["outputs"]):
+                cache.restore(key, "output{}".format(ii), _fpath)
+        except OSError as err:
+            logger.warning("%s: node «%s» cached run «%s» not restored: %s" % (self.__class__.__name__, self.name, key, err))
+            return False
+        _now_ = _now()
+        self._timestamp = [_now_, _now_]
+        self._returncode = _meta["returncode"]
+        self._stdout = _meta["stdout"]
+        self._stderr = _meta["stderr"]
+        self._logfiles = _logfiles or None
+        for _name, _value in _meta["extracted"].items():
+            PflacsFunc._set_internal(self, _name, _value)
+        self._cachekey = key
+        self.mark_dirty()
+        logger.info("%s: node «%s» output restored from cached run «%s»." % (self.__class__.__name__, self.name, key))
+        return True
+
+
+    def _cache_run(self, cache, key, extracted, replace=False):
+        _files = {}
+        _logs = {}
+        for _stream, _fpath in (self._logfiles or {}).items():
+            _name = _stream + (".log.gz" if _fpath.endswith(".gz") else ".log")
+            _files[_name] = _fpath
+            _logs[_stream] = _name
+        for ii, _fpath in enumerate(self._outputs or ()):
+            if not os.path.isfile(_fpath):
+                logger.warning("%s: node «%s» output file «%s» not found, run not cached." % (self.__class__.__name__, self.name, _fpath))
+                return False
+            _files["output{}".format(ii)] = _fpath
+        _meta = {
+            "cmd": self._cmd,
+            "returncode": self._returncode,
+            "stdout": self._stdout,
+            "stderr": self._stderr,
+            "extracted": extracted,
+            "logs": _logs,
+            "outputs": [str(_f) for _f in (self._outputs or ())],
+        }
+        self._cachekey = key
+        return cache.put(key, _meta, _files, replace=replace)
+
+
+    def __call__(self, *args, timeout=None, force=False, **kwargs):
+        """Run the command, and record its `_stdout`, `_stderr`,
+        `_returncode` and `_timestamp` (start and end times).
+
+        The output is streamed to the log files `<nodeid>.stdout.log` and
+        `<nodeid>.stderr.log` (`.log.gz` if compressed) in the log 
+        directory, recorded in `_logfiles`; only the last `tail` lines 
+        are kept in `_stdout` and `_stderr` (all the lines if there is no
+        log directory and no `tail`).  The `extract` regexes and 
+        the :meth:`on_line` callbacks are applied to each line as it is
+        read.
+
+        With a run `cache`, the output of a previous run with the same 
+        command, parameters and input files (see :mod:`pflacs.runcache`)
+        is restored (log files, output files and the node output) instead
+        of running the command again, unless `force=True`.  Successful 
+        runs are cached, a forced run replaces the cached run.
+
+        :param timeout: seconds after which the process is killed, 
+            default the node `timeout`.
+        :type timeout: float or None
+        :param force: run the command even if the run is cached.
+        :type force: bool
+        """
+        if timeout is None:
+            timeout = self._timeout
+        logger.debug("%s.__call__: node «%s» args=%s kwargs=%s" % (self.__class__.__name__, self.name, args, kwargs))
+        self._execute(timeout=timeout, force=force, kwargs=kwargs)
+
+
+    def _execute(self, timeout=None, running=None, cancel=None, force=False,
+                kwargs=None):
+        """Run the command; returns `"ok"`, `"cached"`, `"failed"`, 
+        `"timeout"` or `"cancelled"`.  With `running`, a dict shared by a
+        pool of jobs (see :meth:`run_all`), the process is registered so
+        that it can be killed when event `cancel` is set."""
+        _cache = self._run_cache()
+        if _cache is not None:
+            _key = self._cache_key(kwargs)
+            if not force and self._restore_run(_cache, _key):
+                return "cached"
+        self._cachekey = None
         self._stdout = self._stderr = ""
-        self._timestamp = [datetime.utcnow().replace(tzinfo=timezone.utc).timestamp(), None]
-        # datetime.utcfromtimestamp(timestamp).isoformat()
+        self._returncode = None
+        self._timestamp = [_now(), None]
+        self.mark_dirty()
+        _status = "failed"
+        _extracted = {}
         try:
-            #op = subprocess.run(self._cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-            op = subprocess.run(self._cmd, capture_output=True) # , capture_output=True
-        #except subprocess.CalledProcessError as err:
+            _streams = self._open_logs(_extracted)
+            _proc = subprocess.Popen(self._cmd, shell=bool(self._shell),
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         except Exception as err:
-            self._stderr = op.stderr.decode('UTF-8')
-            logger.error("%s.__call__: node «%s» cannot process %s: %s : %s." % (self.__class__.__name__, self.name, self._cmd, err, self._stderr))
-        self._timestamp[1] = datetime.utcnow().replace(tzinfo=timezone.utc).timestamp()
-        self._stdout = op.stdout.decode('UTF-8')
-        print(f"SubProc {self.name}: op={self._stdout}")
+            self._stderr = str(err)
+            logger.error("%s.__call__: node «%s» cannot process %s: %s." % (self.__class__.__name__, self.name, self._cmd, err))
+            self._timestamp[1] = _now()
+            return _status
+        if running is not None:
+            running[self] = _proc
+            if cancel is not None and cancel.is_set():
+                _proc.kill()
+        _readers = [threading.Thread(target=_stream.read, args=(_pipe,), daemon=True)
+                    for _stream, _pipe in zip(_streams, (_proc.stdout, _proc.stderr))]
+        for _reader in _readers:
+            _reader.start()
+        try:
+            _proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _proc.kill()
+            _proc.wait()
+            _status = "timeout"
+        finally:
+            for _reader in _readers:
+                _reader.join()
+            if running is not None:
+                running.pop(self, None)
+        self._timestamp[1] = _now()
+        self._returncode = _proc.returncode
+        self._stdout, self._stderr = (_stream.text() for _stream in _streams)
+        if _status == "timeout":
+            logger.error("%s.__call__: node «%s» command %s timed out after %s s." % (self.__class__.__name__, self.name, self._cmd, timeout))
+        elif cancel is not None and cancel.is_set() and _proc.returncode < 0:
+            _status = "cancelled"
+        elif _proc.returncode:
+            logger.error("%s.__call__: node «%s» command %s returned %s: %s" % (self.__class__.__name__, self.name, self._cmd, _proc.returncode, self._stderr[-1000:]))
+        else:
+            _status = "ok"
+            if _cache is not None:
+                self._cache_run(_cache, _key, _extracted, replace=force)
+        return _status
+
+
+    def _open_logs(self, extracted):
+        """Return the `_OutputStream` of stdout and stderr; the extracted
+        values are recorded in dict `extracted`."""
+        _fpaths = self._log_fpaths()
+        if _fpaths:
+            self._log_dpath.mkdir(parents=True, exist_ok=True)
+        _lock = threading.Lock()
+        _extract = {_name: re.compile(_regex) for _name, _regex in (self._extract or {}).items()}
+        _tail = self._tail
+        if _tail is None and _fpaths:
+            # the full output is in the log files
+            _tail = self._default_tail
+        _streams = [_OutputStream(self, _name, _fpaths.get(_name), _tail, _extract,
+                                _lock, extracted)
+                    for _name in ("stdout", "stderr")]
+        self._logfiles = {_name: str(_f) for _name, _f in _fpaths.items()} or None
+        return _streams
+
+
+    @classmethod
+    def run_all(cls, root, workers=None, timeout=None, cancel_on_failure=True,
+                force=False):
+        """Run the commands of all the `SubProc` nodes in the sub-tree of 
+        `root`, with at most `workers` processes running at a time.
+
+        Each node records its `_stdout`, `_stderr`, `_returncode` and 
+        `_timestamp`, as when it is called.  With `cancel_on_failure` the
+        first failure (non-zero return code or timeout) kills the running
+        processes and cancels the jobs not started.
+
+        The summary has the node counts, the paths of the nodes by status,
+        and the wall-clock time of the run compared with the CPU time of
+        the processes (`cpu` is `None` where it cannot be measured; it 
+        includes any other sub-processes of this process that end during
+        the run).
+
+        :param root: root node of the sub-tree.
+        :type root: Premise
+        :param workers: number of processes, default `os.cpu_count()`.
+        :type workers: int or None
+        :param timeout: seconds after which a process is killed, for the
+            nodes without their own `timeout`.
+        :type timeout: float or None
+        :param cancel_on_failure: cancel the remaining jobs on failure.
+        :type cancel_on_failure: bool
+        :param force: run the commands even if the runs are cached.
+        :type force: bool
+        :returns: the summary.
+        :rtype: dict
+        """
+        _nodes = [_n for _n in root if isinstance(_n, cls)]
+        _workers = workers or os.cpu_count() or 1
+        _running = {}
+        _cancel = threading.Event()
+        _status = {_n: "cancelled" for _n in _nodes}
+        _cpu0 = _children_cpu()
+        _t0 = time.perf_counter()
+
+        def _job(node):
+            if _cancel.is_set():
+                return "cancelled"
+            _timeout = node._timeout if node._timeout is not None else timeout
+            return node._execute(timeout=_timeout, running=_running, cancel=_cancel,
+                                force=force)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=_workers) as _pool:
+            _futures = {_pool.submit(_job, _n): _n for _n in _nodes}
+            for _future in concurrent.futures.as_completed(_futures):
+                _n = _futures[_future]
+                if _future.cancelled():
+                    continue
+                _status[_n] = _future.result()
+                if _status[_n] in ("failed", "timeout") and cancel_on_failure and not _cancel.is_set():
+                    logger.warning("%s.run_all: node «%s» %s, cancelling the remaining jobs." % (cls.__name__, _n.name, _status[_n]))
+                    _cancel.set()
+                    for _f in _futures:
+                        _f.cancel()
+                    for _proc in list(_running.values()):
+                        _proc.kill()
+        _wall = time.perf_counter() - _t0
+        _cpu1 = _children_cpu()
+        _summary = {_s: [] for _s in ("ok", "cached", "failed", "timeout", "cancelled")}
+        for _n in _nodes:
+            _summary[_status[_n]].append(_n._path)
+        _summary.update({
+            "nodes": len(_nodes),
+            "workers": _workers,
+            "wall": _wall,
+            "cpu": None if _cpu0 is None else _cpu1 - _cpu0,
+            "node_wall": sum(_n._timestamp[1] - _n._timestamp[0] for _n in _nodes
+                            if _n._timestamp and _n._timestamp[1] is not None
+                            and _status[_n] != "cancelled"),
+        })
+        logger.info("%s.run_all: %s nodes, %s ok, %s cached, wall time %.3f s, CPU time %s s." % (cls.__name__, len(_nodes), len(_summary["ok"]), len(_summary["cached"]), _wall, _summary["cpu"]))
+        return _summary
+
+
+class _OutputStream:
+    """Reader of an output pipe of a `SubProc` process, that writes the
+    lines to a log file, keeps the last `tail` lines (all if `None`), and
+    applies the regex extractors and line callbacks of the node.
+
+    :class:`_OutputStream` is used internally by :mod:`pflacs`.
+    """
+    def __init__(self, node, name, fpath, tail, extract, lock, extracted):
+        self.node = node
+        self.name = name
+        self.fpath = fpath
+        self.lines = collections.deque(maxlen=tail)
+        self.extract = extract
+        self.lock = lock
+        self.extracted = extracted
+    def read(self, pipe):
+        _log = None
+        if self.fpath:
+            _log = gzip.open(self.fpath, "wb", compresslevel=6) if self.fpath.suffix == ".gz" else open(self.fpath, "wb")
+        try:
+            for _bline in iter(pipe.readline, b""):
+                if _log:
+                    _log.write(_bline)
+                _line = _bline.decode("UTF-8", errors="replace")
+                self.lines.append(_line)
+                self._apply(_line)
+        finally:
+            pipe.close()
+            if _log:
+                _log.close()
+    def _apply(self, line):
+        for _name, _regex in self.extract.items():
+            _match = _regex.search(line)
+            if _match:
+                _value = _parse_value(_match.group(1))
+                with self.lock:
+                    self.extracted[_name] = _value
+                    PflacsFunc._set_internal(self.node, _name, _value)
+        for _callback in self.node._line_callbacks:
+            try:
+                _callback(self.node, self.name, line)
+            except Exception as err:
+                logger.error("%s: node «%s» line callback %s error: %s" % (self.__class__.__name__, self.node.name, _callback, err))
+    def text(self):
+        return "".join(self.lines)
+
+
+def _parse_value(text):
+    "`int` or `float` value of `text`, or `text`"
+    for _type in (int, float):
+        try:
+            return _type(text)
+        except ValueError:
+            pass
+    return text
+
+
+def _now():
+    return datetime.now(timezone.utc).timestamp()
+
+
+def _children_cpu():
+    "user + system CPU time of the terminated sub-processes, or `None`"
+    if resource is None:
+        return None
+    _usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return _usage.ru_utime + _usage.ru_stime
@@ -0,0 +1,243 @@
+"""Parameter sweeps and sampling designs for `pflacs` parameter studies.
+
+The designs return columns, `{parameter name: ndarray}` (or a
+`pandas.DataFrame` with `dataframe=True`), that can be run as a single
+vectorized calculation with `Premise.run_design`.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    from scipy.stats import qmc
+except ImportError as err:
+    logger.debug("scipy not installed, sobol design not available: %s" % (err,))
+    qmc = None
+
+
+def param_sweep(*paramlists, table=False, dataframe=False, record=False, names=None):
+    "Create a grid-search/parameter sweep from parameter lists"
+    # https://peps.python.org/pep-3102/#specification
+    op = []
+    for ii, li in enumerate(paramlists):
+        if len(li)==0:
+            raise ValueError(f"Empty list not allowed.")
+        li = np.array(li)
+        if ii<len(paramlists)-1:
+            #print(paramlists[ii+1:])
+            flen = 1
+            for li2 in paramlists[ii+1:]:
+                flen = flen*len(li2)
+            li = np.repeat(li, flen)
+        if ii>0:
+            rlen = 1
+            for li2 in paramlists[:ii]:
+                rlen = rlen*len(li2)
+            li = np.tile(li, rlen)
+        li = np.array(li)
+        op.append(li)
+    if record:  # record array, keeps the dtype of each column
+        return np.rec.fromarrays(op, names=names)
+    if table:  # NOTE np.array has a single type
+        op = np.array(op).T
+        return op
+    if dataframe:
+        # op = np.array(op).T
+        # op = pd.DataFrame(op)
+        op_dict = {}
+        for ii, arr in enumerate(op):
+            op_dict[ii] = arr
+        op = pd.DataFrame(op_dict)
+        return op
+    return tuple(op)
+
+def param_sweep_size(*paramlists):
+    "Number of rows in the parameter sweep of parameter lists"
+    size = 1
+    for li in paramlists:
+        size = size*len(li)
+    return size
+
+def param_sweep_chunk(k, *paramlists, chunksize=100000, record=False, names=None):
+    """Return chunk `k` (rows `k*chunksize` to `(k+1)*chunksize`) of the
+    parameter sweep, as a tuple of column arrays (or a record array).
+    The rows are the same as `param_sweep`, but only the rows of the chunk
+    are created, by index arithmetic."""
+    _check_lists(paramlists, chunksize)
+    size = param_sweep_size(*paramlists)
+    start = k*chunksize
+    if k<0 or start>=size:
+        raise IndexError(f"Chunk {k} out of range, {size} rows in chunks of {chunksize}.")
+    idx = np.arange(start, min(start+chunksize, size))
+    op = []
+    stride = size
+    for li in paramlists:
+        stride = stride//len(li)
+        op.append(np.asarray(li)[(idx//stride) % len(li)])
+    if record:
+        return np.rec.fromarrays(op, names=names)
+    return tuple(op)
+
+def param_sweep_chunks(*paramlists, chunksize=100000, record=False, names=None,
+                        start=0, step=1):
+    """Generate the parameter sweep in chunks of `chunksize` rows.
+    Worker `w` of `n` can use `start=w, step=n` to process its share of
+    the chunks without coordinating with the other workers."""
+    _check_lists(paramlists, chunksize)
+    nchunks = -(-param_sweep_size(*paramlists)//chunksize)
+    for k in range(start, nchunks, step):
+        yield param_sweep_chunk(k, *paramlists, chunksize=chunksize,
+                                record=record, names=names)
+
+def _check_lists(paramlists, chunksize=None):
+    for li in paramlists:
+        if len(li)==0:
+            raise ValueError(f"Empty list not allowed.")
+    if chunksize is not None and (not isinstance(chunksize, (int, np.integer)) or chunksize<=0):
+        raise ValueError(f"Chunk size must be a positive integer, not {chunksize!r}.")
+
+
+def _columns(names, cols, dataframe):
+    op = dict(zip(names, cols))
+    if dataframe:
+        return pd.DataFrame(op)
+    return op
+
+def _scale(names, unit, bounds):
+    "Scale samples in the unit hypercube to `bounds`"
+    cols = []
+    for jj, name in enumerate(names):
+        low, high = bounds[name]
+        cols.append(low + unit[:, jj]*(high - low))
+    return cols
+
+
+def full_factorial(params, dataframe=False):
+    """Full-factorial design: all the combinations of the parameter values.
+
+    :param params: parameter values, `{name: list of values}`.
+    :type params: dict
+    :param dataframe: return a `pandas.DataFrame` instead of a dict of columns.
+    :type dataframe: bool
+    :returns: design columns.
+    :rtype: dict or pandas.DataFrame
+    """
+    names = list(params)
+    return _columns(names, param_sweep(*[params[k] for k in names]), dataframe)
+
+
+def one_at_a_time(base, params, dataframe=False):
+    """One-at-a-time design: the base case, then each parameter varied
+    through its values with the other parameters at their base value.
+
+    :param base: base case parameter values, `{name: value}`.
+    :type base: dict
+    :param params: values of the varied parameters, `{name: list of values}`.
+    :type params: dict
+    :param dataframe: return a `pandas.DataFrame` instead of a dict of columns.
+    :type dataframe: bool
+    :returns: design columns.
+    :rtype: dict or pandas.DataFrame
+    :raises ValueError: if a varied parameter is not in `base`.
+    """
+    unknown = [pname for pname in params if pname not in base]
+    if unknown:
+        raise ValueError(f"Varied parameters {unknown} not in the base case.")
+    names = list(base)
+    nrows = 1 + sum(len(v) for v in params.values())
+    cols = []
+    for name in names:
+        col = [base[name]]*nrows
+        row = 1
+        for pname, values in params.items():
+            if pname == name:
+                col[row:row+len(values)] = list(values)
+            row += len(values)
+        cols.append(np.asarray(col))
+    return _columns(names, cols, dataframe)
+
+
+def latin_hypercube(bounds, n, seed=None, dataframe=False):
+    """Latin hypercube design: `n` samples with one sample in each of `n`
+    equal intervals of every parameter range.
+
+    :param bounds: parameter ranges, `{name: (low, high)}`.
+    :type bounds: dict
+    :param n: number of samples.
+    :type n: int
+    :param seed: random seed.
+    :type seed: int or None
+    :param dataframe: return a `pandas.DataFrame` instead of a dict of columns.
+    :type dataframe: bool
+    :returns: design columns.
+    :rtype: dict or pandas.DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    names = list(bounds)
+    unit = np.empty((n, len(names)))
+    for jj in range(len(names)):
+        unit[:, jj] = (rng.permutation(n) + rng.random(n)) / n
+    return _columns(names, _scale(names, unit, bounds), dataframe)
+
+
+def halton(bounds, n, skip=0, dataframe=False):
+    """Halton low-discrepancy design: `n` samples of the Halton sequence
+    (radical inverse in the first prime bases).
+
+    :param bounds: parameter ranges, `{name: (low, high)}`.
+    :type bounds: dict
+    :param n: number of samples.
+    :type n: int
+    :param skip: number of initial points of the sequence to skip.
+    :type skip: int
+    :param dataframe: return a `pandas.DataFrame` instead of a dict of columns.
+    :type dataframe: bool
+    :returns: design columns.
+    :rtype: dict or pandas.DataFrame
+    """
+    names = list(bounds)
+    primes = []
+    candidate = 2
+    while len(primes) < len(names):
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    idx = np.arange(skip + 1, skip + n + 1)
+    unit = np.empty((n, len(names)))
+    for jj, base in enumerate(primes):
+        k = idx.copy()
+        fraction = 1.0
+        col = np.zeros(n)
+        while k.any():
+            fraction /= base
+            col += fraction * (k % base)
+            k //= base
+        unit[:, jj] = col
+    return _columns(names, _scale(names, unit, bounds), dataframe)
+
+
+def sobol(bounds, n, seed=None, scramble=True, dataframe=False):
+    """Sobol low-discrepancy design, requires `scipy`.  `n` should be a
+    power of 2.
+
+    :param bounds: parameter ranges, `{name: (low, high)}`.
+    :type bounds: dict
+    :param n: number of samples.
+    :type n: int
+    :param seed: random seed for scrambling.
+    :type seed: int or None
+    :param scramble: scramble the sequence.
+    :type scramble: bool
+    :param dataframe: return a `pandas.DataFrame` instead of a dict of columns.
+    :type dataframe: bool
+    :returns: design columns.
+    :rtype: dict or pandas.DataFrame
+    """
+    if qmc is None:
+        raise ImportError("sobol design requires scipy, use «halton» or «latin_hypercube» instead.")
+    names = list(bounds)
+    unit = qmc.Sobol(d=len(names), scramble=scramble, seed=seed).random(n)
+    return _columns(names, _scale(names, unit, bounds), dataframe)
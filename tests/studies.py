@@ -0,0 +1,39 @@
+"""Functions and study trees shared by the test modules."""
+from pflacs import Premise, Calc, Table
+
+
+def pipe_hoop_stress(P, D, t):
+    return P * D / 2 / t
+
+def allowable_stress_unity_check(sigma, allowable, df=0.72):
+    return sigma / allowable * df
+
+
+def pipe_study(nlc=20, unity_check=True, name="Pipe study base case."):
+    """Pipe study with `nlc` load cases, each with a pipe stress `Calc`, 
+    the stress unity check `Calc` if `unity_check`, and a results `Table`."""
+    basecase = Premise(name,
+                    parameters={
+                        "ys": 22.1 * 10**6,
+                        "D": 110 * 10**-3,
+                        "P": 20 * 10**5,
+                        "t": 5 * 10**-3,
+                        "design_factor": 0.8,
+                    })
+    basecase.plugin_func(pipe_hoop_stress)
+    basecase.plugin_func(allowable_stress_unity_check)
+    for ii in range(nlc):
+        _lc = Premise("LoadCase{}".format(ii), basecase,
+                        parameters={"P": (10 + ii) * 10**5})
+        _pstress = Calc("Calc pipe stress", _lc, funcname="pipe_hoop_stress")
+        if not unity_check:
+            Table("results", _pstress, paranames=["P", "_pipe_hoop_stress"])
+            continue
+        _unity = Calc("Stress unity check", _pstress,
+                        funcname="allowable_stress_unity_check",
+                        argmap={"sigma": "_pipe_hoop_stress",
+                                "allowable": "ys",
+                                "df": "design_factor"})
+        Table("results", _unity, paranames=["P", "_pipe_hoop_stress",
+                                    "_allowable_stress_unity_check"])
+    return basecase
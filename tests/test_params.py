@@ -0,0 +1,104 @@
+import unittest
+
+from pflacs import Premise, Calc, _empty
+
+
+def add_abc(a, b, c=0):
+    return a + b + c
+
+
+def deep_tree(levels=12):
+    root = Premise("root", parameters={"a": 1, "b": 2, "c": 3})
+    node = root
+    for ii in range(levels):
+        node = Premise("level {}".format(ii), parent=node)
+    return root, node
+
+
+class ParamCacheTests(unittest.TestCase):
+
+    def test_inherited_value_cached(self):
+        root, leaf = deep_tree()
+        self.assertEqual(leaf.a, 1)
+        self.assertIn(leaf, root._tcache.params["a"])
+        self.assertIs(leaf._tcache, root._tcache)
+
+    def test_set_upstream_invalidates(self):
+        root, leaf = deep_tree()
+        self.assertEqual(leaf.b, 2)
+        leaf.parent.parent.b = 20
+        self.assertEqual(leaf.b, 20)
+        self.assertEqual(root.b, 2)
+        del leaf.parent.parent.b
+        self.assertEqual(leaf.b, 2)
+
+    def test_add_param_invalidates(self):
+        root, leaf = deep_tree()
+        self.assertEqual(leaf.c, 3)
+        leaf.parent.add_param("c", value=-3)
+        self.assertEqual(leaf.c, -3)
+        leaf.parent.import_params({"c": {"value": 33}})
+        self.assertEqual(leaf.c, 33)
+
+    def test_reparent_invalidates(self):
+        root, leaf = deep_tree(3)
+        other = Premise("other", parameters={"a": 100})
+        self.assertEqual(leaf.a, 1)
+        other.add_child(leaf)
+        self.assertEqual(leaf.a, 100)
+        self.assertIs(leaf._tcache, other._tcache)
+        other.remove_child(node=leaf)
+        self.assertIsNone(leaf.parent)
+        self.assertIs(leaf.a, _empty)
+
+    def test_calc_reads_cached_params(self):
+        root, leaf = deep_tree()
+        root.plugin_func(add_abc)
+        calc = Calc("calc", parent=leaf, funcname="add_abc")
+        self.assertEqual(calc(), 6)
+        leaf.a = 10
+        self.assertEqual(calc(), 15)
+
+
+class NodeIdIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Premise("root", parameters={"a": 1})
+        self.src = Premise("source", parent=self.root, parameters={"x": 5})
+        self.dst = Premise("dest", parent=self.root)
+        self.dst.add_param("x", linkid=self.src._nodeid)
+
+    def test_index_on_creation(self):
+        for _n in self.root:
+            self.assertIs(self.root._tcache.get_node(_n._nodeid), _n)
+
+    def test_linked_param(self):
+        self.assertEqual(self.dst.x, 5)
+        self.src.x = 6
+        self.assertEqual(self.dst.x, 6)
+
+    def test_get_node_by_id_subtree(self):
+        self.assertIs(self.root.get_node_by_id(self.src._nodeid), self.src)
+        self.assertIsNone(self.dst.get_node_by_id(self.src._nodeid))
+
+    def test_copy_new_ids(self):
+        _copy = self.root.add_child(self.src.copy())
+        self.assertNotEqual(_copy._nodeid, self.src._nodeid)
+        self.assertIs(self.root._tcache.get_node(_copy._nodeid), _copy)
+        self.assertIs(self.root._tcache.get_node(self.src._nodeid), self.src)
+
+    def test_remove_child(self):
+        self.root.remove_child(node=self.src)
+        self.assertIsNone(self.root._tcache.get_node(self.src._nodeid))
+        self.assertIs(self.dst.x, _empty)
+
+    def test_from_treedict(self):
+        _tree = Premise(treedict=self.root.to_treedict())
+        _dst = _tree.get_node_by_path("/root/dest")
+        self.assertEqual(_dst.x, 5)
+        self.assertIs(_tree._tcache.get_node(self.src._nodeid),
+                      _tree.get_node_by_path("/root/source"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import concurrent.futures
+import sys
+import unittest
+
+from pflacs import Premise, Calc, PyFunc
+from pflacs import pyfunc_node
+
+from studies import pipe_hoop_stress, allowable_stress_unity_check
+
+
+def sum_all(a, *args, b=0, **kwargs):
+    return a + sum(args) + b + sum(kwargs.values())
+
+def head(values, n=1):
+    return values[:n]
+
+
+basecase = Premise("Pipe study base case.",
+                parameters={
+                    "ys": 22.1 * 10**6,
+                    "D": 110 * 10**-3,
+                    "P": 20 * 10**5,
+                    "t": 5 * 10**-3,
+                    "design_factor": 0.8,
+                    "a": 1,
+                })
+basecase.plugin_func(pipe_hoop_stress)
+basecase.plugin_func(allowable_stress_unity_check)
+basecase.plugin_func(sum_all)
+basecase.plugin_func(head)
+lc1 = Premise("LoadCase1, pressure 15 bar.", basecase,
+                parameters={"P": 15 * 10**5})
+lc1_pstress = Calc("Calc pipe stress", lc1, funcname="pipe_hoop_stress")
+lc1_unity = Calc("Stress unity check", lc1_pstress,
+                funcname="allowable_stress_unity_check",
+                argmap={"sigma": "_pipe_hoop_stress",
+                        "allowable": "ys",
+                        "df": "design_factor"})
+
+
+class CallPlanTests(unittest.TestCase):
+
+    def test_calc_chain(self):
+        self.assertAlmostEqual(lc1_pstress(), 16.5e6)
+        self.assertAlmostEqual(lc1_unity(), 16.5e6 / 22.1e6 * 0.8)
+        self.assertEqual(lc1_unity._arguments,
+                {"_pipe_hoop_stress": lc1_pstress._pipe_hoop_stress,
+                 "ys": 22.1e6, "design_factor": 0.8})
+
+    def test_plan_reused(self):
+        _pfunc = Premise.__dict__["pipe_hoop_stress"]
+        lc1_pstress()
+        _nplans = len(_pfunc._plans)
+        lc1_pstress()
+        lc1.pipe_hoop_stress()
+        self.assertEqual(len(_pfunc._plans), _nplans)
+
+    def test_explicit_kwargs(self):
+        self.assertAlmostEqual(lc1.pipe_hoop_stress(P=10), 10 * 110e-3 / 2 / 5e-3)
+        self.assertAlmostEqual(lc1_unity(_pipe_hoop_stress=22.1e6), 0.8)
+        self.assertAlmostEqual(lc1_unity(sigma=22.1e6), 0.8)
+        self.assertAlmostEqual(lc1.pipe_hoop_stress(1, 1, t=0.5), 1.0)
+
+    def test_kwargs_copied(self):
+        _values = [1, 2]
+        _calc = Calc("head", lc1, funcname="head")
+        self.assertEqual(_calc(values=_values), [1])
+        _values.append(3)
+        self.assertEqual(_calc._arguments, {"values": [1, 2]})
+
+    def test_errors(self):
+        with self.assertLogs("pflacs.pflacs", level="ERROR"):
+            self.assertIs(lc1.allowable_stress_unity_check(), False)
+        with self.assertLogs("pflacs.pflacs", level="ERROR"):
+            self.assertIs(lc1.pipe_hoop_stress(X=1), False)
+
+    def test_var_arguments(self):
+        self.assertEqual(lc1.sum_all(), 1)
+        self.assertEqual(lc1.sum_all(1, 2, 3, b=4, c=5), 15)
+
+
+class ThreadedCallTests(unittest.TestCase):
+
+    def setUp(self):
+        self._switchinterval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self._switchinterval)
+
+    def test_bound_method(self):
+        _bound = lc1.pipe_hoop_stress
+        self.assertIs(_bound.__self__, lc1)
+        self.assertEqual(_bound.__doc__, pipe_hoop_stress.__doc__)
+        self.assertEqual(_bound.name, "pipe_hoop_stress")
+
+    def test_concurrent_calcs(self):
+        root = Premise("Concurrent study", parameters={
+                    "ys": 22.1 * 10**6, "D": 110 * 10**-3,
+                    "t": 5 * 10**-3, "design_factor": 0.8})
+        root.plugin_func(pipe_hoop_stress)
+        root.plugin_func(allowable_stress_unity_check)
+        expected = {}
+        for ii in range(300):
+            _lc = Premise("LC{}".format(ii), root, parameters={"P": 1e5 * (ii+1)})
+            _pstress = Calc("pstress", _lc, funcname="pipe_hoop_stress")
+            _unity = Calc("unity", _pstress,
+                    funcname="allowable_stress_unity_check",
+                    argmap={"sigma": "_pipe_hoop_stress",
+                            "allowable": "ys", "df": "design_factor"})
+            _sigma = 1e5 * (ii+1) * 110e-3 / 2 / 5e-3
+            expected[_pstress] = _sigma
+            expected[_unity] = _sigma / 22.1e6 * 0.8
+
+        def run_chain(pstress):
+            for _ in range(10):
+                _ret = pstress(), pstress.childs[0]()
+            return _ret
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as pool:
+            _pstresses = [_n for _n in expected if _n.name == "pstress"]
+            for _pstress, (_sigma, _unity) in zip(_pstresses,
+                                        pool.map(run_chain, _pstresses)):
+                self.assertAlmostEqual(_sigma, expected[_pstress])
+                self.assertAlmostEqual(_unity, expected[_pstress.childs[0]])
+        for _n, _val in expected.items():
+            self.assertAlmostEqual(list(_n._internals.values())[0], _val)
+
+
+class PyFuncRegistryTests(unittest.TestCase):
+
+    def test_shared_function_data(self):
+        root = Premise("PyFunc study", parameters={"D": 0.1, "t": 0.01, "P": 2.0})
+        _nodes = [PyFunc("stress{}".format(ii), root, function=pipe_hoop_stress,
+                        kwargs={"P": pyfunc_node._empty, "D": pyfunc_node._empty,
+                                "t": pyfunc_node._empty})
+                    for ii in range(3)]
+        _info = _nodes[0]._funcinfo
+        self.assertIs(_info.function, pipe_hoop_stress)
+        self.assertEqual(_nodes[0]._req_kwargs, ("P", "D", "t"))
+        for _n in _nodes:
+            self.assertIs(_n._funcinfo, _info)
+            self.assertIs(_n._req_kwargs, _nodes[0]._req_kwargs)
+        self.assertNotIn("_funcinfo", _nodes[0].to_treedict())
+        # rebuilt nodes use the registry, the module is not re-imported
+        _tree = root.to_treedict()
+        _imported = []
+        _import_module = pyfunc_node.importlib.import_module
+        pyfunc_node.importlib.import_module = lambda *args: _imported.append(args)
+        try:
+            _copy = Premise(treedict=_tree)
+        finally:
+            pyfunc_node.importlib.import_module = _import_module
+        self.assertEqual(_imported, [])
+        self.assertIs(_copy.childs[2]._funcinfo, _info)
+        self.assertAlmostEqual(_copy.childs[2](), 10.0)
+
+    def test_argmap(self):
+        root = Premise("PyFunc study")
+        _plain = PyFunc("plain", root, function=sum_all)
+        _mapped = PyFunc("mapped", root, function=sum_all, argmap={"a": "x"})
+        self.assertIs(_plain._funcinfo, _mapped._funcinfo)
+        self.assertEqual(_plain._req_kwargs, ("a", "args", "b", "kwargs"))
+        self.assertEqual(_mapped._req_kwargs, ("x", "args", "b", "kwargs"))
+
+    def test_same_name(self):
+        def make_scale(factor):
+            def scale(x):
+                return x * factor
+            return scale
+        root = Premise("PyFunc study", parameters={"x": 2.0})
+        _double = PyFunc("double", root, function=make_scale(2), kwargs={"x": pyfunc_node._empty})
+        with self.assertLogs("pflacs.pyfunc_node", level="WARNING"):
+            _triple = PyFunc("triple", root, function=make_scale(3), kwargs={"x": pyfunc_node._empty})
+        self.assertIsNot(_double._funcinfo, _triple._funcinfo)
+        self.assertAlmostEqual(_double(), 4.0)
+        self.assertAlmostEqual(_triple(), 6.0)
+
+    def test_not_callable(self):
+        root = Premise("PyFunc study")
+        with self.assertLogs("pflacs.pyfunc_node", level="ERROR"):
+            _node = PyFunc("bad", root, function=42)
+        self.assertIsNone(_node._funcname)
+        self.assertNotIn("_funcinfo", vars(_node))
+
+
+if __name__ == '__main__':
+    unittest.main()
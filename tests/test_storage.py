@@ -0,0 +1,449 @@
+import os
+import pickle
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pflacs import Premise, Calc, Table, SweepCalc
+from pflacs.pflacs import _adopting, _empty, _PflacsDefault, as_pflacs
+from pflacs import export, serializers
+from pflacs.results import ResultStore
+from pflacs.sidecar import SidecarRef
+from pflacs.sqlite_store import SqliteStore
+
+import studies
+
+
+def pipe_study(nlc=5):
+    _study = studies.pipe_study(nlc, unity_check=False, name="Pipe study")
+    _study.update()
+    return _study
+
+
+class ResultsHDF5Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.study = pipe_study()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_results_to_hdf5(self):
+        _fpath = os.path.join(self.tmpdir.name, "study.hdf5")
+        _count = self.study.results_to_hdf5(_fpath, long=True, complevel=5)
+        self.assertEqual(_count, 10)
+        _calc = self.study.get_child_by_name("LoadCase3").childs[0]
+        _df = pd.read_hdf(_fpath, _calc._path)
+        self.assertEqual(_df["_pipe_hoop_stress"][0], _calc._pipe_hoop_stress)
+        _long = pd.read_hdf(_fpath, "/_results")
+        self.assertEqual(list(_long.columns), 
+                        ["nodeid", "path", "row", "parameter", "value"])
+        _rows = _long[(_long.nodeid == _calc._nodeid) & 
+                        (_long.parameter == "_pipe_hoop_stress")]
+        self.assertEqual(list(_rows.value), [_calc._pipe_hoop_stress])
+
+    def test_no_fpath(self):
+        self.assertIsNone(self.study.results_to_hdf5())
+
+
+class ResultStoreTests(unittest.TestCase):
+
+    def test_calc_rows(self):
+        study = pipe_study()
+        _store = study.result_store
+        self.assertEqual(len(_store), 5)
+        _nodeids, _stress = _store.column("_pipe_hoop_stress")
+        _calcs = [_n for _n in study if type(_n) is Calc]
+        self.assertEqual(list(_nodeids), [_n._nodeid for _n in _calcs])
+        np.testing.assert_allclose(_stress, [_n._pipe_hoop_stress for _n in _calcs])
+        # Calc.df is a view of the store
+        _df = _calcs[1].df
+        self.assertTrue(np.shares_memory(_df["_pipe_hoop_stress"].to_numpy(),
+                                        _store.columns["_pipe_hoop_stress"]))
+        self.assertEqual(list(_df.columns), ["P", "D", "t", "_pipe_hoop_stress"])
+
+    def test_recall_and_remove(self):
+        study = pipe_study()
+        _calc = study.get_child_by_name("LoadCase1").childs[0]
+        _calc.P = 40 * 10**5
+        _calc()
+        self.assertEqual(len(study.result_store), 5)
+        self.assertEqual(_calc.df["P"][0], 40 * 10**5)
+        study.remove_child(name="LoadCase1")
+        self.assertEqual(len(study.result_store), 4)
+        self.assertNotIn(_calc._nodeid, study.result_store)
+
+    def test_sweep_rows(self):
+        study = pipe_study(1)
+        _sweep = SweepCalc("sweep", study, funcname="pipe_hoop_stress",
+                        sweep={"P": [1, 2, 3]})
+        _sweep()
+        _df = study.result_store.to_dataframe()
+        self.assertEqual(len(_df), 4)
+        self.assertEqual(list(_df[_df.nodeid == _sweep._nodeid]["P"]), [1, 2, 3])
+
+    def test_column_types(self):
+        _store = ResultStore(capacity=1)
+        _store.append("a", {"x": 1, "name": "a"})
+        _store.append("b", {"x": [1.5, 2.5], "y": True})
+        self.assertEqual(_store.columns["x"].dtype, np.dtype(float))
+        _df = _store.to_dataframe()
+        self.assertEqual(_df["name"][0], "a")
+        self.assertEqual(list(_df["name"].isna()), [False, True, True])
+        self.assertTrue(np.isnan(_df["y"][0]))
+        for ii in range(200):
+            _store.append("a", {"x": ii})
+        self.assertEqual(len(_store), 3)
+        self.assertLess(_store._size, 200)
+        self.assertEqual(_store.frame("a")["x"][0], 199)
+
+    def test_missing_and_deferred(self):
+        _store = ResultStore(capacity=2)
+        for ii in range(5):
+            _store.append("n{}".format(ii), {"k": ii, "z": 1j})
+        self.assertEqual(_store.columns["k"].dtype, np.dtype(int))
+        _store.defer("w", {"w": 0.5})
+        _store.defer("w", {"w": 1.5})
+        self.assertIn("w", _store)
+        self.assertNotIn("w", _store.rows)
+        _store.append("n5", {"k": 5})
+        _df = _store.to_dataframe()
+        self.assertEqual(_store.columns["k"].dtype, np.dtype(float))
+        self.assertEqual(list(_df["nodeid"]), ["n0", "n1", "n2", "n3", "n4", "n5", "w"])
+        self.assertEqual(list(_df["k"][:6]), [0, 1, 2, 3, 4, 5])
+        self.assertTrue(np.isnan(_df["k"][6]))
+        self.assertEqual(list(_df["w"].isna()), [True] * 6 + [False])
+        self.assertEqual(_df["w"][6], 1.5)
+        self.assertTrue(np.isnan(_df["z"][5]))
+        _store.defer("v", {"w": 2.5})
+        _store.discard("v")
+        self.assertEqual(len(_store), 7)
+
+
+class SidecarTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "study.vn3")
+        study = pipe_study(2)
+        study.add_param("profile", np.linspace(0, 1, 1000))
+        SweepCalc("sweep", study, funcname="pipe_hoop_stress",
+                    sweep={"P": np.arange(1000.)})()
+        self.assertTrue(study.savefile(self.fpath, sidecar_threshold=1000))
+        self.study = study
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_lazy_open(self):
+        study = Premise.openfile(self.fpath, lazy=True)
+        self.assertIsInstance(study.data["params"]["profile"]["value"], SidecarRef)
+        _sweep = study.get_child_by_name("sweep")
+        self.assertIsInstance(_sweep.data["_internals"]["_pipe_hoop_stress"], SidecarRef)
+        self.assertEqual(study.D, self.study.D)
+        np.testing.assert_array_equal(study.profile, self.study.profile)
+        np.testing.assert_array_equal(_sweep._internals["_pipe_hoop_stress"], 
+                                    self.study.get_child_by_name("sweep")._pipe_hoop_stress)
+        self.assertEqual(len(_sweep.df), 1000)
+
+    def test_open(self):
+        study = Premise.openfile(self.fpath)
+        self.assertIsInstance(study.data["params"]["profile"]["value"], np.memmap)
+        self.assertFalse(study.profile.flags.writeable)
+        # memory-mapped arrays are not written again
+        _mtime = os.path.getmtime(study.profile.filename)
+        study.savefile(sidecar_threshold=1000)
+        self.assertEqual(os.path.getmtime(study.profile.filename), _mtime)
+        study = Premise.openfile(self.fpath)
+        np.testing.assert_array_equal(study.profile, self.study.profile)
+        # a lazy opened study is saved with all its values
+        study = Premise.openfile(self.fpath, lazy=True)
+        _fpath = os.path.join(self.tmpdir.name, "copy.vn3")
+        study.savefile(_fpath)
+        study = Premise.openfile(_fpath, lazy=True)
+        self.assertIsInstance(study.data["params"]["profile"]["value"], np.ndarray)
+
+
+class JSONTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.study = pipe_study(2)
+        self.study.add_param("profile", np.linspace(0, 1, 1000, dtype=np.float32))
+        self.study.add_param("kp", np.arange(3))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_arrays(self):
+        _fpath = os.path.join(self.tmpdir.name, "study.json")
+        self.assertTrue(self.study.to_json(_fpath, array_threshold=1000))
+        self.assertEqual(len(os.listdir(_fpath + ".sidecar")), 1)
+        study = Premise.from_json(_fpath)
+        self.assertIsInstance(study.profile, np.memmap)
+        self.assertEqual(study.profile.dtype, np.float32)
+        np.testing.assert_array_equal(study.profile, self.study.profile)
+        self.assertIsInstance(study.kp, np.ndarray)
+        self.assertEqual(list(study.kp), [0, 1, 2])
+        _calc = study.get_child_by_name("LoadCase1").childs[0]
+        self.assertEqual(_calc._nodeid, 
+                    self.study.get_child_by_name("LoadCase1").childs[0]._nodeid)
+        self.assertEqual(_calc._pipe_hoop_stress, 11 * 10**5 * 0.11 / 2 / 0.005)
+
+    def test_string(self):
+        study = Premise.from_json(self.study.to_json())
+        self.assertEqual(study.profile.dtype, np.float32)
+        self.assertEqual(len(study.profile), 1000)
+
+    def test_serializers(self):
+        _names = sorted(serializers.SERIALIZERS)
+        for _dumps in _names:
+            _json = self.study.to_json(serializer=_dumps)
+            for _loads in _names:
+                study = Premise.from_json(_json, serializer=_loads)
+                self.assertEqual(study.profile.dtype, np.float32)
+                self.assertEqual(study.kp.dtype, self.study.kp.dtype)
+                self.assertEqual(study.get_child_by_name("LoadCase1").P, 11 * 10**5)
+                _obj = serializers.get_serializer(_loads).loads(
+                        serializers.get_serializer(_dumps).dumps(
+                            {"x": [_empty, np.float32(1.5)]}, _PflacsDefault()), 
+                        as_pflacs)
+                self.assertEqual(_obj, {"x": [_empty, 1.5]})
+        with self.assertRaises(ValueError):
+            serializers.get_serializer("no such serializer")
+
+    def test_nonfinite(self):
+        self.study.add_param("nan", float("nan"))
+        self.study.add_param("limits", [float("-inf"), 1.0, float("inf")])
+        self.study.add_param("eps", np.float32("nan"))
+        self.study.add_param("profile", np.array([1.0, np.nan, -np.inf]))
+        _calc = self.study.childs[0].childs[0]
+        _calc._internals["_pipe_hoop_stress"] = float("inf")
+        _names = sorted(serializers.SERIALIZERS)
+        for _dumps in _names:
+            _json = self.study.to_json(serializer=_dumps)
+            for _loads in _names:
+                study = Premise.from_json(_json, serializer=_loads)
+                self.assertTrue(np.isnan(study.nan))
+                self.assertEqual(study.limits, [float("-inf"), 1.0, float("inf")])
+                self.assertTrue(np.isnan(study.eps))
+                np.testing.assert_array_equal(study.profile, [1.0, np.nan, -np.inf])
+                self.assertEqual(study.childs[0].childs[0]._internals["_pipe_hoop_stress"],
+                                float("inf"))
+        self.assertEqual(serializers.encode_nonfinite({"x": [1.0, "a"]}),
+                        {"x": [1.0, "a"]})
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "study.vn3")
+        self.study = pipe_study(3)
+        self.assertTrue(self.study.savefile(self.fpath))
+        self.jpath = self.fpath + ".journal"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_incremental(self):
+        _size = os.path.getsize(self.fpath)
+        _lc = self.study.get_child_by_name("LoadCase1")
+        _lc.P = 50 * 10**5
+        _lc.childs[0]()
+        self.assertEqual(self.study._tcache.dirty, {_lc, _lc.childs[0]})
+        self.assertTrue(self.study.savefile(incremental=True))
+        self.assertTrue(os.path.isfile(self.jpath))
+        self.assertEqual(os.path.getsize(self.fpath), _size)
+        self.assertFalse(self.study._tcache.dirty)
+        self.study.get_child_by_name("LoadCase2").P = 60 * 10**5
+        self.assertTrue(self.study.savefile(incremental=True))
+        study = Premise.openfile(self.fpath)
+        self.assertEqual(study.get_child_by_name("LoadCase1").P, 50 * 10**5)
+        self.assertEqual(study.get_child_by_name("LoadCase1").childs[0]._pipe_hoop_stress,
+                        _lc.childs[0]._pipe_hoop_stress)
+        self.assertEqual(study.get_child_by_name("LoadCase2").P, 60 * 10**5)
+        self.assertEqual(study.get_child_by_name("LoadCase0").P, 10 * 10**5)
+        self.assertFalse(study._tcache.dirty)
+
+    def test_compaction(self):
+        self.study.get_child_by_name("LoadCase1").P = 50 * 10**5
+        self.study.savefile(incremental=True)
+        # adding a node saves the whole tree
+        Premise("LoadCase3", self.study, parameters={"P": 13 * 10**5})
+        self.study.savefile(incremental=True)
+        self.assertFalse(os.path.isfile(self.jpath))
+        study = Premise.openfile(self.fpath)
+        self.assertEqual(len(study.childs), 4)
+        self.assertEqual(study.get_child_by_name("LoadCase1").P, 50 * 10**5)
+
+    def test_stale_journal(self):
+        self.study.get_child_by_name("LoadCase1").P = 50 * 10**5
+        self.study.savefile(incremental=True)
+        with open(self.jpath, "rb") as _fh:
+            _journal = _fh.read()
+        self.study.get_child_by_name("LoadCase1").P = 70 * 10**5
+        self.study.savefile()
+        with open(self.jpath, "wb") as _fh:
+            _fh.write(_journal + b"truncated record")
+        with self.assertLogs("pflacs.pflacs", level="WARNING"):
+            study = Premise.openfile(self.fpath)
+        self.assertEqual(study.get_child_by_name("LoadCase1").P, 70 * 10**5)
+
+
+class AdoptTests(unittest.TestCase):
+
+    def test_adopt_treedict(self):
+        study = pipe_study(3)
+        _treedict = pickle.loads(pickle.dumps(study.to_treedict()))
+        with _adopting():
+            tree = Premise(treedict=_treedict)
+        self.assertIs(tree.data, _treedict["data"])
+        _lc = tree.get_child_by_name("LoadCase2")
+        self.assertIs(_lc.data, _treedict["childs"][2]["data"])
+        self.assertEqual(_lc.P, 12 * 10**5)
+        self.assertEqual(_lc.D, study.D)
+        self.assertIs(tree.get_node_by_id(_lc._nodeid), _lc)
+        _lc.P = 50 * 10**5
+        _calc = _lc.childs[0]
+        self.assertTrue(_calc._is_stale())
+        _calc()
+        self.assertEqual(_calc._pipe_hoop_stress, 50 * 10**5 * study.D / 2 / study.t)
+        # without _adopting the treedict is copied
+        tree = Premise(treedict=_treedict)
+        self.assertIsNot(tree.data["params"], _treedict["data"]["params"])
+
+
+@unittest.skipIf(export.pa is None, "pyarrow not installed")
+class ExportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.study = pipe_study()
+        _lc = self.study.get_child_by_name("LoadCase4")
+        _lc.P = np.linspace(10, 20, 5) * 10**5
+        _lc.childs[0]()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_parquet(self):
+        from pyarrow import parquet
+        _fpath = os.path.join(self.tmpdir.name, "results.parquet")
+        self.assertEqual(self.study.export_results(_fpath, batch_size=2), 5)
+        self.assertEqual(parquet.ParquetFile(_fpath).num_row_groups, 3)
+        _df = parquet.read_table(_fpath).to_pandas()
+        _calcs = [_n for _n in self.study if type(_n) is Calc]
+        self.assertEqual(list(_df["path"]), [_n._path for _n in _calcs])
+        self.assertEqual(list(_df["class"]), ["Calc"] * 5)
+        self.assertEqual(list(_df["D"]), [self.study.D] * 5)
+        self.assertEqual(_df["P"][1], [11 * 10**5])
+        np.testing.assert_allclose(_df["_pipe_hoop_stress"][4], 
+                                    _calcs[4]._pipe_hoop_stress)
+
+    def test_arrow(self):
+        import pyarrow
+        _fpath = os.path.join(self.tmpdir.name, "results.arrow")
+        self.study.get_child_by_name("LoadCase1").add_param("note", "a note")
+        self.assertEqual(self.study.export_results(_fpath, format="arrow"), 5)
+        _table = pyarrow.ipc.open_file(_fpath).read_all()
+        self.assertEqual(_table.column("note").to_pylist(), [None, "a note", None, None, None])
+        with self.assertRaises(ValueError):
+            self.study.export_results(_fpath, format="csv")
+
+    def test_names_and_lazy(self):
+        from pyarrow import parquet
+        self.study.get_child_by_name("LoadCase2").add_param("path", "route A")
+        _spath = os.path.join(self.tmpdir.name, "study.vn3")
+        self.assertTrue(self.study.savefile(_spath, sidecar_threshold=16))
+        study = Premise.openfile(_spath, lazy=True)
+        _fpath = os.path.join(self.tmpdir.name, "results.parquet")
+        self.assertEqual(study.export_results(_fpath), 5)
+        _table = parquet.read_table(_fpath)
+        _df = _table.to_pandas()
+        self.assertEqual(list(_df["path"]), [_n._path for _n in study if type(_n) is Calc])
+        self.assertEqual(_table.column("param.path").to_pylist(), [None, None, "route A", None, None])
+        # the sidecar values are not kept in the tree
+        _lc = study.get_child_by_name("LoadCase4")
+        self.assertIsInstance(_lc.data["params"]["P"]["value"], SidecarRef)
+        np.testing.assert_allclose(_df["P"][4], _lc.P)
+
+
+class SqliteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "study.vn4")
+        self.study = pipe_study()
+        self.assertTrue(self.study.savefile(self.fpath))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_open(self):
+        study = Premise.openfile(self.fpath)
+        self.assertEqual([_n.name for _n in study], [_n.name for _n in self.study])
+        _lc = study.get_child_by_name("LoadCase3")
+        self.assertEqual(_lc.P, 13 * 10**5)
+        self.assertEqual(_lc.D, self.study.D)
+        _calc = _lc.childs[0]
+        self.assertIs(type(_calc), Calc)
+        self.assertEqual(_calc._pipe_hoop_stress, 
+                        self.study.get_child_by_name("LoadCase3").childs[0]._pipe_hoop_stress)
+        _lc.P = 50 * 10**5
+        _calc()
+        self.assertEqual(_calc._pipe_hoop_stress, 50 * 10**5 * study.D / 2 / study.t)
+
+    def test_incremental(self):
+        self.study.get_child_by_name("LoadCase1").P = 50 * 10**5
+        self.assertTrue(self.study.savefile(incremental=True))
+        study = Premise.openfile(self.fpath)
+        self.assertEqual(study.get_child_by_name("LoadCase1").P, 50 * 10**5)
+        self.assertEqual(len(list(study)), len(list(self.study)))
+
+    def test_params_and_select(self):
+        _lc = self.study.get_child_by_name("LoadCase2")
+        _calc = _lc.childs[0]
+        with SqliteStore(self.fpath) as _store:
+            self.assertEqual(_store.get_param(_calc._nodeid, "P"), 12 * 10**5)
+            self.assertEqual(_store.get_param(_calc._nodeid, "D"), self.study.D)
+            with self.assertRaises(KeyError):
+                _store.get_param(_calc._nodeid, "D", inherit=False)
+            _store.set_param(_lc._nodeid, "P", 30 * 10**5)
+            self.assertEqual(_store.get_param(_calc._nodeid, "P"), 30 * 10**5)
+            _limit = self.study.get_child_by_name("LoadCase2").childs[0]._pipe_hoop_stress
+            _rows = _store.select("_pipe_hoop_stress", ">", _limit)
+            self.assertEqual(len(_rows), 2)
+            self.assertEqual(len(_store.select("P", ">=", 13 * 10**5, table="params")), 4)
+            with self.assertRaises(ValueError):
+                _store.select("P", "; DROP TABLE nodes", 0)
+
+    def test_concurrent_branches(self):
+        _calcids = [_n._nodeid for _n in self.study if type(_n) is Calc]
+        with SqliteStore(self.fpath) as _store:
+            for _nodeid in _calcids:
+                _store.set_param(_nodeid, "t", 10 * 10**-3)
+
+        def _worker(nodeid):
+            with SqliteStore(self.fpath) as _store:
+                _branch = _store.open_branch(nodeid)
+                _branch()
+                _store.write_results(_branch)
+
+        _threads = [threading.Thread(target=_worker, args=(_nid,)) for _nid in _calcids]
+        for _th in _threads:
+            _th.start()
+        for _th in _threads:
+            _th.join()
+        study = Premise.openfile(self.fpath)
+        for _calc in (_n for _n in study if type(_n) is Calc):
+            self.assertEqual(_calc._pipe_hoop_stress, _calc.P * _calc.D / 2 / _calc.t)
+            self.assertEqual(_calc.t, 10 * 10**-3)
+
+
+if __name__ == '__main__':
+    unittest.main()
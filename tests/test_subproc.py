@@ -0,0 +1,223 @@
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+
+from pflacs import Premise, SubProc
+from pflacs.runcache import RunCache
+
+
+def python_cmd(code):
+    return [sys.executable, "-c", code]
+
+
+class RunAllTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Premise("root")
+        for ii in range(6):
+            SubProc("job{}".format(ii), self.root,
+                    cmd=python_cmd("print({})".format(ii)))
+
+    def test_run_all(self):
+        _summary = SubProc.run_all(self.root, workers=3)
+        self.assertEqual(_summary["nodes"], 6)
+        self.assertEqual(len(_summary["ok"]), 6)
+        self.assertGreater(_summary["wall"], 0)
+        for ii, _n in enumerate(self.root.childs):
+            self.assertEqual(_n._stdout.strip(), str(ii))
+            self.assertEqual(_n._returncode, 0)
+            self.assertLessEqual(_n._timestamp[0], _n._timestamp[1])
+
+    def test_cancel_on_failure(self):
+        SubProc("bad", self.root, cmd=python_cmd("import sys; sys.exit(3)"))
+        SubProc("slow", self.root, cmd=python_cmd("import time; time.sleep(30)"))
+        with self.assertLogs("pflacs.subprocess_node", level="ERROR"):
+            _summary = SubProc.run_all(self.root, workers=8)
+        self.assertEqual(_summary["failed"], ["/root/bad"])
+        # jobs still running at the failure are cancelled too
+        self.assertIn("/root/slow", _summary["cancelled"])
+        self.assertLess(_summary["wall"], 20)
+
+    def test_timeout(self):
+        _slow = SubProc("slow", self.root, cmd=python_cmd("import time; time.sleep(30)"))
+        with self.assertLogs("pflacs.subprocess_node", level="ERROR"):
+            _summary = SubProc.run_all(self.root, timeout=0.5, cancel_on_failure=False)
+        self.assertEqual(_summary["timeout"], ["/root/slow"])
+        self.assertEqual(len(_summary["ok"]), 6)
+        self.assertNotEqual(_slow._returncode, 0)
+
+    def test_node_timeout(self):
+        _hung = SubProc("hung", self.root, cmd=python_cmd("import time; time.sleep(30)"),
+                        timeout=0.5)
+        with self.assertLogs("pflacs.subprocess_node", level="ERROR"):
+            _summary = SubProc.run_all(self.root, timeout=20, cancel_on_failure=False)
+        self.assertEqual(_summary["timeout"], ["/root/hung"])
+        self.assertEqual(len(_summary["ok"]), 6)
+        self.assertLess(_summary["wall"], 10)
+        self.assertNotEqual(_hung._returncode, 0)
+        self.assertEqual(SubProc(treedict=_hung.to_treedict())._timeout, 0.5)
+
+    def test_call(self):
+        _node = SubProc("missing", self.root, cmd=["/nonexistent/command"])
+        with self.assertLogs("pflacs.subprocess_node", level="ERROR"):
+            _node()
+        self.assertIsNone(_node._returncode)
+        self.assertTrue(_node._stderr)
+
+
+class OutputTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Premise("root")
+        self.code = ("import sys\n"
+                    "for ii in range(1000):\n"
+                    "    print('iteration', ii, 'residual', 1.0 / (ii + 1))\n"
+                    "print('max stress = 123.5')\n"
+                    "print('warning', file=sys.stderr)\n")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_logfiles_and_tail(self):
+        _node = SubProc("solver", self.root, cmd=python_cmd(self.code),
+                        logdir=self.tmpdir.name, compress=True, tail=5)
+        _node()
+        self.assertEqual(len(_node._stdout.splitlines()), 5)
+        self.assertEqual(_node._stdout.splitlines()[-1], "max stress = 123.5")
+        self.assertEqual(_node._stderr, "warning\n")
+        with gzip.open(_node._logfiles["stdout"], "rt") as _fh:
+            self.assertEqual(len(_fh.readlines()), 1001)
+
+    def test_extract_and_callback(self):
+        _node = SubProc("solver", self.root, cmd=python_cmd(self.code), logdir=False,
+                        extract={"max_stress": r"max stress = (\S+)",
+                                "iterations": r"^iteration (\d+)"})
+        _lines = []
+        _node.on_line(lambda node, stream, line: _lines.append((stream, line)))
+        _node()
+        self.assertIsNone(_node._logfiles)
+        # no log file: the full output is kept
+        self.assertEqual(len(_node._stdout.splitlines()), 1001)
+        self.assertEqual(_node.max_stress, 123.5)
+        self.assertEqual(_node.iterations, 999)
+        self.assertEqual(len(_lines), 1002)
+        self.assertIn(("stderr", "warning\n"), _lines)
+
+    def test_shell(self):
+        _node = SubProc("shell", self.root, cmd="echo $((6 * 7))", shell=True)
+        _node()
+        self.assertEqual(_node._stdout, "42\n")
+        self.assertTrue(SubProc(treedict=_node.to_treedict())._shell)
+
+    def test_study_logdir(self):
+        _node = SubProc("solver", self.root, cmd=python_cmd("print('ok')"))
+        _fpath = os.path.join(self.tmpdir.name, "study.vn3")
+        self.root.savefile(_fpath)
+        _node()
+        self.assertEqual(os.path.dirname(_node._logfiles["stdout"]), _fpath + ".logs")
+        self.root.savefile()
+        _study = Premise.openfile(_fpath)
+        self.assertEqual(_study.childs[0]._stdout, "ok\n")
+
+
+class RunCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dpath = self.tmpdir.name
+        self.input = os.path.join(self.dpath, "model.inp")
+        self.output = os.path.join(self.dpath, "model.out")
+        self.counter = os.path.join(self.dpath, "runs.txt")
+        with open(self.input, "w") as _fh:
+            _fh.write("pressure 10\n")
+        _code = ("import sys\n"
+                "open(sys.argv[3], 'a').write('run\\n')\n"
+                "data = open(sys.argv[1]).read()\n"
+                "open(sys.argv[2], 'w').write(data.upper())\n"
+                "print('result =', len(data))\n"
+                "print('runs =', len(open(sys.argv[3]).readlines()))\n")
+        self.root = Premise("root", parameters={"P": 10})
+        self.node = SubProc("solver", self.root,
+                    cmd=python_cmd(_code) + [self.input, self.output, self.counter],
+                    inputs=[self.input], outputs=[self.output],
+                    extract={"result": r"result = (\d+)", "runs": r"runs = (\d+)"},
+                    logdir=os.path.join(self.dpath, "logs"),
+                    cache=os.path.join(self.dpath, "cache"))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def runs(self):
+        with open(self.counter) as _fh:
+            return len(_fh.readlines())
+
+    def test_cached_run(self):
+        self.node()
+        _key = self.node._cachekey
+        self.assertTrue(_key)
+        os.remove(self.output)
+        os.remove(self.node._logfiles["stdout"])
+        self.node.result = 0
+        self.node()
+        self.assertEqual(self.runs(), 1)
+        self.assertEqual(self.node._cachekey, _key)
+        self.assertEqual(self.node.result, 12)
+        with open(self.output) as _fh:
+            self.assertEqual(_fh.read(), "PRESSURE 10\n")
+        with open(self.node._logfiles["stdout"]) as _fh:
+            self.assertEqual(_fh.read(), "result = 12\nruns = 1\n")
+        # a forced run replaces the cached run
+        self.node(force=True)
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual(self.node.runs, 2)
+        self.node.runs = 0
+        self.node()
+        self.assertEqual(self.runs(), 2)
+        self.assertEqual(self.node.runs, 2)
+
+    def test_replace(self):
+        _cache = RunCache(os.path.join(self.dpath, "replace"))
+        self.assertTrue(_cache.put("k", {"v": 1}, {}))
+        self.assertFalse(_cache.put("k", {"v": 2}, {}))
+        self.assertEqual(_cache.get("k")["v"], 1)
+        self.assertTrue(_cache.put("k", {"v": 2}, {}, replace=True))
+        self.assertEqual(_cache.get("k")["v"], 2)
+        self.assertEqual([_e[2] for _e in _cache.entries()], ["k"])
+
+    def test_key(self):
+        self.node()
+        # changed input file
+        with open(self.input, "w") as _fh:
+            _fh.write("pressure 20\n")
+        self.node()
+        self.assertEqual(self.runs(), 2)
+        # changed parameter
+        self.root.P = 20
+        _summary = SubProc.run_all(self.root)
+        self.assertEqual(_summary["ok"], ["/root/solver"])
+        _summary = SubProc.run_all(self.root)
+        self.assertEqual(_summary["cached"], ["/root/solver"])
+        self.assertEqual(self.runs(), 3)
+
+    def test_eviction(self):
+        _cache = RunCache(os.path.join(self.dpath, "lru"))
+        for _key in ("a", "b", "c"):
+            _fpath = os.path.join(self.dpath, _key)
+            with open(_fpath, "w") as _fh:
+                _fh.write("x" * 10)
+            _cache.put(_key, {}, {"output0": _fpath})
+            if _key == "a":
+                # room for two runs
+                _cache.max_bytes = 2 * _cache.entries()[0][1]
+            if _key == "b":
+                self.assertIsNotNone(_cache.get("a"))
+        self.assertIsNotNone(_cache.get("a"))
+        self.assertIsNone(_cache.get("b"))
+        self.assertIsNotNone(_cache.get("c"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import math
+import unittest
+
+import numpy as np
+
+from pflacs import Premise, SweepCalc
+from pflacs import sweep as designs
+
+from studies import pipe_hoop_stress
+
+
+def scalar_only(P, t):
+    if P > 15 * 10**5:
+        return math.sqrt(P) / t
+    return 0.0
+
+def stresses(P, D, t):
+    return {"hoop": P * D / 2 / t, "long": P * D / 4 / t}
+
+
+basecase = Premise("Pipe study base case.",
+                parameters={
+                    "D": 110 * 10**-3,
+                    "P": 20 * 10**5,
+                    "t": 5 * 10**-3,
+                })
+basecase.plugin_func(pipe_hoop_stress)
+basecase.plugin_func(scalar_only)
+basecase.plugin_func(stresses, argmap={"return": "{'hoop':'sigma_h'}"})
+
+P_list = [10 * 10**5, 20 * 10**5, 30 * 10**5]
+t_list = [4 * 10**-3, 5 * 10**-3]
+
+
+class SweepCalcTests(unittest.TestCase):
+
+    def test_vectorized(self):
+        sweep = SweepCalc("sweep", basecase, funcname="pipe_hoop_stress",
+                        sweep={"P": P_list, "t": t_list})
+        _result = sweep()
+        self.assertEqual(_result.shape, (6,))
+        np.testing.assert_allclose(sweep._pipe_hoop_stress, 
+                np.repeat(P_list, 2) * 110e-3 / 2 / np.tile(t_list, 3))
+        self.assertEqual(list(sweep.df.columns), ["P", "D", "t", "_pipe_hoop_stress"])
+        self.assertEqual(len(sweep.df), 6)
+        self.assertEqual(basecase.P, 20 * 10**5)
+
+    def test_scalar_fallback(self):
+        sweep = SweepCalc("sweep scalar", basecase, funcname="scalar_only",
+                        sweep={"P": P_list, "t": t_list}, chunksize=4)
+        _result = sweep()
+        _expected = [scalar_only(_P, _t) for _P in P_list for _t in t_list]
+        np.testing.assert_allclose(_result, _expected)
+
+    def test_dict_result_columns(self):
+        sweep = SweepCalc("sweep dict", basecase, funcname="stresses",
+                        sweep={"P": P_list, "t": [4e-3, 5e-3, 6e-3]}, 
+                        product=False)
+        sweep()
+        self.assertEqual(sorted(sweep._internals), ["long", "sigma_h"])
+        np.testing.assert_allclose(sweep.sigma_h, 2 * sweep.long)
+        self.assertEqual(len(sweep.df), 3)
+        with self.assertRaises(ValueError):
+            SweepCalc("bad", basecase, funcname="stresses",
+                    sweep={"P": P_list, "t": t_list}, product=False)()
+
+    def test_sweep_stored_once(self):
+        sweep = SweepCalc("sweep cols", basecase, funcname="pipe_hoop_stress",
+                        sweep={"P": P_list, "t": [4e-3, 5e-3, 6e-3], "D": [0.1] * 3}, 
+                        product=False)
+        sweep()
+        self.assertIsInstance(sweep._sweep["P"], np.ndarray)
+        self.assertIs(sweep._arguments["P"], sweep._sweep["P"])
+        _td = sweep.to_treedict(recursive=False)
+        self.assertEqual(_td["data"]["_arguments"], {})
+        self.assertIn("P", sweep._arguments)
+        _copy = SweepCalc(treedict=_td)
+        np.testing.assert_array_equal(_copy._arguments["t"], [4e-3, 5e-3, 6e-3])
+        np.testing.assert_allclose(_copy.df["_pipe_hoop_stress"], sweep._pipe_hoop_stress)
+
+    def test_empty_sweep(self):
+        _nchilds = len(basecase.childs)
+        with self.assertRaises(ValueError):
+            SweepCalc("empty", basecase, funcname="pipe_hoop_stress",
+                    sweep={"P": P_list, "t": []})
+        with self.assertRaises(ValueError):
+            SweepCalc("chunks", basecase, funcname="pipe_hoop_stress",
+                    sweep={"P": P_list}, chunksize=0)
+        self.assertEqual(len(basecase.childs), _nchilds)
+
+    def test_update(self):
+        tree = Premise("root", parameters={"D": 0.1, "P": 1, "t": 0.01})
+        tree.plugin_func(pipe_hoop_stress)
+        sweep = SweepCalc("sweep", tree, funcname="pipe_hoop_stress",
+                        sweep={"P": P_list})
+        tree.update()
+        self.assertEqual(len(sweep._pipe_hoop_stress), 3)
+
+
+class DesignTests(unittest.TestCase):
+
+    def test_full_factorial(self):
+        _cols = designs.full_factorial({"P": P_list, "t": t_list})
+        np.testing.assert_allclose(_cols["P"], np.repeat(P_list, 2))
+        np.testing.assert_allclose(_cols["t"], np.tile(t_list, 3))
+
+    def test_one_at_a_time(self):
+        _df = designs.one_at_a_time({"P": 10, "t": 0.005}, 
+                        {"P": [20, 30], "t": [0.004]}, dataframe=True)
+        self.assertEqual(len(_df), 4)
+        self.assertEqual(list(_df["P"]), [10, 20, 30, 10])
+        self.assertEqual(list(_df["t"]), [0.005, 0.005, 0.005, 0.004])
+        with self.assertRaises(ValueError):
+            designs.one_at_a_time({"P": 10}, {"P": [20], "t": [0.004]})
+
+    def test_space_filling(self):
+        _bounds = {"P": (10, 30), "t": (0.004, 0.006)}
+        for _cols in (designs.latin_hypercube(_bounds, 8, seed=1), 
+                      designs.halton(_bounds, 8)):
+            for _name, (_low, _high) in _bounds.items():
+                self.assertEqual(len(_cols[_name]), 8)
+                self.assertTrue(np.all((_cols[_name] >= _low) & (_cols[_name] <= _high)))
+        # one sample in each interval
+        _lhs = designs.latin_hypercube({"x": (0, 1)}, 10, seed=2)
+        self.assertEqual(sorted(np.floor(_lhs["x"] * 10)), list(range(10)))
+        np.testing.assert_allclose(designs.halton({"x": (0, 1)}, 3)["x"], [0.5, 0.25, 0.75])
+
+    @unittest.skipIf(designs.qmc is None, "scipy not installed")
+    def test_sobol(self):
+        _cols = designs.sobol({"P": (10, 30)}, 8, seed=1)
+        self.assertEqual(len(_cols["P"]), 8)
+
+    def test_run_design(self):
+        tree = Premise("root", parameters={"D": 0.1, "P": 1, "t": 0.01})
+        tree.plugin_func(pipe_hoop_stress)
+        _design = designs.halton({"P": (10, 30), "t": (0.004, 0.006)}, 16, dataframe=True)
+        _node = tree.run_design(_design, "pipe_hoop_stress")
+        self.assertIsInstance(_node, SweepCalc)
+        self.assertIs(_node.parent, tree)
+        np.testing.assert_allclose(_node._pipe_hoop_stress, 
+                        _design["P"] * 0.1 / 2 / _design["t"])
+        self.assertEqual(len(_node.df), 16)
+
+
+class ChunkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lists = ([1.5, 2.5, 3.5], ["a", "b"], [10, 20, 30, 40])
+
+    def test_chunks(self):
+        _sweep = designs.param_sweep(*self.lists)
+        self.assertEqual(designs.param_sweep_size(*self.lists), 24)
+        _chunks = list(designs.param_sweep_chunks(*self.lists, chunksize=5))
+        self.assertEqual([len(_c[0]) for _c in _chunks], [5, 5, 5, 5, 4])
+        for _col, _expected in zip(zip(*_chunks), _sweep):
+            np.testing.assert_array_equal(np.concatenate(_col), _expected)
+        # a chunk can be created directly, or by a worker of a pool
+        _chunk = designs.param_sweep_chunk(3, *self.lists, chunksize=5)
+        for _col, _expected in zip(_chunk, _sweep):
+            np.testing.assert_array_equal(_col, _expected[15:20])
+        _shares = list(designs.param_sweep_chunks(*self.lists, chunksize=5, start=1, step=2))
+        self.assertEqual(len(_shares), 2)
+        np.testing.assert_array_equal(_shares[1][2], _sweep[2][15:20])
+
+    def test_record(self):
+        _names = ["P", "name", "n"]
+        _rec = designs.param_sweep(*self.lists, record=True, names=_names)
+        self.assertEqual(_rec.dtype["P"], np.dtype(float))
+        self.assertEqual(_rec.dtype["name"].kind, "U")
+        self.assertEqual(_rec.dtype["n"].kind, "i")
+        _chunk = designs.param_sweep_chunk(1, *self.lists, chunksize=10, 
+                                        record=True, names=_names)
+        self.assertEqual(_chunk.dtype, _rec.dtype)
+        np.testing.assert_array_equal(_chunk, _rec[10:20])
+
+    def test_errors(self):
+        for _k in (-1, 5):
+            with self.assertRaises(IndexError):
+                designs.param_sweep_chunk(_k, *self.lists, chunksize=5)
+        with self.assertRaises(ValueError):
+            designs.param_sweep([1, 2], [])
+        with self.assertRaises(ValueError):
+            designs.param_sweep_chunk(0, [1, 2], [])
+        with self.assertRaises(ValueError):
+            list(designs.param_sweep_chunks([], chunksize=5))
+        self.assertEqual(designs.param_sweep_size([1, 2], []), 0)
+        for _size in (0, -5):
+            with self.assertRaises(ValueError):
+                designs.param_sweep_chunk(0, *self.lists, chunksize=_size)
+            with self.assertRaises(ValueError):
+                list(designs.param_sweep_chunks(*self.lists, chunksize=_size))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,342 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from pflacs import Premise, Calc, Table, CalcGraph, PyFunc, SweepCalc
+from pflacs import hashing
+from pflacs.memo import MemoCache
+
+from studies import pipe_study
+
+
+def results(tree):
+    return [(_n._path, _n._arguments, _n._internals) 
+            for _n in tree if type(_n) is Calc]
+
+
+class ParallelUpdateTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.serial = pipe_study()
+        cls.serial.update()
+
+    def check(self, tree):
+        self.assertEqual(results(tree), results(self.serial))
+        for _n in tree:
+            if type(_n) is Calc:
+                self.assertTrue(_n._internals)
+            if type(_n) is Table:
+                self.assertEqual(len(_n.df), 1)
+                self.assertEqual(_n.df["_allowable_stress_unity_check"][0],
+                        _n._allowable_stress_unity_check)
+
+    def test_branches(self):
+        tree = pipe_study(3)
+        self.assertEqual([_b.name for _b in tree._calc_branches()],
+                         ["Calc pipe stress"] * 3)
+
+    def test_thread_update(self):
+        tree = pipe_study()
+        tree.update(workers=4, executor="thread")
+        self.check(tree)
+
+    def test_process_update(self):
+        tree = pipe_study()
+        tree.update(workers=2, executor="process")
+        self.check(tree)
+
+    def test_lazy_process_update(self):
+        tree = pipe_study(4)
+        tree.D = np.full(500, 110 * 10**-3)
+        tree.childs[1].t = np.full(500, 5 * 10**-3)
+        with tempfile.TemporaryDirectory() as _dpath:
+            _fpath = os.path.join(_dpath, "study.vn3")
+            tree.savefile(_fpath, sidecar_threshold=1000)
+            study = Premise.openfile(_fpath, lazy=True)
+            study.update(workers=2, executor="process")
+        tree.update()
+        for _n, _expected in zip([_n for _n in study if type(_n) is Calc],
+                                [_n for _n in tree if type(_n) is Calc]):
+            self.assertEqual(_n._path, _expected._path)
+            np.testing.assert_allclose(list(_n._internals.values())[0],
+                                    list(_expected._internals.values())[0])
+
+    def test_linked_branch_deferred(self):
+        tree = pipe_study(2)
+        _lc0, _lc1 = tree.childs
+        del _lc1.P
+        _lc1.add_param("P", linkid=_lc0._nodeid)
+        self.assertTrue(_lc1.childs[0]._has_external_links())
+        self.assertFalse(_lc0.childs[0]._has_external_links())
+        tree.update(workers=2, executor="process")
+        self.assertEqual(_lc1.childs[0]._internals, _lc0.childs[0]._internals)
+
+    def test_bad_executor(self):
+        with self.assertRaises(ValueError):
+            pipe_study(2).update(workers=2, executor="cluster")
+
+
+class IncrementalUpdateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = pipe_study(5)
+        self.tree.update()
+        self.count_calls()
+
+    def count_calls(self):
+        self.ncalls = 0
+        _pfunc = Premise.__dict__["pipe_hoop_stress"]
+        _func = _pfunc._func
+        def counted(*args, **kwargs):
+            self.ncalls += 1
+            return _func(*args, **kwargs)
+        _pfunc._func = counted
+        self.addCleanup(setattr, _pfunc, "_func", _func)
+
+    def stale(self):
+        return [_n for _n in self.tree if isinstance(_n, Calc) and _n._is_stale()]
+
+    def test_nothing_stale(self):
+        self.assertEqual(self.stale(), [])
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 0)
+
+    def test_param_change(self):
+        _lc = self.tree.childs[2]
+        _lc.P = 50 * 10**5
+        _stale = self.stale()
+        self.assertEqual(_stale, [_lc.childs[0], _lc.childs[0].childs[0].childs[0]])
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 1)
+        self.assertEqual(self.stale(), [])
+        _unity = _lc.childs[0].childs[0]
+        self.assertAlmostEqual(_unity._allowable_stress_unity_check,
+                    50e5 * 110e-3 / 2 / 5e-3 / 22.1e6 * 0.8)
+        self.assertAlmostEqual(_unity.childs[0].df["P"][0], 50e5)
+
+    def test_reopened(self):
+        with tempfile.TemporaryDirectory() as _dname:
+            for _ext in (".vn3", ".vn4", ".json"):
+                _fpath = os.path.join(_dname, "study" + _ext)
+                if _ext == ".json":
+                    self.tree.to_json(_fpath)
+                    self.tree = Premise.from_json(_fpath)
+                else:
+                    self.tree.savefile(_fpath)
+                    self.tree = Premise.openfile(_fpath)
+                self.assertEqual(self.stale(), [])
+                _lc = self.tree.childs[0]
+                _lc.P = _lc.P + 10**5
+                self.assertEqual(self.stale(), [_lc.childs[0], _lc.childs[0].childs[0].childs[0]])
+                # the plugins are plugged in again by opening the file
+                self.count_calls()
+                self.tree.update(incremental=True)
+                self.assertEqual(self.ncalls, 1)
+                self.assertEqual(self.stale(), [])
+
+    def test_root_param_change(self):
+        self.tree.ys = 30 * 10**6
+        self.assertEqual(len(self.stale()), 5)
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 0)
+        self.assertEqual(self.stale(), [])
+
+    def test_new_and_copied_nodes(self):
+        _lc = self.tree.add_child(self.tree.childs[0].copy())
+        _lc.P = 1
+        Calc("extra", _lc, funcname="pipe_hoop_stress")
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 2)
+        self.assertEqual(self.stale(), [])
+
+    def test_linked_param_change(self):
+        _lc0, _lc1 = self.tree.childs[:2]
+        del _lc1.P
+        _lc1.add_param("P", linkid=_lc0._nodeid)
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 1)
+        _lc0.P = 1
+        self.tree.update(incremental=True)
+        self.assertEqual(self.ncalls, 3)
+        self.assertEqual(_lc1.childs[0]._internals, _lc0.childs[0]._internals)
+
+
+class CalcGraphTests(unittest.TestCase):
+
+    def test_adjacency(self):
+        tree = pipe_study(2)
+        _adj = CalcGraph(tree).adjacency()
+        _lc = "/Pipe study base case./LoadCase0"
+        self.assertEqual(sorted(_adj[_lc + "/Calc pipe stress"]),
+                        [_lc + "/Calc pipe stress/Stress unity check",
+                         _lc + "/Calc pipe stress/Stress unity check/results"])
+        self.assertEqual(_adj[_lc + "/Calc pipe stress/Stress unity check"],
+                        [_lc + "/Calc pipe stress/Stress unity check/results"])
+        self.assertEqual(len(_adj), 6)
+
+    def test_linked_dependency(self):
+        tree = pipe_study(2)
+        _pstress = tree.childs[0].childs[0]
+        _summary = Premise("summary", tree)
+        _summary.add_param("_pipe_hoop_stress", linkid=_pstress._nodeid)
+        _table = Table("summary table", _summary, paranames=["_pipe_hoop_stress"])
+        _graph = CalcGraph(tree)
+        self.assertIn(_table, _graph.edges[_pstress])
+        self.assertEqual(len(_graph.levels()), 3)
+
+    def test_run(self):
+        tree = pipe_study()
+        _graph = CalcGraph(tree)
+        _graph.run(workers=8)
+        _serial = pipe_study()
+        _serial.update()
+        self.assertEqual(results(tree), results(_serial))
+        self.assertEqual(len(_graph.durations), 60)
+        _path, _total = _graph.critical_path()
+        self.assertEqual([type(_n) for _n in _path], [Calc, Calc, Table])
+        self.assertAlmostEqual(_total, sum(_graph.durations[_n] for _n in _path))
+
+
+class SelectTests(unittest.TestCase):
+
+    def setUp(self):
+        self.study = pipe_study(10)
+        self.study.update()
+
+    def test_where(self):
+        _calcs = self.study.select(cls=Calc, name="Calc pipe*", where="P >= 15e5")
+        self.assertEqual([_n.parent.name for _n in _calcs],
+                        ["LoadCase{}".format(ii) for ii in range(5, 10)])
+        # inherited values; the index is updated when a parameter is set
+        _lc = self.study.get_child_by_name("LoadCase2")
+        _lc.P = 40 * 10**5
+        _nodes = self.study.select(where=[("P", ">", 30e5), "design_factor == 0.8"])
+        self.assertEqual(_nodes, list(_lc))
+        self.study.P = 50 * 10**5
+        self.assertEqual(self.study.select(where="P > 45e5"), [self.study])
+        self.assertEqual(len(self.study.select(where=("P", "in", [11e5, 12e5]))), 
+                        len(list(self.study.get_child_by_name("LoadCase1"))))
+
+    def test_results(self):
+        _limit = 0.5
+        _nodes = self.study.select(results="_allowable_stress_unity_check > {}".format(_limit))
+        _expected = [_n for _n in self.study if type(_n) is Calc and 
+                        (_n._internals or {}).get("_allowable_stress_unity_check", 0) > _limit]
+        self.assertTrue(_expected)
+        self.assertEqual(_nodes, _expected)
+        _df = self.study.select(results="_allowable_stress_unity_check > {}".format(_limit),
+                                frame=True, columns=["P", "_allowable_stress_unity_check"])
+        self.assertEqual(list(_df["path"]), [_n._path for _n in _expected])
+        self.assertEqual(list(_df["P"]), [_n.P for _n in _expected])
+        with self.assertRaises(ValueError):
+            self.study.select(where="P ~ 1")
+
+    def test_results_reopened(self):
+        _query = "_allowable_stress_unity_check > 0.5"
+        _expected = [_n._path for _n in self.study.select(results=_query)]
+        _nrows = len(self.study.result_store)
+        with tempfile.TemporaryDirectory() as _dname:
+            self.study.savefile(os.path.join(_dname, "study.vn3"))
+            self.study.savefile(os.path.join(_dname, "study.vn4"))
+            self.study.to_json(os.path.join(_dname, "study.json"))
+            for _tree in (Premise.openfile(os.path.join(_dname, "study.vn3")),
+                        Premise.openfile(os.path.join(_dname, "study.vn3"), lazy=True),
+                        Premise.openfile(os.path.join(_dname, "study.vn4")),
+                        Premise.from_json(os.path.join(_dname, "study.json"))):
+                self.assertEqual([_n._path for _n in _tree.select(results=_query)], _expected)
+                self.assertEqual(len(_tree.result_store), _nrows)
+
+    def test_restructure(self):
+        self.assertEqual(len(self.study.select(cls=Table, where="P < 12e5")), 2)
+        self.study.remove_child(name="LoadCase0")
+        self.assertEqual(len(self.study.select(cls=Table, where="P < 12e5")), 1)
+
+
+CALLS = []
+
+def counted_stress(P, D, t):
+    CALLS.append(P)
+    return P * D / 2 / t
+
+
+class MemoizeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fpath = os.path.join(self.tmpdir.name, "study.vn3")
+        CALLS.clear()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sessions(self):
+        study = pipe_study(5)
+        study.savefile(self.fpath)
+        _memo = study.memoize()
+        study.update()
+        self.assertEqual(_memo.stats()["misses"], 10)
+        _memo.close()
+        study = Premise.openfile(self.fpath)
+        _memo = study.memoize()
+        study.update()
+        self.assertEqual((_memo.hits, _memo.misses), (10, 0))
+        _expected = pipe_study(5)
+        _expected.update()
+        self.assertEqual(results(study), results(_expected))
+        # a changed input is a miss
+        study.get_child_by_name("LoadCase2").P = 50 * 10**5
+        study.update()
+        self.assertEqual(_memo.misses, 2)
+        self.assertGreater(_memo.hits, 10)
+        study.memoize(False)
+        self.assertIsNone(study._tcache.memo)
+
+    def test_arrays_and_pyfunc(self):
+        root = Premise("root", parameters={"D": 0.1, "t": 0.01})
+        root.memoize(os.path.join(self.tmpdir.name, "cache.memo"), max_entries=2)
+        _pyfunc = PyFunc("stress", root, function=counted_stress,
+                        kwargs={"P": np.linspace(1, 2, 5), "D": 0.1, "t": 0.01})
+        _first = _pyfunc()
+        np.testing.assert_allclose(_pyfunc(), _first)
+        self.assertEqual(len(CALLS), 1)
+        _pyfunc(P=np.linspace(1, 2, 5) + 1)
+        self.assertEqual(len(CALLS), 2)
+        root.plugin_func(counted_stress)
+        _sweep = SweepCalc("sweep", root, funcname="counted_stress",
+                        sweep={"P": [1.0, 2.0, 3.0]})
+        _sweep()
+        _sweep()
+        self.assertEqual(len(CALLS), 3)
+        self.assertEqual(root._tcache.memo.stats()["entries"], 2)
+
+    def test_hits_are_reads(self):
+        _fpath = os.path.join(self.tmpdir.name, "cache.memo")
+        with MemoCache(_fpath, max_entries=2) as _memo:
+            _memo.put("a", "f", 1)
+            _memo.put("b", "f", 2)
+            _used = dict(_memo.conn.execute("SELECT key, used FROM memo"))
+            self.assertEqual(_memo.get("a"), (True, 1))
+            self.assertEqual(dict(_memo.conn.execute("SELECT key, used FROM memo")), _used)
+            # the hit is recorded before eviction, "b" is least recently used
+            _memo.put("c", "f", 3)
+            self.assertEqual(_memo.get("b"), (False, None))
+            self.assertEqual(_memo.get("a"), (True, 1))
+        with MemoCache(_fpath) as _memo:
+            self.assertEqual(_memo.stats()["entries"], 2)
+
+    def test_function_digest(self):
+        _code = ("def helper(x):\n    return x * {}\n"
+                "def func(x):\n    return helper(x) + func.__name__.count('f')\n")
+        _digests = []
+        for _factor in (2, 3):
+            _ns = {"__name__": "memo_test"}
+            exec(_code.format(_factor), _ns)
+            _digests.append(hashing.function_digest(_ns["func"]))
+        self.assertNotEqual(_digests[0], _digests[1])
+
+
+if __name__ == '__main__':
+    unittest.main()